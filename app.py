@@ -4,22 +4,32 @@ Hugging Face Spaces用Whisper発音解析API
 Gradioインターフェース + API機能
 """
 import gradio as gr
-import whisper
+from whisper_runtime import load_whisper_model
+import whisper_metrics
+import whisper_profiler
+import whisper_tracing
+from whisper_logging import get_logger
 import tempfile
 import os
 import json
 import difflib
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from idempotency import IDEMPOTENCY_HEADER, IdempotencyConflict, IdempotencyStore, fingerprint, valid_key
 
 # Whisperモデルをグローバルで読み込み（初回のみ）
 model = None
 
+log = get_logger("app")
+
+# 再送されたアップロード（同じIdempotency-Key）には保存済みの結果を返す
+idempotency_store = IdempotencyStore.from_env()
+
 def setup_whisper():
     """Whisperモデルをセットアップ"""
     global model
     if model is None:
         print("Whisper tinyモデルをロード中...")
-        model = whisper.load_model("tiny")
+        model = load_whisper_model("tiny")
         print("✅ Whisperモデル読み込み完了")
     return model
 
@@ -30,7 +40,7 @@ def transcribe_with_whisper(audio_file):
     model = setup_whisper()
     
     try:
-        print(f"🎤 音声ファイルを分析中: {audio_file}")
+        log.debug("🎤 音声ファイルを分析中: %s", audio_file)
         
         # 英語認識で実際の発音を取得
         result = model.transcribe(
@@ -44,21 +54,22 @@ def transcribe_with_whisper(audio_file):
         )
         
         raw_text = result["text"].strip()
-        print(f"📝 Whisper結果: '{raw_text}'", flush=True)
+        log.info("📝 Whisper結果: '%s'", raw_text, extra={"fields": {"event": "transcribed", "chars": len(raw_text)}})
         
         return raw_text
         
     except Exception as e:
-        print(f"❌ Whisper文字起こし失敗: {e}")
+        log.error("❌ Whisper文字起こし失敗: %s", e)
         raise e
 
+@whisper_metrics.timed("katakana")
 def convert_to_katakana_simple(text):
     """
     音韻ルールベースのカタカナ変換（任意の英単語に対応）
     """
-    print(f"🔤 カタカナ変換入力: '{text}'", flush=True)
+    log.debug("🔤 カタカナ変換入力: '%s'", text)
     if not text:
-        print("⚠️ 空のテキストです")
+        log.warning("⚠️ 空のテキストです")
         return "？？？"
     
     def convert_word_to_katakana(word):
@@ -113,7 +124,7 @@ def convert_to_katakana_simple(text):
     converted_words = [convert_word_to_katakana(word) for word in words]
     result = ' '.join(converted_words)
     
-    print(f"🎌 カタカナ変換結果: '{result}'")
+    log.info("🎌 カタカナ変換結果: '%s'", result, extra={"fields": {"event": "katakana"}})
     return result
 
 def process_pronunciation(audio_file) -> Dict[str, Any]:
@@ -140,17 +151,45 @@ def process_pronunciation(audio_file) -> Dict[str, Any]:
         }
         
     except Exception as e:
-        print(f"❌ 処理エラー: {e}")
+        log.exception("❌ 処理エラー: %s", e)
         return {
             "success": False,
             "error": str(e)
         }
 
-def process_pronunciation_gradio(audio_file):
+def process_pronunciation_idempotent(audio_file, idempotency_key: Optional[str]) -> Dict[str, Any]:
     """
-    Gradioインターフェース用の処理関数
+    冪等キー付きの発音解析（/api/predict の再送対策）
+    同じキー・同じ音声なら保存済みの結果を返し、成功した結果だけを保存する
     """
+    idempotency_key = valid_key(idempotency_key)
+    if not idempotency_key or audio_file is None:
+        return process_pronunciation(audio_file)
+
+    with open(audio_file, "rb") as f:
+        audio_fingerprint = fingerprint(f.read())
+    try:
+        stored = idempotency_store.get(idempotency_key, audio_fingerprint)
+    except IdempotencyConflict as e:
+        return {"success": False, "error": str(e)}
+    if stored is not None:
+        log.info("♻️ 冪等キーが一致したため保存済みの結果を返します")
+        return stored
+
     result = process_pronunciation(audio_file)
+    if result["success"]:
+        idempotency_store.put(idempotency_key, audio_fingerprint, result)
+    return result
+
+def process_pronunciation_gradio(audio_file, request: gr.Request = None):
+    """
+    Gradioインターフェース用の処理関数
+    requestはGradioが渡すHTTPリクエスト（Idempotency-Keyヘッダーの取得に使用）
+    """
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER.lower()) if request else None
+    request_id = request.headers.get(whisper_tracing.REQUEST_ID_HEADER.lower()) if request else None
+    with whisper_tracing.traced("process_pronunciation", request_id), whisper_profiler.profile_request():
+        result = process_pronunciation_idempotent(audio_file, idempotency_key)
     
     if result["success"]:
         return f"""
@@ -207,6 +246,8 @@ def create_gradio_app():
         
         Form data:
         - data: [null, audio_file]
+        
+        再送時は同じ Idempotency-Key ヘッダーを付けると、保存済みの結果が返ります
         ```
         """)
     
@@ -5,6 +5,8 @@
 """
 import gradio as gr
 import whisper
+from whisper_runtime import load_whisper_model
+import whisper_metrics
 import torch
 import librosa
 import numpy as np
@@ -23,7 +25,7 @@ def setup_whisper():
     if model is None:
         print("Whisper baseモデルをロード中...")
         # より大きなモデルで精度向上
-        model = whisper.load_model("base")
+        model = load_whisper_model("base")
         print("✅ Whisperモデル読み込み完了")
     return model
 
@@ -115,6 +117,7 @@ def select_best_result(results: List[Dict], mel_features: np.ndarray) -> Dict:
     print(f"🎯 選択された結果: '{best_result['text'].strip()}'")
     return best_result
 
+@whisper_metrics.timed("katakana")
 def phonetic_katakana_conversion_advanced(text: str) -> str:
     """
     高精度音韻→カタカナ変換（実際の発音重視）
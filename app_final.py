@@ -4,7 +4,8 @@
 日本人の実際の発音に特化した高精度カタカナ変換
 """
 import gradio as gr
-import whisper
+from whisper_runtime import load_whisper_model
+import whisper_metrics
 import numpy as np
 import tempfile
 import os
@@ -20,7 +21,7 @@ def setup_whisper():
     global model
     if model is None:
         print("Whisper tinyモデルをロード中...")
-        model = whisper.load_model("tiny")
+        model = load_whisper_model("tiny")
         print("✅ Whisperモデル読み込み完了")
     return model
 
@@ -55,6 +56,7 @@ def smart_transcribe(audio_file):
         print(f"❌ 解析失敗: {e}")
         raise e
 
+@whisper_metrics.timed("katakana")
 def japanese_english_katakana_conversion(text: str) -> str:
     """
     日本人の英語発音に特化した高精度カタカナ変換
@@ -4,7 +4,8 @@
 英語発音を日本語モードで認識してカタカナ出力を実験
 """
 import gradio as gr
-import whisper
+from whisper_runtime import load_whisper_model
+import whisper_metrics
 import re
 from typing import Dict, Any
 
@@ -16,7 +17,7 @@ def setup_whisper():
     global model
     if model is None:
         print("Whisper tinyモデルをロード中...")
-        model = whisper.load_model("tiny")
+        model = load_whisper_model("tiny")
         print("✅ Whisperモデル読み込み完了")
     return model
 
@@ -97,6 +98,7 @@ def transcribe_auto_mode(audio_file):
         print(f"❌ 自動検出解析失敗: {e}")
         raise e
 
+@whisper_metrics.timed("katakana")
 def clean_japanese_text(text: str) -> str:
     """日本語テキストをクリーンアップ（カタカナ・ひらがなのみ抽出）"""
     if not text:
@@ -4,7 +4,8 @@ MeCab強化版英語発音解析システム
 日本語モード + MeCabで漢字→カタカナ変換 + 精度向上
 """
 import gradio as gr
-import whisper
+from whisper_runtime import load_whisper_model
+import whisper_metrics
 import re
 import MeCab
 from typing import Dict, Any
@@ -18,7 +19,7 @@ def setup_whisper():
     global model
     if model is None:
         print("Whisper tinyモデルをロード中...")
-        model = whisper.load_model("tiny")
+        model = load_whisper_model("tiny")
         print("✅ Whisperモデル読み込み完了")
     return model
 
@@ -110,6 +111,7 @@ def transcribe_japanese_mode(audio_file):
         print(f"❌ 日本語モード解析失敗: {e}")
         raise e
 
+@whisper_metrics.timed("mecab")
 def convert_kanji_to_katakana_mecab(text: str) -> str:
     """MeCabを使って漢字→カタカナ変換（改良版）"""
     if not text:
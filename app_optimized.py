@@ -4,7 +4,8 @@
 軽量高速でありながら発音をそのままカタカナ表示する実用版
 """
 import gradio as gr
-import whisper
+from whisper_runtime import load_whisper_model
+import whisper_metrics
 import numpy as np
 import tempfile
 import os
@@ -20,7 +21,7 @@ def setup_whisper():
     global model
     if model is None:
         print("Whisper tinyモデルをロード中...")
-        model = whisper.load_model("tiny")
+        model = load_whisper_model("tiny")
         print("✅ Whisperモデル読み込み完了")
     return model
 
@@ -54,6 +55,7 @@ def optimized_transcribe(audio_file):
         print(f"❌ 解析失敗: {e}")
         raise e
 
+@whisper_metrics.timed("katakana")
 def advanced_katakana_conversion(text: str) -> str:
     """
     実用的高精度カタカナ変換（実際の発音重視）
@@ -4,19 +4,24 @@
 Whisper認識結果を発音記号経由でカタカナ変換
 """
 import gradio as gr
-import whisper
+from whisper_runtime import load_whisper_model
+import whisper_metrics
+from whisper_logging import get_logger
+import logging
 import re
 from typing import Dict, Any
 
 # Whisperモデル
 model = None
 
+log = get_logger("phonetic")
+
 def setup_whisper():
     """Whisperモデルをセットアップ"""
     global model
     if model is None:
         print("Whisper tinyモデルをロード中...")
-        model = whisper.load_model("tiny")
+        model = load_whisper_model("tiny")
         print("✅ Whisperモデル読み込み完了")
     return model
 
@@ -25,7 +30,7 @@ def transcribe_audio(audio_file):
     model = setup_whisper()
     
     try:
-        print(f"🎤 音声解析中: {audio_file}")
+        log.debug("🎤 音声解析中: %s", audio_file)
         
         result = model.transcribe(
             audio_file,
@@ -36,12 +41,12 @@ def transcribe_audio(audio_file):
         )
         
         raw_text = result["text"].strip()
-        print(f"📝 Whisper認識結果: '{raw_text}'")
+        log.info("📝 Whisper認識結果: '%s'", raw_text, extra={"fields": {"event": "transcribed", "chars": len(raw_text)}})
         
         return raw_text
         
     except Exception as e:
-        print(f"❌ 音声認識失敗: {e}")
+        log.error("❌ 音声認識失敗: %s", e)
         raise e
 
 def get_pronunciation_dict():
@@ -544,11 +549,13 @@ def get_pronunciation_dict():
         "probably": "/prɑbəbli/"
     }
 
+@whisper_metrics.timed("phonetic")
 def text_to_phonetic(text):
     """英語テキストを発音記号に変換"""
     pronunciation_dict = get_pronunciation_dict()
     
-    print(f"🔤 発音記号変換入力: '{text}'")
+    log.debug("🔤 発音記号変換入力: '%s'", text)
+    trace_words = log.isEnabledFor(logging.DEBUG)
     
     # テキストを小文字化して単語に分割
     words = re.findall(r'\b\w+\b', text.lower())
@@ -558,15 +565,17 @@ def text_to_phonetic(text):
         if word in pronunciation_dict:
             phonetic = pronunciation_dict[word]
             phonetic_parts.append(f"{word}:{phonetic}")
-            print(f"  '{word}' -> {phonetic}")
+            if trace_words:
+                log.debug("  '%s' -> %s", word, phonetic)
         else:
             # 辞書にない場合は推測変換
             estimated_phonetic = estimate_phonetic(word)
             phonetic_parts.append(f"{word}:{estimated_phonetic}")
-            print(f"  '{word}' -> {estimated_phonetic} (推測)")
+            if trace_words:
+                log.debug("  '%s' -> %s (推測)", word, estimated_phonetic)
     
     phonetic_result = " ".join([part.split(':')[1] for part in phonetic_parts])
-    print(f"🔤 発音記号結果: '{phonetic_result}'")
+    log.info("🔤 発音記号結果: '%s'", phonetic_result)
     
     return phonetic_result
 
@@ -576,9 +585,10 @@ def estimate_phonetic(word):
     phonetic = "/" + word.replace("ch", "tʃ").replace("sh", "ʃ").replace("th", "θ") + "/"
     return phonetic
 
+@whisper_metrics.timed("katakana")
 def phonetic_to_katakana(phonetic_text):
     """発音記号をカタカナに変換"""
-    print(f"🎌 発音記号→カタカナ変換: '{phonetic_text}'")
+    log.debug("🎌 発音記号→カタカナ変換: '%s'", phonetic_text)
     
     # 発音記号→カタカナ変換マップ
     phonetic_map = {
@@ -644,7 +654,7 @@ def phonetic_to_katakana(phonetic_text):
     result = re.sub(r'\s+', ' ', result).strip()  # 余分な空白除去
     result = result if result else "？？？"
     
-    print(f"🎌 カタカナ変換結果: '{result}'")
+    log.info("🎌 カタカナ変換結果: '%s'", result, extra={"fields": {"event": "katakana"}})
     return result
 
 def process_phonetic_pronunciation(audio_file):
@@ -670,7 +680,7 @@ def process_phonetic_pronunciation(audio_file):
         )
         
     except Exception as e:
-        print(f"❌ 処理エラー: {e}")
+        log.exception("❌ 処理エラー: %s", e)
         return f"❌ エラー: {str(e)}", "", "", ""
 
 # 発音記号ベースGradioインターフェース
@@ -4,7 +4,8 @@
 シンプルで確実に動作するカタカナ変換
 """
 import gradio as gr
-import whisper
+from whisper_runtime import load_whisper_model
+import whisper_metrics
 import re
 from typing import Dict, Any
 
@@ -16,7 +17,7 @@ def setup_whisper():
     global model
     if model is None:
         print("Whisper tinyモデルをロード中...")
-        model = whisper.load_model("tiny")
+        model = load_whisper_model("tiny")
         print("✅ Whisperモデル読み込み完了")
     return model
 
@@ -140,6 +141,7 @@ def get_word_to_katakana_dict():
         "here": "ヒア", "there": "ゼア"
     }
 
+@whisper_metrics.timed("katakana")
 def word_to_katakana_conversion(text: str) -> str:
     """単語レベルでの発音記号ベースカタカナ変換"""
     if not text:
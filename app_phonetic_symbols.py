@@ -4,7 +4,8 @@
 カタカナ変換に加えて、IPA発音記号でも表示
 """
 import gradio as gr
-import whisper
+from whisper_runtime import load_whisper_model
+import whisper_metrics
 import re
 from typing import Dict, Any
 
@@ -16,7 +17,7 @@ def setup_whisper():
     global model
     if model is None:
         print("Whisper tinyモデルをロード中...")
-        model = whisper.load_model("tiny")
+        model = load_whisper_model("tiny")
         print("✅ Whisperモデル読み込み完了")
     return model
 
@@ -174,6 +175,7 @@ def convert_to_phonetic_symbols(text: str) -> str:
     print(f"🔤 IPA変換結果: '{result}'")
     return result
 
+@whisper_metrics.timed("katakana")
 def convert_to_katakana(text: str) -> str:
     """英語テキストをカタカナに変換"""
     if not text:
@@ -4,7 +4,8 @@ Hugging Face Spaces用Whisper発音解析API - シンプル版
 Phonemizerなし、Whisperの結果をそのまま使用
 """
 import gradio as gr
-import whisper
+from whisper_runtime import load_whisper_model
+import whisper_metrics
 import tempfile
 import os
 import json
@@ -19,7 +20,7 @@ def setup_whisper():
     global model
     if model is None:
         print("Whisper tinyモデルをロード中...")
-        model = whisper.load_model("tiny")
+        model = load_whisper_model("tiny")
         print("✅ Whisperモデル読み込み完了")
     return model
 
@@ -52,6 +53,7 @@ def transcribe_with_whisper(audio_file):
         print(f"❌ Whisper文字起こし失敗: {e}")
         raise e
 
+@whisper_metrics.timed("katakana")
 def english_to_katakana_phonetic(text):
     """
     英語をカタカナに変換（音韻ベース・改良版）
@@ -4,7 +4,8 @@ Hugging Face Spaces用Whisper発音解析API v2
 Phonemizer統合 + 改善されたUI
 """
 import gradio as gr
-import whisper
+from whisper_runtime import load_whisper_model
+import whisper_metrics
 import tempfile
 import os
 import json
@@ -20,7 +21,7 @@ def setup_whisper():
     global model
     if model is None:
         print("Whisper tinyモデルをロード中...")
-        model = whisper.load_model("tiny")
+        model = load_whisper_model("tiny")
         print("✅ Whisperモデル読み込み完了")
     return model
 
@@ -53,6 +54,7 @@ def transcribe_with_whisper(audio_file):
         print(f"❌ Whisper文字起こし失敗: {e}")
         raise e
 
+@whisper_metrics.timed("phonemize")
 def phonemize_text(text):
     """
     テキストを音素に変換（Phonemizer使用）
@@ -81,6 +83,7 @@ def phonemize_text(text):
         print(f"❌ 音素変換失敗: {e}")
         return text  # フォールバック
 
+@whisper_metrics.timed("katakana")
 def phonemes_to_katakana(phonemes):
     """
     音素をカタカナに変換（改良版）
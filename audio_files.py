@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+音声ファイルの一覧（ディレクトリは再帰的に辿る）
+torch・whisperに依存しないため、ワーカーをforkする前の親プロセスや負荷をかける側からも使える
+"""
+import os
+from typing import List
+
+AUDIO_EXTENSIONS = (".m4a", ".wav", ".mp3", ".flac", ".ogg", ".webm")
+
+def collect_audio_files(paths: List[str]) -> List[str]:
+    """ファイルはそのまま、ディレクトリは配下の音声ファイルを名前順に並べる（存在しないパスは飛ばす）"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files += [os.path.join(root, n) for n in sorted(names) if n.lower().endswith(AUDIO_EXTENSIONS)]
+        elif os.path.exists(path):
+            files.append(path)
+    return files
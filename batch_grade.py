@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+録音の一括採点（オフライン）
+ディレクトリまたはzipの録音をプロセスプールで文字起こしし、選んだカタカナ変換器の結果を
+1件ずつJSONL/CSVに追記する。zipは展開せず、メンバーをそのままffmpegへ流し込む
+出力ファイルに既にあるファイルは飛ばすため、中断しても同じコマンドで再開できる
+corpus_store.pyのストアも指定でき、その場合はデコード済みの波形（--use-mel なら保存済みのメル）を直接使う
+
+使い方:
+    python batch_grade.py <ディレクトリ or zip or ストア> --output results.jsonl [--converter app] [--workers 4]
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import IO, Dict, List, Optional, Set
+
+import numpy as np
+
+from audio_files import AUDIO_EXTENSIONS, collect_audio_files
+from corpus_store import CorpusStore
+from katakana_converters import available_converters, get_converter
+from transcribe_options import TRANSCRIBE_OPTIONS  # whisper_api.py と同じ認識設定（生徒が見る結果と揃える）
+
+# torch・whisperはワーカープロセスの中で初めてimportする（親プロセスはファイルの一覧と結果の書き出しだけ）
+
+CSV_FIELDS = ["file", "success", "whisper_raw", "whisper_katakana", "reference", "converter", "seconds", "error"]
+
+# ワーカープロセスごとに1回だけ用意する
+_model = None
+_convert = None
+_converter_name = None
+_use_mel = False
+_archives: Dict[str, zipfile.ZipFile] = {}
+_stores: Dict[str, CorpusStore] = {}
+
+def decode_audio_stream(stream: IO[bytes]) -> np.ndarray:
+    """
+    音声のバイトストリームをffmpegにパイプで渡し、16kHzモノラルの波形にする
+    （whisper.load_audioと同じ変換をファイルを介さずに行う）
+    """
+    from whisper.audio import SAMPLE_RATE
+
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-",
+    ]
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def feed():
+        try:
+            shutil.copyfileobj(stream, process.stdin)
+        except BrokenPipeError:
+            pass  # ffmpegが先に終了した（エラーはreturncodeで判定）
+        finally:
+            process.stdin.close()
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    out, err = process.communicate()
+    writer.join()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpegでの読み込みに失敗: {err.decode(errors='ignore').strip()[-200:]}")
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+# MP4系のコンテナはmoov atomが末尾にあることが多く、パイプ（シーク不可）では読めない
+SEEKABLE_ONLY_FORMATS = {".m4a", ".mp4", ".mov", ".3gp"}
+
+def _load_via_temp_file(archive: zipfile.ZipFile, member: str) -> np.ndarray:
+    with archive.open(member) as stream, tempfile.NamedTemporaryFile(suffix=os.path.splitext(member)[1]) as tmp_file:
+        shutil.copyfileobj(stream, tmp_file)
+        tmp_file.flush()
+        import whisper
+        return whisper.load_audio(tmp_file.name)
+
+def load_member(archive_path: str, member: str) -> np.ndarray:
+    """
+    zipのメンバーを読み込む（ストリームで読める形式は展開せずにパイプで渡す）
+    MP4系は最初から一時ファイル経由で読む（パイプで失敗してから読み直すとffmpegを2回起動するため）
+    """
+    archive = _archives.get(archive_path)
+    if archive is None:
+        archive = _archives[archive_path] = zipfile.ZipFile(archive_path)
+    if os.path.splitext(member)[1].lower() in SEEKABLE_ONLY_FORMATS:
+        return _load_via_temp_file(archive, member)
+    try:
+        with archive.open(member) as stream:
+            return decode_audio_stream(stream)
+    except RuntimeError:
+        # 拡張子と中身が合わない等でパイプでは読めなかった場合は一時ファイル経由で読み直す
+        return _load_via_temp_file(archive, member)
+
+def open_store(path: str) -> CorpusStore:
+    store = _stores.get(path)
+    if store is None:
+        store = _stores[path] = CorpusStore(path)
+    return store
+
+def transcribe_mel(mel: np.ndarray) -> str:
+    """
+    保存済みのメルから直接デコード（30秒以内のクリップ）
+    温度フォールバックもtranscribeと同じ基準で、同じメルを使ってデコードし直す
+    """
+    import torch
+    import whisper
+    from whisper.audio import N_FRAMES
+    from whisper_batch import decode_with_fallback, is_silent
+
+    mel = torch.from_numpy(whisper.pad_or_trim(mel, N_FRAMES)).to(_model.device)
+    result = decode_with_fallback(_model, mel.unsqueeze(0), TRANSCRIBE_OPTIONS)[0]
+    if is_silent(result, TRANSCRIBE_OPTIONS):
+        return ""
+    return result.text.strip()
+
+def transcribe_item(source: str, member: Optional[str]) -> str:
+    """ファイル・zipメンバー・ストアのクリップを文字起こし"""
+    from whisper.audio import N_FRAMES
+
+    if member is None:
+        audio = source
+    elif CorpusStore.is_store(source):
+        store = open_store(source)
+        mel = store.mel(member) if _use_mel else None
+        if mel is not None and store.n_mels == _model.dims.n_mels and mel.shape[1] <= N_FRAMES:
+            return transcribe_mel(mel)
+        audio = store.audio(member)
+    else:
+        audio = load_member(source, member)
+    return _model.transcribe(audio, **TRANSCRIBE_OPTIONS)["text"].strip()
+
+def _init_worker(model_name: str, converter_name: str, threads: int, use_mel: bool = False) -> None:
+    global _model, _convert, _converter_name, _use_mel
+    import torch
+    from whisper_runtime import load_whisper_model
+
+    torch.set_num_threads(threads)
+    _model = load_whisper_model(model_name)
+    _convert = get_converter(converter_name)
+    _converter_name = converter_name
+    _use_mel = use_mel
+
+def grade_one(source: str, member: Optional[str]) -> Dict:
+    """1ファイルを文字起こしして変換（ワーカープロセスで実行）"""
+    name = f"{source}:{member}" if member else source
+    reference = ""
+    if member and CorpusStore.is_store(source):
+        reference = open_store(source).text(member) or ""
+    start = time.perf_counter()
+    try:
+        raw_text = transcribe_item(source, member)
+        return {
+            "file": name,
+            "success": True,
+            "whisper_raw": raw_text,
+            "whisper_katakana": _convert(raw_text),
+            "reference": reference,
+            "converter": _converter_name,
+            "seconds": round(time.perf_counter() - start, 3),
+            "error": "",
+        }
+    except Exception as e:
+        return {
+            "file": name,
+            "success": False,
+            "whisper_raw": "",
+            "whisper_katakana": "",
+            "reference": reference,
+            "converter": _converter_name,
+            "seconds": round(time.perf_counter() - start, 3),
+            "error": str(e),
+        }
+
+def list_inputs(path: str) -> List[tuple]:
+    """(ソース, zipメンバー名・ストアのクリップ名 or None) の一覧"""
+    if CorpusStore.is_store(path):
+        return [(path, name) for name in CorpusStore(path).names()]
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return [
+                (path, info.filename) for info in archive.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(AUDIO_EXTENSIONS)
+            ]
+    return [(file, None) for file in collect_audio_files([path])]
+
+def completed_files(output: str) -> Set[str]:
+    """出力ファイルに成功として記録済みのファイル名（再開用）"""
+    if not os.path.exists(output):
+        return set()
+    with open(output, encoding="utf-8", newline="") as f:
+        if output.endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        return {row["file"] for row in rows if str(row.get("success")) in ("True", "true")}
+
+class ResultWriter:
+    """結果を1件ずつ追記する（JSONL or CSV）"""
+    def __init__(self, output: str):
+        self.is_csv = output.endswith(".csv")
+        new_file = not os.path.exists(output) or os.path.getsize(output) == 0
+        self.file = open(output, "a", encoding="utf-8", newline="")
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            if new_file:
+                self.writer.writeheader()
+
+    def write(self, row: Dict) -> None:
+        if self.is_csv:
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="録音ディレクトリ/zipの一括採点")
+    parser.add_argument("source", help="録音のディレクトリ・zip・ストア（corpus_store.py）")
+    parser.add_argument("--output", required=True, help="結果の出力先（.jsonl または .csv）")
+    parser.add_argument("--converter", default="app", choices=available_converters(), help="カタカナ変換器")
+    parser.add_argument("--model", default="tiny", help="Whisperモデル名")
+    parser.add_argument("--use-mel", action="store_true", help="ストアに保存済みのメルから直接デコードする")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="ワーカープロセス数")
+    args = parser.parse_args()
+
+    inputs = list_inputs(args.source)
+    if not inputs:
+        print("❌ 音声ファイルが見つかりません")
+        sys.exit(1)
+
+    done = completed_files(args.output)
+    pending = [(source, member) for source, member in inputs if (f"{source}:{member}" if member else source) not in done]
+    print(f"📋 {len(inputs)}件中 {len(inputs) - len(pending)}件は処理済み、残り{len(pending)}件")
+    if not pending:
+        return
+
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    writer = ResultWriter(args.output)
+    failures = 0
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=_init_worker,
+            initargs=(args.model, args.converter, threads, args.use_mel),
+        ) as executor:
+            futures = [executor.submit(grade_one, source, member) for source, member in pending]
+            for count, future in enumerate(as_completed(futures), 1):
+                row = future.result()
+                writer.write(row)
+                if not row["success"]:
+                    failures += 1
+                    print(f"❌ {row['file']}: {row['error']}")
+                print(f"   [{count}/{len(pending)}] {row['file']}: '{row['whisper_katakana']}'", flush=True)
+    finally:
+        writer.close()
+
+    print(f"✅ 完了: {len(pending)}件（失敗 {failures}件） {time.perf_counter() - start:.1f}秒 → {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+ベンチマークの回帰チェック
+保存済みのベースライン（bench_pipeline.pyのJSON）と同じ条件でベンチマークを再実行し、
+段階別レイテンシ・スループット・最大メモリの悪化をバリアントごとに判定する
+レイテンシは生のサンプル同士をMann-Whitney U検定で比べ、有意かつ許容幅を超えた悪化だけを回帰とする
+回帰があれば終了コード1を返す（CI等で失敗させる用）
+
+使い方:
+    python bench_compare.py bench_baseline.json [--current bench_now.json] [--latency-tolerance 0.1]
+"""
+import argparse
+import json
+import math
+import sys
+from typing import Dict, List, Tuple
+
+from bench_pipeline import STAGES, run_in_subprocess
+
+def mann_whitney_greater(current: List[float], baseline: List[float]) -> float:
+    """
+    currentがbaselineより大きい（遅い）という片側検定のp値
+    同順位補正・連続性補正付きの正規近似（各5件以上を想定）
+    """
+    n1, n2 = len(current), len(baseline)
+    if n1 == 0 or n2 == 0:
+        return 1.0
+    combined = sorted([(value, 0) for value in current] + [(value, 1) for value in baseline])
+
+    # 同順位は平均順位にする
+    ranks = [0.0] * len(combined)
+    tie_term = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        ties = j - i + 1
+        tie_term += ties ** 3 - ties
+        i = j + 1
+
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, combined) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def compare_variant(name: str, baseline: Dict, current: Dict, args) -> List[Tuple[bool, str]]:
+    """1バリアント分の比較結果（回帰かどうか, 説明）の一覧"""
+    findings = []
+    for stage in STAGES:
+        before = baseline["stages"].get(stage)
+        after = current["stages"].get(stage)
+        if not before or not after:
+            continue
+        delta = after["p50"] - before["p50"]
+        ratio = delta / before["p50"] if before["p50"] > 0 else 0.0
+        p_value = mann_whitney_greater(after["samples"], before["samples"])
+        regressed = (
+            p_value < args.alpha
+            and ratio > args.latency_tolerance
+            and delta * 1000 > args.min_delta_ms
+        )
+        findings.append((regressed, (
+            f"{name}/{stage}: p50 {before['p50'] * 1000:.1f}ms → {after['p50'] * 1000:.1f}ms "
+            f"({ratio:+.1%}, p={p_value:.4f})"
+        )))
+
+    before, after = baseline["throughput_files_per_second"], current["throughput_files_per_second"]
+    ratio = (after - before) / before if before else 0.0
+    findings.append((ratio < -args.throughput_tolerance, (
+        f"{name}/throughput: {before:.2f} → {after:.2f}件/秒 ({ratio:+.1%})"
+    )))
+
+    before, after = baseline["peak_rss_mb"], current["peak_rss_mb"]
+    ratio = (after - before) / before if before else 0.0
+    findings.append((ratio > args.rss_tolerance, (
+        f"{name}/peak_rss: {before:.0f} → {after:.0f}MB ({ratio:+.1%})"
+    )))
+    return findings
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマークの回帰チェック")
+    parser.add_argument("baseline", help="ベースラインのJSON（bench_pipeline.pyの出力）")
+    parser.add_argument("--current", help="比較対象のJSON（省略時はベースラインと同じ条件で再実行）")
+    parser.add_argument("--save", help="再実行した結果の保存先")
+    parser.add_argument("--alpha", type=float, default=0.01, help="有意水準")
+    parser.add_argument("--latency-tolerance", type=float, default=0.10, help="許容するp50の悪化率")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="これ未満のp50の悪化は無視（ms）")
+    parser.add_argument("--throughput-tolerance", type=float, default=0.10, help="許容するスループットの低下率")
+    parser.add_argument("--rss-tolerance", type=float, default=0.10, help="許容する最大メモリの増加率")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    if args.current:
+        with open(args.current, encoding="utf-8") as f:
+            current = json.load(f)
+    else:
+        variants = [name for name, result in baseline["variants"].items() if "error" not in result]
+        print(f"⏱️ ベースラインと同じ条件で再実行: {len(variants)}バリアント × {len(baseline['corpus'])}ファイル × {baseline['repeats']}回")
+        current = dict(baseline, variants={})
+        for name in variants:
+            print(f"🔄 {name} を計測中...", flush=True)
+            current["variants"][name] = run_in_subprocess(
+                name, baseline["corpus"], baseline["repeats"], baseline.get("store")
+            )
+        if args.save:
+            with open(args.save, "w", encoding="utf-8") as f:
+                json.dump(current, f, ensure_ascii=False, indent=2)
+
+    regressions = 0
+    for name, before in baseline["variants"].items():
+        after = current["variants"].get(name)
+        if "error" in before:
+            continue
+        if after is None or "error" in after:
+            regressions += 1
+            print(f"❌ {name}: 比較対象の計測に失敗しました")
+            continue
+        for regressed, message in compare_variant(name, before, after, args):
+            regressions += regressed
+            print(f"{'❌' if regressed else '  '} {message}")
+
+    if regressions:
+        print(f"❌ 性能回帰: {regressions}件")
+        sys.exit(1)
+    print("✅ 性能回帰なし")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+カタカナ変換器のマイクロベンチマーク
+各app_*.pyの変換処理に同じ文字起こしコーパス（合成 + 実際の文字起こし結果）を流し、
+1秒あたりの処理回数・1回あたりのメモリ確保量・変換器同士の出力の一致度を比較する
+変換器内のprintは計測に影響しないよう捨て、ログ（whisper_logging）は出さない
+
+使い方:
+    python bench_converters.py [--transcripts results.jsonl] [--synthetic 2000] [--json converters.json]
+"""
+import argparse
+import contextlib
+import difflib
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from katakana_converters import CONVERTERS, get_converter
+
+# 英語の文字起こし結果を受け取る変換器（日本語テキスト向けのものは除く）
+DEFAULT_CONVERTERS = [
+    "app", "api", "test", "final", "optimized", "simple", "advanced",
+    "phonetic", "phonetic_fixed", "phonetic_symbols", "v2",
+]
+
+# 発音練習でよく出る語（合成コーパス用）
+VOCABULARY = (
+    "hello world thank you very much good morning afternoon evening water coffee "
+    "please sorry excuse me nice to meet how are doing fine weather today tomorrow "
+    "yesterday school teacher student english japanese practice pronunciation right "
+    "light rice lice think sink this that three tree very berry love rub walk work "
+    "bird word girl world really little bottle computer internet restaurant important "
+    "difficult simple beautiful comfortable vegetable chocolate"
+).split()
+
+class _Discard:
+    """printの出力先（何もしない）"""
+    def write(self, text: str) -> int:
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+def synthetic_transcripts(count: int, seed: int = 0) -> List[str]:
+    """1〜8語のランダムな文（再現性のため乱数シード固定）"""
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(1, 8))) for _ in range(count)]
+
+def load_transcripts(path: str) -> List[str]:
+    """実際の文字起こし結果（batch_grade.pyのJSONL、または1行1文のテキスト）"""
+    texts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                row = json.loads(line)
+                line = row.get("whisper_raw") or row.get("text") or ""
+            if line:
+                texts.append(line)
+    return texts
+
+def measure_throughput(convert: Callable[[str], str], corpus: List[str], min_seconds: float) -> float:
+    """コーパスを繰り返し変換し、1秒あたりの処理回数を返す"""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for text in corpus:
+            convert(text)
+        calls += len(corpus)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return calls / elapsed
+
+def measure_allocations(convert: Callable[[str], str], corpus: List[str]) -> float:
+    """1回の変換で確保されるメモリのピーク（バイト、平均）"""
+    total = 0
+    tracemalloc.start()
+    try:
+        for text in corpus:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            convert(text)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / len(corpus)
+
+def agreement(outputs: Dict[str, List[str]]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """変換器の組ごとの一致率（完全一致・文字列類似度の平均）"""
+    def normalize(text: str) -> str:
+        return text.replace(" ", "").replace("　", "")
+
+    names = list(outputs)
+    matrix: Dict[str, Dict[str, Dict[str, float]]] = {name: {} for name in names}
+    for i, a in enumerate(names):
+        for b in names[i + 1:]:
+            pairs = [(normalize(x), normalize(y)) for x, y in zip(outputs[a], outputs[b])]
+            result = {
+                "exact": sum(x == y for x, y in pairs) / len(pairs),
+                "similarity": sum(difflib.SequenceMatcher(None, x, y).ratio() for x, y in pairs) / len(pairs),
+            }
+            matrix[a][b] = matrix[b][a] = result
+    return matrix
+
+def main():
+    parser = argparse.ArgumentParser(description="カタカナ変換器のマイクロベンチマーク")
+    parser.add_argument("--converters", nargs="+", default=DEFAULT_CONVERTERS, choices=list(CONVERTERS))
+    parser.add_argument("--transcripts", nargs="*", default=[], help="実際の文字起こし結果（JSONL or テキスト）")
+    parser.add_argument("--synthetic", type=int, default=2000, help="合成する文の数")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="変換器ごとのスループット計測時間")
+    parser.add_argument("--json", help="結果の保存先")
+    args = parser.parse_args()
+    # ログの組み立て・キューへの積み込みが変換1回ごとの計測に混ざらないよう、ログは出さない
+    os.environ["WHISPER_LOG_LEVEL"] = "OFF"
+
+    corpus = synthetic_transcripts(args.synthetic)
+    for path in args.transcripts:
+        corpus += load_transcripts(path)
+    if not corpus:
+        print("❌ コーパスが空です")
+        sys.exit(1)
+    print(f"🔤 変換器ベンチマーク: {len(args.converters)}種類 × {len(corpus)}文")
+
+    results, outputs = {}, {}
+    for name in args.converters:
+        try:
+            with contextlib.redirect_stdout(_Discard()):
+                convert = get_converter(name)
+                outputs[name] = [convert(text) for text in corpus]  # ウォームアップを兼ねる
+                ops = measure_throughput(convert, corpus, args.min_seconds)
+                allocated = measure_allocations(convert, corpus)
+        except Exception as e:
+            print(f"⚠️ {name}: 計測できませんでした（{e}）")
+            continue
+        results[name] = {"ops_per_second": ops, "allocated_bytes_per_call": allocated}
+        print(f"   {name:18s} {ops:12.0f} 回/秒   {allocated / 1024:8.1f} KB/回")
+
+    matrix = agreement(outputs)
+    print("🤝 出力の一致率（完全一致 / 類似度）")
+    for a in outputs:
+        for b, result in matrix[a].items():
+            if a < b:
+                print(f"   {a} ⇔ {b}: {result['exact']:.1%} / {result['similarity']:.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"corpus_size": len(corpus), "converters": results, "agreement": matrix},
+                      f, ensure_ascii=False, indent=2)
+        print(f"✅ 結果保存: {args.json}")
+
+if __name__ == "__main__":
+    main()
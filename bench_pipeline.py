@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+推論パイプラインの段階別レイテンシベンチマーク（オフライン）
+各バリアント（app.py, app_final.py, ...）の文字起こし + カタカナ変換を手元のコーパスで繰り返し実行し、
+音声デコード / メル / エンコーダ / デコーダ / 変換 の段階ごとに p50/p95/p99 をJSONに保存する
+バリアントごとに別プロセスで実行し、import・メモリ使用量が互いに影響しないようにする
+--store を指定すると corpus_store.py で前処理済みの波形を渡し、毎回のffmpegデコードを省く
+
+使い方:
+    python bench_pipeline.py [音声ファイル or ディレクトリ ...] [--variants app final] [--repeats 5] [--json bench.json]
+    python bench_pipeline.py --store corpus.store --variants app final
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+STAGES = ("audio_decode", "mel", "encoder", "decoder", "conversion", "total")
+DEFAULT_CORPUS = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_recording.m4a")]
+
+@dataclass(frozen=True)
+class Variant:
+    """ベンチマーク対象（文字起こし関数と、対応するカタカナ変換器）"""
+    module: str
+    transcribe: str
+    converter: str
+    reads_bytes: bool = False  # 文字起こし関数がパスではなく音声バイト列を受け取る
+    accepts_array: bool = True  # パスの代わりに波形（np.ndarray）を渡せる（model.transcribeにそのまま渡す関数）
+
+VARIANTS: Dict[str, Variant] = {
+    "app": Variant("app", "transcribe_with_whisper", "app"),
+    "api": Variant("whisper_api", "transcribe_with_whisper", "api", reads_bytes=True, accepts_array=False),
+    "final": Variant("app_final", "smart_transcribe", "final"),
+    "optimized": Variant("app_optimized", "optimized_transcribe", "optimized"),
+    "simple": Variant("app_simple", "transcribe_with_whisper", "simple"),
+    "advanced": Variant("app_advanced", "advanced_transcribe_with_features", "advanced", accepts_array=False),
+    "phonetic": Variant("app_phonetic", "transcribe_audio", "phonetic"),
+    "phonetic_fixed": Variant("app_phonetic_fixed", "transcribe_audio", "phonetic_fixed"),
+    "phonetic_symbols": Variant("app_phonetic_symbols", "transcribe_audio", "phonetic_symbols"),
+    "v2": Variant("app_v2", "transcribe_with_whisper", "v2"),
+    "japanese_mode": Variant("app_japanese_mode", "transcribe_japanese_mode", "japanese_mode"),
+    "mecab": Variant("app_mecab_enhanced", "transcribe_japanese_mode", "mecab"),
+}
+
+def percentile(values: List[float], q: float) -> float:
+    """線形補間のパーセンタイル（qは0〜100）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize(values: List[float]) -> Dict:
+    return {
+        "n": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "samples": values,
+    }
+
+def peak_rss_mb() -> float:
+    """このプロセスの最大常駐メモリ（MB、Linuxのru_maxrssはKB単位）"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+def run_variant(name: str, files: List[str], repeats: int, store_path: Optional[str] = None) -> Dict:
+    """1つのバリアントを計測（子プロセス内で実行）"""
+    import whisper_metrics
+    from katakana_converters import get_converter
+
+    variant = VARIANTS[name]
+    store = None
+    if store_path:
+        from corpus_store import CorpusStore
+        store = CorpusStore(store_path)
+        # 波形を受け取れないバリアントは、ストアのクリップの元ファイルから読む
+        if not variant.accepts_array:
+            files = [store.source_path(path) for path in files]
+            store = None
+    from whisper_runtime import instrument_audio_stages
+    instrument_audio_stages()
+    transcribe = getattr(importlib.import_module(variant.module), variant.transcribe)
+    convert = get_converter(variant.converter)
+
+    def run_once(path: str) -> Dict[str, float]:
+        if store is not None:
+            audio = store.audio(path)
+        else:
+            audio = open(path, "rb").read() if variant.reads_bytes else path
+        whisper_metrics.reset()
+        start = time.perf_counter()
+        result = transcribe(audio)
+        text = result["text"].strip() if isinstance(result, dict) else result
+        conversion_start = time.perf_counter()
+        convert(text)
+        end = time.perf_counter()
+
+        samples = {stage: sum(values) for stage, values in whisper_metrics.get_samples().items()}
+        return {
+            "audio_decode": samples.get("audio_decode", 0.0),
+            "mel": samples.get("mel", 0.0),
+            "encoder": samples.get("encoder", 0.0),
+            "decoder": samples.get("decoder", 0.0),
+            "conversion": end - conversion_start,
+            "total": end - start,
+        }
+
+    stages: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    whisper_metrics.record_samples()
+    # 各アプリのprintが計測に混ざらないよう、標準出力は捨てる
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for path in files:
+            run_once(path)  # ウォームアップ（モデル読み込み・初回のJIT等）
+        for _ in range(repeats):
+            for path in files:
+                for stage, seconds in run_once(path).items():
+                    stages[stage].append(seconds)
+
+    total = sum(stages["total"])
+    return {
+        "module": variant.module,
+        "converter": variant.converter,
+        "files": len(files),
+        "runs": len(stages["total"]),
+        "throughput_files_per_second": len(stages["total"]) / total if total else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {stage: summarize(values) for stage, values in stages.items()},
+    }
+
+def run_in_subprocess(name: str, files: List[str], repeats: int, store_path: Optional[str] = None) -> Dict:
+    """バリアントを子プロセスで計測し、結果を一時ファイル経由で受け取る"""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp_file:
+        result_path = tmp_file.name
+    try:
+        command = [
+            # ストアを使う場合、ファイル一覧は子プロセスがストアから読む（数千件をコマンドラインに載せない）
+            sys.executable, os.path.abspath(__file__), *([] if store_path else files),
+            "--worker", name, "--repeats", str(repeats), "--result-file", result_path,
+        ]
+        if store_path:
+            command += ["--store", store_path]
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            return {"error": completed.stderr.strip()[-1000:]}
+        with open(result_path, encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.unlink(result_path)
+
+def environment() -> Dict:
+    info = {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()}
+    for key in ("WHISPER_QUANTIZE", "WHISPER_DRAFT_MODEL", "WHISPER_BACKEND", "WHISPER_ORT_THREADS"):
+        if os.environ.get(key):
+            info[key] = os.environ[key]
+    return info
+
+def main():
+    parser = argparse.ArgumentParser(description="推論パイプラインの段階別レイテンシベンチマーク")
+    parser.add_argument("paths", nargs="*", help="音声ファイルまたはディレクトリ（既定: test_recording.m4a）")
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--repeats", type=int, default=5, help="コーパス全体を繰り返す回数")
+    parser.add_argument("--json", default="bench_results.json", help="結果の保存先")
+    parser.add_argument("--store", help="corpus_store.pyで作ったストア（指定時はpathsの代わりに使用）")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # ログの組み立て・キューへの積み込みが計測に混ざらないよう、ログは出さない（子プロセスにも引き継ぐ）
+    os.environ["WHISPER_LOG_LEVEL"] = "OFF"
+
+    if args.store:
+        from corpus_store import CorpusStore
+        files = CorpusStore(args.store).names()
+    else:
+        from audio_files import collect_audio_files
+        files = collect_audio_files(args.paths or DEFAULT_CORPUS)
+    if not files:
+        print("❌ 音声ファイルが見つかりません")
+        sys.exit(1)
+
+    if args.worker:
+        result = run_variant(args.worker, files, args.repeats, args.store)
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+
+    print(f"⏱️ ベンチマーク: {len(args.variants)}バリアント × {len(files)}ファイル × {args.repeats}回")
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "corpus": files,
+        "store": args.store,
+        "repeats": args.repeats,
+        "variants": {},
+    }
+    for name in args.variants:
+        print(f"🔄 {name} を計測中...", flush=True)
+        result = report["variants"][name] = run_in_subprocess(name, files, args.repeats, args.store)
+        if "error" in result:
+            print(f"❌ {name}: {result['error'].splitlines()[-1] if result['error'] else '失敗'}")
+            continue
+        stages = result["stages"]
+        print("   " + " / ".join(
+            f"{stage} p50 {stages[stage]['p50'] * 1000:.0f}ms p95 {stages[stage]['p95'] * 1000:.0f}ms"
+            for stage in STAGES
+        ))
+        print(f"   スループット {result['throughput_files_per_second']:.2f}件/秒 / 最大メモリ {result['peak_rss_mb']:.0f}MB")
+
+    with open(args.json, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 結果保存: {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+前処理済みコーパスのストア（メモリマップ）
+音声を1回だけffmpegで16kHzモノラルにデコードし、全クリップを1つのファイルに連結して保存する
+（オフセットの索引付き）。必要ならログメルも隣に保存する
+ベンチマーク・一括採点はストアからコピーなしのスライスを読むため、繰り返し実行しても時間はほぼモデルだけになる
+
+使い方:
+    python corpus_store.py pack <音声ファイル or ディレクトリ ...> --out corpus.store [--dtype float16] [--mel 80]
+    python corpus_store.py info corpus.store
+"""
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+INDEX_FILE = "index.json"
+AUDIO_FILE = "audio.bin"
+MEL_FILE = "mel.bin"
+DTYPES = ("float32", "float16")
+# packで書き込みを待つデコード済みクリップの上限（ワーカー数の倍数）
+PREFETCH_PER_WORKER = 2
+
+class CorpusStore:
+    """
+    packで作ったストアを読み込む（音声・メルはメモリマップ）
+    float32で保存したストアのaudio()はコピーなしのビューを返す
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), encoding="utf-8") as f:
+            self.index = json.load(f)
+        self.dtype = np.dtype(self.index["dtype"])
+        self.sample_rate = self.index["sample_rate"]
+        self.n_mels = self.index.get("n_mels")
+        self.clips: Dict[str, Dict] = {clip["name"]: clip for clip in self.index["clips"]}
+        self._audio = np.memmap(os.path.join(path, AUDIO_FILE), dtype=self.dtype, mode="r")
+        self._mel = (
+            np.memmap(os.path.join(path, MEL_FILE), dtype=self.dtype, mode="r")
+            if self.n_mels else None
+        )
+
+    @staticmethod
+    def is_store(path: str) -> bool:
+        return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+    def __len__(self) -> int:
+        return len(self.clips)
+
+    def names(self) -> List[str]:
+        return list(self.clips)
+
+    def source_path(self, name: str) -> str:
+        """クリップの元の音声ファイル（ストアを作ったときの場所。rootのない古いストアは作成時のカレントディレクトリから）"""
+        return os.path.join(self.index.get("root", ""), name)
+
+    def text(self, name: str) -> Optional[str]:
+        """正解テキスト（generate_corpus.pyのmanifestがあった場合）"""
+        return self.clips[name].get("text")
+
+    def audio(self, name: str) -> np.ndarray:
+        """16kHzモノラルの波形（float32）"""
+        clip = self.clips[name]
+        samples = self._audio[clip["offset"]:clip["offset"] + clip["length"]]
+        return samples if self.dtype == np.float32 else samples.astype(np.float32)
+
+    def mel(self, name: str) -> Optional[np.ndarray]:
+        """
+        保存済みのログメル (n_mels, frames)。パディングなしの音声から計算したもの
+        30秒に揃えるときはwhisper.pad_or_trimを使う（transcribeと同じ0埋め）
+        """
+        if self._mel is None:
+            return None
+        clip = self.clips[name]
+        size = self.n_mels * clip["mel_frames"]
+        frames = self._mel[clip["mel_offset"]:clip["mel_offset"] + size].reshape(self.n_mels, clip["mel_frames"])
+        return frames if self.dtype == np.float32 else frames.astype(np.float32)
+
+def read_manifest(paths: List[str]) -> Dict[str, str]:
+    """generate_corpus.pyのmanifest.jsonlから ファイルパス → 正解テキスト"""
+    texts = {}
+    for path in paths:
+        manifest = os.path.join(path, "manifest.jsonl")
+        if not os.path.isdir(path) or not os.path.exists(manifest):
+            continue
+        with open(manifest, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    texts[os.path.join(path, row["file"])] = row["text"]
+    return texts
+
+def corpus_root(paths: List[str]) -> str:
+    """クリップ名の基準にするディレクトリ（指定したディレクトリ・ファイルの親に共通する場所）"""
+    roots = [
+        os.path.abspath(path) if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+        for path in paths
+    ]
+    return os.path.commonpath(roots)
+
+def ordered_map(executor: Executor, fn: Callable, items: Iterable, limit: int) -> Iterator:
+    """
+    executor.mapと同じく入力順に結果を返すが、先行して実行する件数をlimit件までに抑える
+    （executor.mapは全件を一度に投入するため、書き込みが遅いと結果がすべてメモリにたまる）
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
+def pack(files: List[str], out_dir: str, dtype: str = "float32", n_mels: Optional[int] = None,
+         texts: Optional[Dict[str, str]] = None, workers: int = 4, root: Optional[str] = None) -> Dict:
+    """
+    音声をデコードして1つのファイルに連結し、索引を書き出す
+    クリップ名はroot（省略時はfilesに共通の親）からの相対パス。どのディレクトリで実行しても同じ名前になる
+    """
+    import torch
+    import whisper
+    from whisper.audio import SAMPLE_RATE
+
+    texts = texts or {}
+    root = os.path.abspath(root) if root else corpus_root(files)
+    os.makedirs(out_dir, exist_ok=True)
+    index = {"dtype": dtype, "sample_rate": SAMPLE_RATE, "n_mels": n_mels, "root": root, "clips": []}
+    audio_offset = mel_offset = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            open(os.path.join(out_dir, AUDIO_FILE), "wb") as audio_file, \
+            open(os.path.join(out_dir, MEL_FILE), "wb") if n_mels else open(os.devnull, "wb") as mel_file:
+        # ffmpegのデコードは並列に、書き込みは入力順に行う
+        decoded = ordered_map(executor, whisper.load_audio, files, workers * PREFETCH_PER_WORKER)
+        for path, audio in zip(files, decoded):
+            clip = {
+                "name": os.path.relpath(os.path.abspath(path), root),
+                "offset": audio_offset,
+                "length": int(audio.size),
+                "seconds": round(audio.size / SAMPLE_RATE, 3),
+            }
+            if path in texts:
+                clip["text"] = texts[path]
+            audio_file.write(audio.astype(dtype).tobytes())
+            audio_offset += audio.size
+
+            if n_mels:
+                with torch.no_grad():
+                    mel = whisper.log_mel_spectrogram(audio, n_mels).numpy()
+                clip["mel_offset"] = mel_offset
+                clip["mel_frames"] = int(mel.shape[1])
+                mel_file.write(np.ascontiguousarray(mel, dtype=dtype).tobytes())
+                mel_offset += mel.size
+            index["clips"].append(clip)
+
+    with open(os.path.join(out_dir, INDEX_FILE), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description="前処理済みコーパスのストア")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack_parser = commands.add_parser("pack", help="音声をデコードしてストアを作る")
+    pack_parser.add_argument("paths", nargs="+", help="音声ファイルまたはディレクトリ")
+    pack_parser.add_argument("--out", required=True, help="ストアの出力先ディレクトリ")
+    pack_parser.add_argument("--dtype", default="float32", choices=DTYPES, help="保存形式（float16は半分の容量、読み出し時に変換）")
+    pack_parser.add_argument("--mel", type=int, choices=(80, 128), help="ログメルも保存する（メル数: tiny/base/small/mediumは80）")
+    pack_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ffmpegの並列数")
+    info_parser = commands.add_parser("info", help="ストアの内容を表示")
+    info_parser.add_argument("store")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        store = CorpusStore(args.store)
+        seconds = sum(clip["seconds"] for clip in store.clips.values())
+        print(f"📦 {args.store}: {len(store)}クリップ / 合計{seconds / 60:.1f}分 / {store.dtype} / メル: {store.n_mels or 'なし'}")
+        return
+
+    from audio_files import collect_audio_files
+    files = collect_audio_files(args.paths)
+    if not files:
+        print("❌ 音声ファイルが見つかりません")
+        sys.exit(1)
+
+    print(f"📦 ストア作成: {len(files)}ファイル → {args.out}（{args.dtype}, メル: {args.mel or 'なし'}）")
+    index = pack(files, args.out, args.dtype, args.mel, read_manifest(args.paths), args.workers, corpus_root(args.paths))
+    seconds = sum(clip["seconds"] for clip in index["clips"])
+    print(f"✅ 完了: {len(index['clips'])}クリップ / 合計{seconds / 60:.1f}分")
+
+if __name__ == "__main__":
+    main()
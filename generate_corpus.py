@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+ベンチマーク・回帰テスト用の合成音声コーパス生成（ローカルのespeak-ngを使用、ネットワーク不要）
+文のリストから、話速・声の高さ・前後の無音・ノイズを変えたWAVを作り、正解テキスト付きのmanifest.jsonlを書き出す
+同じ--seedなら同じコーパスが再生成される
+
+使い方:
+    python generate_corpus.py --out corpus/ --count 3000 [--sentences sentences.txt] [--workers 4]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+import numpy as np
+
+# 発音練習でよく使う文（--sentences を省略したとき）
+DEFAULT_SENTENCES = [
+    "hello world",
+    "thank you very much",
+    "good morning",
+    "nice to meet you",
+    "how are you doing today",
+    "I would like a glass of water",
+    "the weather is beautiful",
+    "excuse me where is the station",
+    "I think this is the right answer",
+    "she sells sea shells by the sea shore",
+    "red lorry yellow lorry",
+    "the quick brown fox jumps over the lazy dog",
+    "I really love rice and light food",
+    "could you say that again please",
+    "my favorite subject is english",
+    "see you tomorrow",
+]
+
+VOICES = ["en-us", "en-gb", "en-us+f3", "en-gb+m3", "en-us+m7"]
+
+@dataclass
+class ClipSpec:
+    """1クリップ分の合成条件（manifestにそのまま書き出す）"""
+    file: str
+    text: str
+    voice: str
+    rate: int           # 話速（語/分）
+    pitch: int          # 声の高さ（0〜99）
+    pad_before: float   # 前の無音（秒）
+    pad_after: float    # 後の無音（秒）
+    snr_db: Optional[float]  # ノイズのSN比（Noneならノイズなし）
+    seed: int
+    seconds: float = 0.0
+
+def find_espeak() -> str:
+    for name in ("espeak-ng", "espeak"):
+        path = shutil.which(name)
+        if path:
+            return path
+    print("❌ espeak-ng が見つかりません（apt install espeak-ng / brew install espeak-ng）")
+    sys.exit(1)
+
+def plan_clips(sentences: List[str], count: int, seed: int, args) -> List[ClipSpec]:
+    """乱数シードから各クリップの条件を決める"""
+    rng = random.Random(seed)
+    clips = []
+    for index in range(count):
+        clips.append(ClipSpec(
+            file=f"clip_{index:05d}.wav",
+            text=sentences[index % len(sentences)],
+            voice=rng.choice(VOICES),
+            rate=rng.randint(args.min_rate, args.max_rate),
+            pitch=rng.randint(args.min_pitch, args.max_pitch),
+            pad_before=round(rng.uniform(0.0, args.max_padding), 3),
+            pad_after=round(rng.uniform(0.0, args.max_padding), 3),
+            snr_db=None if rng.random() < args.clean_ratio else round(rng.uniform(args.min_snr, args.max_snr), 1),
+            seed=rng.randrange(2 ** 31),
+        ))
+    return clips
+
+def synthesize(espeak: str, clip: ClipSpec, out_dir: str) -> ClipSpec:
+    """espeak-ngで読み上げ、無音とノイズを加えてWAVに保存"""
+    with tempfile.NamedTemporaryFile(suffix=".wav") as tmp_file:
+        subprocess.run(
+            [espeak, "-v", clip.voice, "-s", str(clip.rate), "-p", str(clip.pitch), "-w", tmp_file.name, clip.text],
+            check=True, capture_output=True,
+        )
+        with wave.open(tmp_file.name, "rb") as source:
+            sample_rate = source.getframerate()
+            speech = np.frombuffer(source.readframes(source.getnframes()), np.int16).astype(np.float32) / 32768.0
+
+    audio = np.concatenate([
+        np.zeros(int(clip.pad_before * sample_rate), np.float32),
+        speech,
+        np.zeros(int(clip.pad_after * sample_rate), np.float32),
+    ])
+    if clip.snr_db is not None and speech.size:
+        signal_power = float(np.mean(speech ** 2)) or 1e-8
+        noise_power = signal_power / (10 ** (clip.snr_db / 10))
+        audio = audio + np.random.default_rng(clip.seed).normal(0.0, np.sqrt(noise_power), audio.size).astype(np.float32)
+
+    with wave.open(os.path.join(out_dir, clip.file), "wb") as target:
+        target.setnchannels(1)
+        target.setsampwidth(2)
+        target.setframerate(sample_rate)
+        target.writeframes((np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16).tobytes())
+    clip.seconds = round(audio.size / sample_rate, 3)
+    return clip
+
+def main():
+    parser = argparse.ArgumentParser(description="espeak-ngによる合成音声コーパス生成")
+    parser.add_argument("--out", required=True, help="出力ディレクトリ")
+    parser.add_argument("--count", type=int, default=1000, help="生成するクリップ数")
+    parser.add_argument("--sentences", help="1行1文のテキストファイル（省略時は組み込みの練習文）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--min-rate", type=int, default=120)
+    parser.add_argument("--max-rate", type=int, default=220)
+    parser.add_argument("--min-pitch", type=int, default=30)
+    parser.add_argument("--max-pitch", type=int, default=70)
+    parser.add_argument("--max-padding", type=float, default=1.5, help="前後の無音の最大秒数")
+    parser.add_argument("--min-snr", type=float, default=5.0, help="ノイズのSN比の下限（dB）")
+    parser.add_argument("--max-snr", type=float, default=30.0, help="ノイズのSN比の上限（dB）")
+    parser.add_argument("--clean-ratio", type=float, default=0.3, help="ノイズを加えないクリップの割合")
+    args = parser.parse_args()
+
+    if args.sentences:
+        with open(args.sentences, encoding="utf-8") as f:
+            sentences = [line.strip() for line in f if line.strip()]
+    else:
+        sentences = DEFAULT_SENTENCES
+    if not sentences:
+        print("❌ 文のリストが空です")
+        sys.exit(1)
+
+    espeak = find_espeak()
+    os.makedirs(args.out, exist_ok=True)
+    clips = plan_clips(sentences, args.count, args.seed, args)
+    print(f"🗣️ 合成音声コーパス生成: {len(clips)}クリップ（{len(sentences)}文, seed={args.seed}）→ {args.out}")
+
+    manifest_path = os.path.join(args.out, "manifest.jsonl")
+    total_seconds = 0.0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor, open(manifest_path, "w", encoding="utf-8") as manifest:
+        # mapは入力順に結果を返すため、manifestの順序も再現できる
+        for count, clip in enumerate(executor.map(lambda c: synthesize(espeak, c, args.out), clips), 1):
+            manifest.write(json.dumps(asdict(clip), ensure_ascii=False) + "\n")
+            total_seconds += clip.seconds
+            if count % 100 == 0:
+                print(f"   {count}/{len(clips)}", flush=True)
+
+    print(f"✅ 完了: {len(clips)}クリップ / 合計{total_seconds / 60:.1f}分 → {manifest_path}")
+
+if __name__ == "__main__":
+    main()
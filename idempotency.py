@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+冪等キー（Idempotency-Key）による応答の保存
+スマホの通信が一瞬切れて同じアップロードが再送されたとき、推論をやり直さずに保存済みの応答を返す
+保存件数はLRUで、保存期間はTTLで上限を設ける
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+import whisper_metrics
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+class IdempotencyConflict(Exception):
+    """同じ冪等キーが別の内容のリクエストに使われた"""
+
+def fingerprint(data: bytes) -> str:
+    """リクエスト内容の指紋（キーの使い回しを検出するため）"""
+    return hashlib.sha256(data).hexdigest()
+
+class IdempotencyStore:
+    """
+    冪等キー → 完了済みの応答（LRU + TTL）
+    max_entries: 保存する最大件数 / ttl: 保存期間（秒）
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[float, str, Any]]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "IdempotencyStore":
+        return cls(
+            max_entries=int(os.environ.get("WHISPER_IDEMPOTENCY_MAX", "1024")),
+            ttl=float(os.environ.get("WHISPER_IDEMPOTENCY_TTL", "600")),
+        )
+
+    def get(self, key: Hashable, request_fingerprint: str) -> Optional[Any]:
+        """保存済みの応答を返す（なければNone、内容が違えばIdempotencyConflict）"""
+        whisper_metrics.increment("idempotency_lookups_total")
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, stored_fingerprint, response = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            if stored_fingerprint != request_fingerprint:
+                raise IdempotencyConflict("この冪等キーは別の音声で使用済みです")
+            self._entries.move_to_end(key)
+        whisper_metrics.increment("idempotent_replays_total")
+        return response
+
+    def put(self, key: Hashable, request_fingerprint: str, response: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, request_fingerprint, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def valid_key(key: Optional[str]) -> Optional[str]:
+    """空や長すぎるキーは無視する"""
+    if not key:
+        return None
+    key = key.strip()
+    return key if 0 < len(key) <= MAX_KEY_LENGTH else None
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+推論ジョブのスケジューラー
+非同期サーバーから受け取ったジョブを上限付きのキューに積み、専用スレッドで実行する
+キューが一杯のときは受け付けずにQueueFullを送出し、呼び出し側で503 + Retry-Afterを返す
+各ジョブは期限を持ち、期限の早い順（EDF）に実行する。期限内に終わらないジョブは実行せずに捨てる
+レーン（interactive / batch）ごとにキューを分け、練習中の録音を一括採点より先に処理する
+batchは空きがあれば使い、混雑時も最低限の割合（batch_share）は処理して飢餓を防ぐ
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import whisper_metrics
+
+LANES = ("interactive", "batch")
+
+class QueueFull(Exception):
+    """キューが一杯で受け付けられない"""
+    def __init__(self, retry_after: int):
+        super().__init__(f"推論キューが一杯です（{retry_after}秒後に再試行してください）")
+        self.retry_after = retry_after
+
+class DeadlineExceeded(Exception):
+    """期限までに処理を終えられない"""
+
+class Job:
+    """
+    キューに積まれる1件の推論
+    投入時のcontextvarsを保持し、推論スレッドでもその中で実行する（デコードの中止要求などを引き継ぐ）
+    """
+    _sequence = itertools.count()
+
+    def __init__(self, fn: Callable, args: tuple, loop: asyncio.AbstractEventLoop, deadline: float, lane: str):
+        self.fn = fn
+        self.args = args
+        self.loop = loop
+        self.deadline = deadline
+        self.lane = lane
+        self.future = loop.create_future()
+        self.context = contextvars.copy_context()
+        self.enqueued_at = time.monotonic()
+        self.order = next(self._sequence)
+
+    def __lt__(self, other: "Job") -> bool:
+        return (self.deadline, self.order) < (other.deadline, other.order)
+
+    def _resolve(self, result: Any = None, error: BaseException = None) -> None:
+        if self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+    def fail(self, error: BaseException) -> None:
+        self.loop.call_soon_threadsafe(self._resolve, None, error)
+
+    def run(self) -> None:
+        try:
+            result = self.context.run(self.fn, *self.args)
+        except BaseException as e:
+            self.fail(e)
+        else:
+            self.loop.call_soon_threadsafe(self._resolve, result)
+
+class Lane:
+    """1つの優先度クラスのキューと統計"""
+    def __init__(self, name: str):
+        self.name = name
+        self.queue: List[Job] = []
+        self.dispatched = 0
+        self.dropped = 0
+        self.wait_seconds = 0.0     # キュー待ち時間（指数移動平均）
+        self.latency_seconds = 0.0  # 投入から完了までの時間（指数移動平均）
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": len(self.queue),
+            "dispatched": self.dispatched,
+            "dropped": self.dropped,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "latency_seconds": round(self.latency_seconds, 3),
+        }
+
+class InferenceScheduler:
+    """
+    上限付きキュー + ワーカースレッドで推論を実行する
+    workers: 同時に実行する推論数 / max_queue: レーンごとに実行待ちで保持する最大件数
+    batch_share: 両レーンに待ちがあるとき、batchに割り当てる最低限の割合
+    """
+    def __init__(self, workers: int = 1, max_queue: int = 8, batch_share: float = 0.2):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.batch_share = batch_share
+        self.active = 0
+        self.service_time = 1.0  # 1件あたりの処理時間（秒、指数移動平均）
+        self.lanes = {name: Lane(name) for name in LANES}
+        self._recent: Deque[str] = deque(maxlen=20)  # 直近で取り出したジョブのレーン
+        self._cond = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"inference-{i}", daemon=True).start()
+
+    @property
+    def depth(self) -> int:
+        """実行待ちの件数（全レーン合計）"""
+        with self._cond:
+            return sum(len(lane.queue) for lane in self.lanes.values())
+
+    def stats(self) -> Dict[str, Any]:
+        """レーンごとの待ち件数と待ち時間・レイテンシ"""
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "active": self.active,
+                "service_time_seconds": round(self.service_time, 3),
+                "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+            }
+
+    def retry_after(self, lane: str = "interactive") -> int:
+        """今のキューが捌けるまでのおおよその秒数（interactiveはbatchを待たない）"""
+        lanes = self.lanes.values() if lane == "batch" else [self.lanes[lane]]
+        backlog = sum(len(l.queue) for l in lanes) + self.active
+        return max(1, math.ceil(self.service_time * backlog / self.workers))
+
+    def submit(self, fn: Callable, *args, deadline: Optional[float] = None, lane: str = "interactive") -> Job:
+        """
+        ジョブを積む（イベントループ上から呼ぶ）
+        deadline: time.monotonic()基準の期限。結果はJob.futureで受け取る
+        lane: "interactive" または "batch"
+        """
+        if lane not in self.lanes:
+            raise ValueError(f"未知のレーンです: {lane}")
+        job = Job(fn, args, asyncio.get_running_loop(), math.inf if deadline is None else deadline, lane)
+        with self._cond:
+            queue = self.lanes[lane].queue
+            if job.deadline - job.enqueued_at < self.service_time:
+                self.lanes[lane].dropped += 1
+                whisper_metrics.increment("scheduler_deadline_drops_total")
+                raise DeadlineExceeded("期限までに処理を終えられません")
+            if len(queue) >= self.max_queue:
+                raise QueueFull(self.retry_after(lane))
+            heapq.heappush(queue, job)
+            self._cond.notify()
+        return job
+
+    def extend_deadline(self, job: Job, deadline: float) -> None:
+        """
+        ジョブの期限を遅くする（早める変更は無視）
+        同じジョブの結果を待つリクエストが合流したとき、最も遅い期限まで破棄されないようにする
+        """
+        with self._cond:
+            if deadline <= job.deadline:
+                return
+            job.deadline = deadline
+            queue = self.lanes[job.lane].queue
+            if job in queue:
+                heapq.heapify(queue)
+
+    def cancel(self, job: Job) -> bool:
+        """実行待ちのジョブをキューから外す（実行中なら何もしない）"""
+        with self._cond:
+            queue = self.lanes[job.lane].queue
+            if job not in queue:
+                return False
+            queue.remove(job)
+            heapq.heapify(queue)
+        whisper_metrics.increment("scheduler_cancelled_total")
+        return True
+
+    def _pick_lane(self) -> Optional[Lane]:
+        """次に取り出すレーン（interactive優先、ただしbatchの最低割合は守る）"""
+        interactive, batch = self.lanes["interactive"], self.lanes["batch"]
+        if not batch.queue:
+            return interactive if interactive.queue else None
+        if not interactive.queue:
+            return batch
+        batch_ratio = self._recent.count("batch") / len(self._recent) if self._recent else 0.0
+        return batch if batch_ratio < self.batch_share else interactive
+
+    def _next_job(self) -> Job:
+        """期限の最も早いジョブを取り出す（間に合わないものは捨てる）"""
+        with self._cond:
+            while True:
+                lane = self._pick_lane()
+                while lane is None:
+                    self._cond.wait()
+                    lane = self._pick_lane()
+                job = heapq.heappop(lane.queue)
+                now = time.monotonic()
+                if now + self.service_time > job.deadline:
+                    lane.dropped += 1
+                    whisper_metrics.increment("scheduler_deadline_drops_total")
+                    job.fail(DeadlineExceeded("期限までに処理を終えられないため破棄しました"))
+                    continue
+                self._recent.append(lane.name)
+                lane.dispatched += 1
+                lane.wait_seconds = 0.8 * lane.wait_seconds + 0.2 * (now - job.enqueued_at)
+                whisper_metrics.histogram("queue_wait_seconds", now - job.enqueued_at, lane=lane.name)
+                self.active += 1
+                return job
+
+    def _worker(self) -> None:
+        while True:
+            job = self._next_job()
+            start = time.monotonic()
+            try:
+                job.run()
+            finally:
+                end = time.monotonic()
+                with self._cond:
+                    self.active -= 1
+                    self.service_time = 0.8 * self.service_time + 0.2 * (end - start)
+                    lane = self.lanes[job.lane]
+                    lane.latency_seconds = 0.8 * lane.latency_seconds + 0.2 * (end - job.enqueued_at)
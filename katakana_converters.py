@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+カタカナ変換器の一覧
+各app_*.pyの変換処理を名前で選べるようにする（一括採点・ベンチマーク用）
+モジュールはgradio等の重い依存を含むため、使うときに初めてimportする
+"""
+import importlib
+from typing import Callable, Dict, List, Tuple
+
+# 名前 → (モジュール, 順に適用する関数, 説明)
+CONVERTERS: Dict[str, Tuple[str, Tuple[str, ...], str]] = {
+    "app": ("app", ("convert_to_katakana_simple",), "Hugging Face Spaces版（音韻ルール）"),
+    "api": ("whisper_api", ("convert_to_katakana_simple",), "Flask API版（音韻ルール）"),
+    "final": ("app_final", ("japanese_english_katakana_conversion",), "日本人特化版"),
+    "optimized": ("app_optimized", ("advanced_katakana_conversion",), "最適化版"),
+    "simple": ("app_simple", ("english_to_katakana_phonetic",), "シンプル版"),
+    "advanced": ("app_advanced", ("phonetic_katakana_conversion_advanced",), "高精度版"),
+    "phonetic": ("app_phonetic", ("text_to_phonetic", "phonetic_to_katakana"), "発音記号経由"),
+    "phonetic_fixed": ("app_phonetic_fixed", ("word_to_katakana_conversion",), "辞書ベース修正版"),
+    "phonetic_symbols": ("app_phonetic_symbols", ("convert_to_katakana",), "発音記号表示版"),
+    "v2": ("app_v2", ("phonemize_text", "phonemes_to_katakana"), "Phonemizer（espeak）経由"),
+    "mecab": ("app_mecab_enhanced", ("convert_kanji_to_katakana_mecab",), "MeCab（日本語テキスト向け）"),
+    "test": ("whisper_test", ("convert_to_katakana_simple",), "置換辞書のみ"),
+    "japanese_mode": ("app_japanese_mode", ("clean_japanese_text",), "日本語モードの整形（カタカナ化なし）"),
+}
+
+def available_converters() -> List[str]:
+    return list(CONVERTERS)
+
+def get_converter(name: str) -> Callable[[str], str]:
+    """名前から変換関数（英語テキスト → カタカナ）を取得"""
+    if name not in CONVERTERS:
+        raise ValueError(f"未知の変換器です: {name}（{', '.join(CONVERTERS)}）")
+    module_name, function_names, _ = CONVERTERS[name]
+    module = importlib.import_module(module_name)
+    steps = [getattr(module, function_name) for function_name in function_names]
+    if len(steps) == 1:
+        return steps[0]
+
+    def convert(text: str) -> str:
+        for step in steps:
+            text = step(text)
+        return text
+    return convert
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+ローカルのサーバーに対する負荷試験（オープンループ）
+録音（またはコーパス）からリクエストを作り、指定した到着レート（ポアソン到着）で送り続ける
+応答が遅くても送信ペースは落とさず、レイテンシは予定到着時刻から計るため、過負荷時の待ちも結果に含まれる
+到着レートごとにレイテンシ分布・エラー率・拒否率（429/503）・達成スループットを出し、飽和点を求める
+
+対象:
+    transcribe  whisper_api.py / whisper_asgi.py の POST /transcribe（multipart の audio）
+    predict     Gradio（app.py）の POST /upload → POST /api/predict
+    expo        app/(tabs)/index.tsx と同じ送り方（POST /api/predict に multipart の data='[null, Blob]'）
+
+使い方:
+    python load_generator.py test_recording.m4a --url http://localhost:5001 --rates 0.5 1 2 4 --duration 60
+    python load_generator.py --mix requests.jsonl --url http://localhost:7860 --target predict
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Union
+
+from audio_files import collect_audio_files
+from bench_pipeline import percentile
+
+REJECT_STATUSES = (429, 503)
+TARGETS = ("transcribe", "predict", "expo")
+
+@dataclass
+class RequestSpec:
+    """送信するリクエスト1種類"""
+    name: str
+    audio: bytes
+    target: str = "transcribe"
+    headers: Dict[str, str] = field(default_factory=dict)
+
+@dataclass
+class Outcome:
+    status: int          # HTTPステータス（0は接続エラー・タイムアウト）
+    latency: float       # 予定到着時刻からの秒数
+    error: str = ""
+
+def multipart_body(fields: Dict[str, Union[str, tuple]]) -> tuple:
+    """multipart/form-dataの本文とContent-Type（fields: 名前 → 文字列 or (ファイル名, バイト列)）"""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f"--{boundary}\r\n".encode())
+        if isinstance(value, str):
+            body.write(f'Content-Disposition: form-data; name="{name}"\r\n\r\n'.encode())
+            body.write(value.encode())
+        else:
+            filename, data = value
+            body.write(f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'.encode())
+            body.write(b"Content-Type: application/octet-stream\r\n\r\n")
+            body.write(data)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+def post(url: str, body: bytes, content_type: str, headers: Dict[str, str], timeout: float) -> tuple:
+    request = urllib.request.Request(url, data=body, method="POST", headers={"Content-Type": content_type, **headers})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def send(base_url: str, spec: RequestSpec, timeout: float, fn_index: int) -> int:
+    """1リクエストを送ってステータスを返す"""
+    if spec.target == "transcribe":
+        body, content_type = multipart_body({"audio": (spec.name, spec.audio)})
+        status, _ = post(f"{base_url}/transcribe", body, content_type, spec.headers, timeout)
+        return status
+
+    if spec.target == "expo":
+        # index.tsxはBlobをJSON.stringifyするため、音声の中身は送られず '{}' になる（実機と同じ本文を再現）
+        body, content_type = multipart_body({"data": json.dumps([None, {}])})
+        status, _ = post(f"{base_url}/api/predict", body, content_type, {"Accept": "application/json", **spec.headers}, timeout)
+        return status
+
+    # Gradio: ファイルをアップロードしてから、そのパスで予測を呼ぶ
+    body, content_type = multipart_body({"files": (spec.name, spec.audio)})
+    status, payload = post(f"{base_url}/upload", body, content_type, spec.headers, timeout)
+    if status != 200:
+        return status
+    path = json.loads(payload)[0]
+    request = {"data": [{"path": path, "orig_name": spec.name, "meta": {"_type": "gradio.FileData"}}], "fn_index": fn_index}
+    status, _ = post(
+        f"{base_url}/api/predict", json.dumps(request).encode(), "application/json", spec.headers, timeout
+    )
+    return status
+
+def wav_bytes(audio, sample_rate: int) -> bytes:
+    """波形（float）を16bit WAVにエンコード"""
+    import numpy as np
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as target:
+        target.setnchannels(1)
+        target.setsampwidth(2)
+        target.setframerate(sample_rate)
+        target.writeframes((np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+def load_specs(args) -> List[RequestSpec]:
+    """リクエストの種類を用意（--mix のJSONL、corpus_store.pyのストア、または音声ファイル）"""
+    specs = []
+    if args.mix:
+        with open(args.mix, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    with open(row["file"], "rb") as audio:
+                        spec = RequestSpec(
+                            os.path.basename(row["file"]), audio.read(),
+                            row.get("target", args.target), row.get("headers", {}),
+                        )
+                    specs += [spec] * int(row.get("weight", 1))
+        return specs
+
+    for path in args.paths:
+        from corpus_store import CorpusStore
+        if CorpusStore.is_store(path):
+            store = CorpusStore(path)
+            for name in store.names()[:args.max_clips]:
+                specs.append(RequestSpec(os.path.basename(name) + ".wav", wav_bytes(store.audio(name), store.sample_rate), args.target))
+            continue
+        for file in collect_audio_files([path])[:max(0, args.max_clips - len(specs))]:
+            with open(file, "rb") as audio:
+                specs.append(RequestSpec(os.path.basename(file), audio.read(), args.target))
+    return specs[:args.max_clips]
+
+def run_rate(args, specs: List[RequestSpec], rate: float, rng: random.Random) -> Dict:
+    """1つの到着レートで duration 秒間送り続ける"""
+    outcomes: List[Outcome] = []
+    lock = threading.Lock()
+
+    def next_request() -> RequestSpec:
+        # 乱数は送信スレッドではなくここで引き、シードが同じなら同じ並びになるようにする
+        spec = rng.choice(specs)
+        headers = dict(spec.headers)
+        if args.batch_ratio and rng.random() < args.batch_ratio:
+            headers["X-Priority"] = "batch"
+        if args.idempotency:
+            headers["Idempotency-Key"] = uuid.uuid4().hex
+        return RequestSpec(spec.name, spec.audio, spec.target, headers)
+
+    def fire(spec: RequestSpec, scheduled: float) -> None:
+        try:
+            status, error = send(args.url, spec, args.timeout, args.fn_index), ""
+        except Exception as e:
+            status, error = 0, str(e)
+        with lock:
+            outcomes.append(Outcome(status, time.perf_counter() - scheduled, error))
+
+    start = time.perf_counter()
+    arrivals = 0
+    next_arrival = start
+    with ThreadPoolExecutor(max_workers=args.max_inflight) as executor:
+        while next_arrival - start < args.duration:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            spec = next_request()
+            executor.submit(fire, spec, next_arrival)
+            arrivals += 1
+            # 二重送信（モバイルの再送）を模擬
+            if args.duplicate_ratio and rng.random() < args.duplicate_ratio:
+                executor.submit(fire, spec, next_arrival)
+                arrivals += 1
+            next_arrival += rng.expovariate(rate)
+    elapsed = time.perf_counter() - start
+
+    ok = [o.latency for o in outcomes if 200 <= o.status < 300]
+    rejected = sum(o.status in REJECT_STATUSES for o in outcomes)
+    errors = len(outcomes) - len(ok) - rejected
+    return {
+        "rate": rate,
+        "sent": arrivals,
+        "ok": len(ok),
+        "rejected": rejected,
+        "errors": errors,
+        "rejection_rate": rejected / len(outcomes) if outcomes else 0.0,
+        "error_rate": errors / len(outcomes) if outcomes else 0.0,
+        "throughput": len(ok) / elapsed if elapsed else 0.0,
+        "latency": {
+            "p50": percentile(ok, 50),
+            "p90": percentile(ok, 90),
+            "p99": percentile(ok, 99),
+            "max": max(ok) if ok else 0.0,
+        },
+        "statuses": {str(s): sum(o.status == s for o in outcomes) for s in sorted({o.status for o in outcomes})},
+        "sample_errors": sorted({o.error for o in outcomes if o.error})[:5],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルサーバーへのオープンループ負荷試験")
+    parser.add_argument("paths", nargs="*", help="音声ファイル・ディレクトリ・ストア（--mix 省略時）")
+    parser.add_argument("--mix", help="リクエストの組み合わせ（JSONL: file, target, headers, weight）")
+    parser.add_argument("--url", default="http://localhost:5001", help="サーバーのURL")
+    parser.add_argument("--target", default="transcribe", choices=TARGETS)
+    parser.add_argument("--fn-index", type=int, default=0, help="Gradioの関数番号（predict用）")
+    parser.add_argument("--rates", type=float, nargs="+", default=[0.5, 1, 2, 4], help="到着レート（件/秒）")
+    parser.add_argument("--duration", type=float, default=60, help="レートごとの送信時間（秒）")
+    parser.add_argument("--timeout", type=float, default=60, help="1リクエストのタイムアウト（秒）")
+    parser.add_argument("--max-inflight", type=int, default=512, help="同時に送信中にできる最大数")
+    parser.add_argument("--max-clips", type=int, default=200, help="読み込む音声の最大数")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0, help="同じ音声を二重送信する割合")
+    parser.add_argument("--batch-ratio", type=float, default=0.0, help="X-Priority: batch を付ける割合")
+    parser.add_argument("--idempotency", action="store_true", help="Idempotency-Keyを付ける")
+    parser.add_argument("--slo-p99", type=float, default=5.0, help="飽和判定に使うp99レイテンシの上限（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="結果の保存先")
+    args = parser.parse_args()
+    args.url = args.url.rstrip("/")
+
+    specs = load_specs(args) if args.mix or args.paths else []
+    if not specs:
+        print("❌ 送信する音声がありません")
+        sys.exit(1)
+
+    rng = random.Random(args.seed)
+    print(f"🚦 負荷試験: {args.url} ({args.target}) / {len(specs)}種類の音声 / レート {args.rates} × {args.duration:.0f}秒")
+    results = []
+    for rate in args.rates:
+        result = run_rate(args, specs, rate, rng)
+        results.append(result)
+        latency = result["latency"]
+        print(
+            f"   {rate:6.2f}件/秒: 成功 {result['ok']}/{result['sent']} "
+            f"拒否 {result['rejection_rate']:.1%} エラー {result['error_rate']:.1%} "
+            f"p50 {latency['p50']:.2f}s p99 {latency['p99']:.2f}s → {result['throughput']:.2f}件/秒",
+            flush=True,
+        )
+
+    # SLO（p99・拒否/エラー1%未満）を満たした中で最大の達成スループット
+    healthy = [
+        r for r in results
+        if r["latency"]["p99"] <= args.slo_p99 and r["rejection_rate"] + r["error_rate"] < 0.01 and r["ok"]
+    ]
+    saturation = max((r["throughput"] for r in healthy), default=0.0)
+    peak = max((r["throughput"] for r in results), default=0.0)
+    print(f"📈 SLO内の最大スループット: {saturation:.2f}件/秒（最大達成: {peak:.2f}件/秒）")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "url": args.url, "target": args.target, "duration": args.duration,
+                "slo_p99": args.slo_p99, "saturation_throughput": saturation,
+                "peak_throughput": peak, "rates": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"✅ 結果保存: {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,13 @@
 基準テキストとの類似度でWhisper結果をフィルタリング
 """
 import difflib
+import logging
 from typing import Optional, List, Tuple
 
+from whisper_logging import get_logger
+
+log = get_logger("pronunciation_filter")
+
 class PronunciationFilter:
     def __init__(self):
         # 音韻変換テーブル（英語→音韻記号風）
@@ -74,10 +79,16 @@ class PronunciationFilter:
         similarity = self.calculate_similarity(reference, recognized)
         is_acceptable = similarity >= threshold
         
-        print(f"📏 類似度判定:")
-        print(f"   基準: '{reference}' → 音韻: '{self.to_phonetic(reference)}'")
-        print(f"   認識: '{recognized}' → 音韻: '{self.to_phonetic(recognized)}'")
-        print(f"   類似度: {similarity:.3f} ({'✅合格' if is_acceptable else '❌不合格'})")
+        # 音韻表記はログに出すときだけ計算する
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "📏 類似度判定: 基準 '%s' → 音韻 '%s' / 認識 '%s' → 音韻 '%s'",
+                reference, self.to_phonetic(reference), recognized, self.to_phonetic(recognized),
+            )
+        log.info(
+            "📏 類似度: %.3f (%s)", similarity, '✅合格' if is_acceptable else '❌不合格',
+            extra={"fields": {"event": "similarity", "similarity": round(similarity, 3), "acceptable": is_acceptable}},
+        )
         
         return is_acceptable, similarity
     
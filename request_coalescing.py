@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+同一音声リクエストの合流（single-flight）
+モバイルクライアントの再送・二重送信で同じ音声が短時間に重なって届くため、
+処理中の同じリクエスト（音声のハッシュ + 認識パラメータが一致）があればその結果を待って共有する
+"""
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import whisper_metrics
+from whisper_logging import get_logger
+
+log = get_logger("coalescing")
+
+def request_key(audio_data: bytes, params: Dict[str, Any]) -> str:
+    """音声のハッシュと認識パラメータから合流用のキーを作る"""
+    digest = hashlib.sha256(audio_data)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+class _Call:
+    """実行中の1件（後から来た同じリクエストはdoneを待つ）"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """同じキーの処理が実行中なら、新しく実行せずにその結果を待って共有する（スレッド用）"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable, *args) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            whisper_metrics.increment("coalesced_requests_total")
+            log.info("🔗 同じ音声の処理中リクエストに合流")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+bench_compare のMann-Whitney U検定のテスト（whisper不要）
+期待値は scipy.stats.mannwhitneyu(current, baseline, alternative="greater", method="asymptotic") と同じ
+
+実行: python -m pytest test_bench_compare.py
+"""
+import pytest
+
+from bench_compare import mann_whitney_greater
+
+def test_clearly_slower_is_significant():
+    assert mann_whitney_greater([6, 7, 8, 9, 10], [1, 2, 3, 4, 5]) == pytest.approx(0.006093, abs=1e-6)
+
+def test_faster_is_not_significant():
+    assert mann_whitney_greater([1, 2, 3, 4, 5], [6, 7, 8, 9, 10]) == pytest.approx(0.996692, abs=1e-6)
+
+def test_same_samples_are_not_significant():
+    assert mann_whitney_greater([1, 2, 3, 4, 5], [1, 2, 3, 4, 5]) == pytest.approx(0.542235, abs=1e-6)
+
+def test_ties_use_average_ranks_and_tie_correction():
+    assert mann_whitney_greater([1, 1, 2, 2, 3], [1, 2, 2, 3, 3]) == pytest.approx(0.811990, abs=1e-6)
+
+def test_degenerate_inputs_are_not_significant():
+    assert mann_whitney_greater([], [1.0, 2.0]) == 1.0
+    assert mann_whitney_greater([1.0, 2.0], []) == 1.0
+    # 全て同じ値（分散0）
+    assert mann_whitney_greater([0.5] * 5, [0.5] * 5) == 1.0
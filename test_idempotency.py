@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+idempotency の冪等キー保存（TTL・LRU・内容の不一致）のテスト（whisper不要）
+
+実行: python -m pytest test_idempotency.py
+"""
+import pytest
+
+from idempotency import MAX_KEY_LENGTH, IdempotencyConflict, IdempotencyStore, fingerprint, valid_key
+
+AUDIO = fingerprint(b"audio")
+
+def test_stored_response_is_replayed():
+    store = IdempotencyStore()
+    assert store.get("key", AUDIO) is None
+    store.put("key", AUDIO, {"text": "こんにちは"})
+    assert store.get("key", AUDIO) == {"text": "こんにちは"}
+
+def test_expired_response_is_not_replayed():
+    store = IdempotencyStore(ttl=-1)
+    store.put("key", AUDIO, {"text": "こんにちは"})
+    assert store.get("key", AUDIO) is None
+    assert len(store) == 0
+
+def test_least_recently_used_key_is_evicted():
+    store = IdempotencyStore(max_entries=2)
+    store.put("a", AUDIO, 1)
+    store.put("b", AUDIO, 2)
+    store.get("a", AUDIO)  # aを最近使ったことにする
+    store.put("c", AUDIO, 3)
+    assert store.get("b", AUDIO) is None
+    assert store.get("a", AUDIO) == 1
+    assert store.get("c", AUDIO) == 3
+
+def test_key_reused_for_different_audio_conflicts():
+    # サーバーはIdempotencyConflictを422で返す
+    store = IdempotencyStore()
+    store.put("key", AUDIO, {"text": "こんにちは"})
+    with pytest.raises(IdempotencyConflict):
+        store.get("key", fingerprint(b"other audio"))
+
+def test_valid_key():
+    assert valid_key(" abc ") == "abc"
+    assert valid_key("") is None
+    assert valid_key("   ") is None
+    assert valid_key("x" * (MAX_KEY_LENGTH + 1)) is None
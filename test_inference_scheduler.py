@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+inference_scheduler の実行順・期限切れの破棄・レーンの割り当て・合流時の期限延長のテスト（whisper不要）
+
+実行: python -m pytest test_inference_scheduler.py
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from inference_scheduler import DeadlineExceeded, InferenceScheduler
+
+async def hold_worker(scheduler: InferenceScheduler) -> threading.Event:
+    """ワーカーを1件のジョブで塞ぎ、後から積んだジョブをキューに溜める（戻り値をsetすると再開）"""
+    gate = threading.Event()
+    scheduler.submit(gate.wait, deadline=time.monotonic() + 60)
+    while scheduler.active == 0:
+        await asyncio.sleep(0.01)
+    return gate
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_jobs_run_earliest_deadline_first():
+    async def main():
+        scheduler = InferenceScheduler(max_queue=8)
+        gate = await hold_worker(scheduler)
+        order = []
+        now = time.monotonic()
+        jobs = [
+            scheduler.submit(order.append, name, deadline=now + offset)
+            for name, offset in [("late", 30), ("early", 10), ("middle", 20)]
+        ]
+        gate.set()
+        await asyncio.gather(*(job.future for job in jobs))
+        return order
+
+    assert run(main()) == ["early", "middle", "late"]
+
+def test_submit_rejects_deadline_shorter_than_service_time():
+    async def main():
+        scheduler = InferenceScheduler()
+        scheduler.submit(print, deadline=time.monotonic() + scheduler.service_time / 2)
+
+    with pytest.raises(DeadlineExceeded):
+        run(main())
+
+def test_job_whose_deadline_passes_in_queue_is_dropped():
+    async def main():
+        scheduler = InferenceScheduler()
+        scheduler.service_time = 0.05
+        gate = await hold_worker(scheduler)
+        ran = []
+        job = scheduler.submit(ran.append, "run", deadline=time.monotonic() + 0.2)
+        await asyncio.sleep(0.3)
+        gate.set()
+        with pytest.raises(DeadlineExceeded):
+            await job.future
+        return ran, scheduler.stats()["lanes"]["interactive"]["dropped"]
+
+    ran, dropped = run(main())
+    assert ran == []
+    assert dropped == 1
+
+def test_batch_lane_gets_its_share_while_interactive_is_busy():
+    async def main():
+        scheduler = InferenceScheduler(max_queue=20, batch_share=0.2)
+        gate = await hold_worker(scheduler)
+        order = []
+        deadline = time.monotonic() + 60
+        jobs = [
+            scheduler.submit(order.append, lane, deadline=deadline, lane=lane)
+            for lane in ["interactive"] * 10 + ["batch"] * 10
+        ]
+        gate.set()
+        await asyncio.gather(*(job.future for job in jobs))
+        return order
+
+    order = run(main())
+    # 両レーンに待ちがある間はinteractiveを優先しつつ、batchにも2割（10件中2件）を割り当てる
+    assert order[:10].count("batch") == 2
+    assert order[-1] == "batch"
+
+def test_extended_deadline_keeps_job_and_reorders_queue():
+    async def main():
+        scheduler = InferenceScheduler()
+        scheduler.service_time = 0.05
+        gate = await hold_worker(scheduler)
+        order = []
+        now = time.monotonic()
+        coalesced = scheduler.submit(order.append, "coalesced", deadline=now + 0.2)
+        other = scheduler.submit(order.append, "other", deadline=now + 5)
+        # 期限の遅いリクエストが合流した
+        scheduler.extend_deadline(coalesced, now + 10)
+        scheduler.extend_deadline(coalesced, now + 1)  # 早める変更は無視
+        await asyncio.sleep(0.3)
+        gate.set()
+        await asyncio.gather(coalesced.future, other.future)
+        return order, coalesced.deadline - now
+
+    order, deadline = run(main())
+    assert order == ["other", "coalesced"]
+    assert deadline == pytest.approx(10)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+request_coalescing の合流キーとsingle-flightのテスト（whisper不要）
+
+実行: python -m pytest test_request_coalescing.py
+"""
+import threading
+import time
+
+import whisper_metrics
+from request_coalescing import SingleFlight, request_key
+
+def test_request_key_depends_on_audio_and_params():
+    params = {"language": "ja", "beam_size": 5}
+    key = request_key(b"audio", params)
+    assert key == request_key(b"audio", {"beam_size": 5, "language": "ja"})
+    assert key != request_key(b"other", params)
+    assert key != request_key(b"audio", dict(params, beam_size=1))
+
+def wait_for_followers(before: float, count: int) -> None:
+    """後続の呼び出しが合流するまで待つ"""
+    limit = time.monotonic() + 5
+    while whisper_metrics.get_counters().get("coalesced_requests_total", 0) - before < count:
+        assert time.monotonic() < limit, "合流しませんでした"
+        time.sleep(0.01)
+
+def run_concurrently(flight: SingleFlight, fn, followers: int):
+    """1件目の実行中に同じキーで followers 件呼び出し、全員の結果（または例外）を返す"""
+    gate = threading.Event()
+    results = [None] * (followers + 1)
+
+    def leader_fn():
+        gate.wait()
+        return fn()
+
+    def call(i):
+        try:
+            results[i] = flight.do("key", leader_fn)
+        except Exception as e:
+            results[i] = e
+
+    before = whisper_metrics.get_counters().get("coalesced_requests_total", 0)
+    leader = threading.Thread(target=call, args=(0,))
+    leader.start()
+    while not flight._calls:
+        time.sleep(0.01)
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(1, followers + 1)]
+    for thread in threads:
+        thread.start()
+    wait_for_followers(before, followers)
+    gate.set()
+    for thread in [leader] + threads:
+        thread.join()
+    return results
+
+def test_concurrent_calls_share_one_execution():
+    calls = []
+
+    def transcribe():
+        calls.append(1)
+        return {"text": "こんにちは"}
+
+    results = run_concurrently(SingleFlight(), transcribe, followers=3)
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+def test_error_is_shared_and_key_is_released():
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError("デコード失敗")
+
+    results = run_concurrently(flight, fail, followers=2)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    # 失敗後は同じキーで新しく実行できる
+    assert flight.do("key", lambda: "retry") == "retry"
+
+def test_sequential_calls_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
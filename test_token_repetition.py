@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+token_repetition の繰り返し検出のテスト（whisper不要）
+
+実行: python -m pytest test_token_repetition.py
+"""
+from token_repetition import find_repeating_cycle
+
+# whisper_decoding.DecodeGuards の既定値
+MAX_PERIOD, MIN_REPEATS, MIN_SPAN = 12, 4, 12
+
+def detect(tokens):
+    return find_repeating_cycle(tokens, MAX_PERIOD, MIN_REPEATS, MIN_SPAN)
+
+def test_short_natural_repetition_is_not_a_loop():
+    # 「no no no no」「はいはいはい」のような短い繰り返し
+    assert detect([10, 20, 7, 7, 7, 7]) == 0
+    assert detect([10, 20, 5, 6, 5, 6, 5, 6, 5, 6]) == 0
+
+def test_long_repetition_of_short_unit_is_a_loop():
+    assert detect([10, 20] + [7] * 12) == 1
+    assert detect([10] + [5, 6] * 6) == 2
+
+def test_phrase_repeated_min_repeats_times_is_a_loop():
+    assert detect([1, 2] + [5, 6, 7] * 4) == 3
+    assert detect([1, 2] + [5, 6, 7] * 3) == 0
+
+def test_only_the_tail_counts():
+    assert detect([7] * 12 + [1, 2, 3]) == 0
+
+def test_without_min_span_short_repeats_are_loops():
+    assert find_repeating_cycle([7, 7, 7, 7], MAX_PERIOD, MIN_REPEATS) == 1
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+whisper_batch の一括文字起こしのテスト
+openai-whisper（tinyモデル）とffmpegが必要（無い環境ではスキップ）
+
+実行: python -m pytest test_whisper_batch.py
+"""
+import io
+import shutil
+import wave
+
+import pytest
+
+pytest.importorskip("whisper")
+if shutil.which("ffmpeg") is None:
+    pytest.skip("ffmpegが必要です", allow_module_level=True)
+
+import numpy as np
+
+import whisper_metrics
+from transcribe_options import TRANSCRIBE_OPTIONS
+from whisper_batch import BatchItem, transcribe_batch
+from whisper_runtime import load_whisper_model
+
+def wav_bytes(seconds: float, frequency: float) -> bytes:
+    """16kHzモノラルの正弦波のWAV"""
+    t = np.arange(int(16000 * seconds)) / 16000
+    samples = (np.sin(2 * np.pi * frequency * t) * 0.3 * 32767).astype(np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+def no_fallback(audio_data: bytes) -> str:
+    raise AssertionError("30秒以内の音声が1件ずつの文字起こしに回された")
+
+@pytest.fixture(scope="module")
+def model():
+    return load_whisper_model("tiny")
+
+def test_bucket_is_decoded_as_one_batch(model):
+    # whisper_apiと同じ設定（best_of=3 なので n_group=3 でバッチデコードする）
+    items = [BatchItem(i, f"{i}.wav", wav_bytes(1.0 + i, 220.0 * (i + 1))) for i in range(3)]
+    before = whisper_metrics.get_counters().get("batch_decode_items_total", 0)
+
+    results = list(transcribe_batch(model, items, TRANSCRIBE_OPTIONS, no_fallback, convert=str, batch_size=8))
+
+    assert sorted(result["index"] for result in results) == [0, 1, 2]
+    assert all(result["success"] and result["batched"] for result in results)
+    assert whisper_metrics.get_counters()["batch_decode_items_total"] - before == 3
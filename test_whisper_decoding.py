@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+whisper_decoding のデコードガードのテスト
+openai-whisperが必要（無い環境ではスキップ）
+
+実行: python -m pytest test_whisper_decoding.py
+"""
+import math
+
+import pytest
+
+pytest.importorskip("whisper")
+
+import numpy as np
+import whisper
+from whisper.audio import N_FRAMES, N_SAMPLES, SAMPLE_RATE
+
+from whisper_decoding import DecodeGuards, token_budgets
+
+def tone(seconds: float, frequency: float = 440.0) -> np.ndarray:
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (np.sin(2 * np.pi * frequency * t) * 0.3).astype(np.float32)
+
+def test_short_clip_padded_by_transcribe_gets_short_budget():
+    # transcribeと同じ作り方: 末尾を無音で伸ばしてメルにし、セグメントを切り出して0埋めで3000フレームにする
+    audio = tone(2.0)
+    mel = whisper.log_mel_spectrogram(audio, 80, padding=N_SAMPLES)
+    content_frames = mel.shape[-1] - N_FRAMES
+    segment = whisper.pad_or_trim(mel[:, :content_frames], N_FRAMES)
+    assert segment.shape[-1] == N_FRAMES
+
+    guards = DecodeGuards()
+    (budget,) = token_budgets(segment, 80, guards)
+
+    # 2秒分（端の誤差を含めて3秒以内）の上限になる
+    assert budget <= math.ceil(3.0 * guards.tokens_per_second) + guards.token_slack
+    assert budget >= math.ceil(1.0 * guards.tokens_per_second) + guards.token_slack
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+whisper_metrics のPrometheus形式の出力のテスト（whisper不要）
+
+実行: python -m pytest test_whisper_metrics.py
+"""
+import pytest
+
+import whisper_metrics
+
+@pytest.fixture(autouse=True)
+def clean_metrics(monkeypatch):
+    whisper_metrics.reset()
+    monkeypatch.setattr(whisper_metrics, "_gauges", {})
+    yield
+    whisper_metrics.reset()
+
+def rendered_lines():
+    return whisper_metrics.render_prometheus().splitlines()
+
+def test_counters_are_grouped_by_family_with_labels():
+    whisper_metrics.increment("decode_attempts_total", temperature="0.0")
+    whisper_metrics.increment("decode_attempts_total", temperature="0.2")
+    whisper_metrics.increment("decode_attempts_total", temperature="0.0")
+    whisper_metrics.increment("retry_seconds_total", 0.25)
+
+    lines = rendered_lines()
+    assert lines.count("# TYPE whisper_decode_attempts_total counter") == 1
+    assert 'whisper_decode_attempts_total{temperature="0.0"} 2' in lines
+    assert 'whisper_decode_attempts_total{temperature="0.2"} 1' in lines
+    assert "whisper_retry_seconds_total 0.25" in lines
+
+def test_histogram_buckets_are_cumulative():
+    for seconds in (0.02, 0.3, 0.3, 50.0):
+        whisper_metrics.histogram("queue_wait_seconds", seconds, buckets=(0.1, 1.0), lane="batch")
+
+    lines = rendered_lines()
+    assert "# TYPE whisper_queue_wait_seconds histogram" in lines
+    assert 'whisper_queue_wait_seconds_bucket{lane="batch",le="0.1"} 1' in lines
+    assert 'whisper_queue_wait_seconds_bucket{lane="batch",le="1.0"} 3' in lines
+    assert 'whisper_queue_wait_seconds_bucket{lane="batch",le="+Inf"} 4' in lines
+    assert 'whisper_queue_wait_seconds_sum{lane="batch"} 50.62' in lines
+    assert 'whisper_queue_wait_seconds_count{lane="batch"} 4' in lines
+
+def test_label_values_are_escaped():
+    whisper_metrics.increment("errors_total", reason='bad "file"\n')
+    assert 'whisper_errors_total{reason="bad \\"file\\"\\n"} 1' in rendered_lines()
+
+def test_gauges_are_read_at_render_time():
+    depth = {"value": 3}
+    whisper_metrics.register_gauge("queue_depth", lambda: {(("lane", "batch"),): depth["value"]})
+    whisper_metrics.register_gauge("broken", lambda: 1 / 0)
+    assert 'whisper_queue_depth{lane="batch"} 3' in rendered_lines()
+
+    depth["value"] = 5
+    lines = rendered_lines()
+    assert 'whisper_queue_depth{lane="batch"} 5' in lines
+    # 取得に失敗したゲージだけ出力されない
+    assert not any(line.startswith("whisper_broken") for line in lines)
+    assert "# TYPE whisper_process_resident_memory_bytes gauge" in lines
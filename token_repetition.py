@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+トークン列の繰り返し検出
+whisper_decoding の RepetitionLoopFilter が使う（whisper・torchに依存しない）
+"""
+import math
+from typing import List
+
+def find_repeating_cycle(tokens: List[int], max_period: int, min_repeats: int, min_span: int = 0) -> int:
+    """
+    末尾が同じn-gramの連続になっていればその周期を返す（なければ0）
+    例: [.., 5, 6, 7, 5, 6, 7, 5, 6, 7, 5, 6, 7] → 3
+    短い周期は繰り返し部分が min_span トークン以上になるまでループとみなさない
+    （「no no no no」のような自然な短い繰り返しを止めないため）
+    """
+    n = len(tokens)
+    for period in range(1, max_period + 1):
+        repeats = max(min_repeats, math.ceil(min_span / period))
+        span = period * repeats
+        if span > n:
+            continue
+        tail = tokens[n - span:]
+        if tail[period:] == tail[:-period]:
+            return period
+    return 0
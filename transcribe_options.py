@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""
+whisper_api（Flask版・ASGI版・一括文字起こし）とbatch_grade.pyで共通の認識設定
+生徒が見る結果とオフライン採点の結果を揃えるため、設定はここだけに書く
+"""
+
+# 英語認識で実際の発音を取得（誤認識促進設定）
+TRANSCRIBE_OPTIONS = dict(
+    language="en",          # 英語として認識
+    temperature=0.8,        # 少し高めで多様性を持たせる
+    best_of=3,             # 候補数を適度に設定
+    beam_size=3,           # ビーム探索を適度に設定
+    compression_ratio_threshold=2.0,  # 品質基準を緩める
+    logprob_threshold=-1.5  # 確信度基準を緩める
+)
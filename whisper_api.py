@@ -3,13 +3,24 @@
 Web API for Whisper transcription
 シンプルなFlask APIでWhisper処理を提供
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-import whisper
+import whisper_metrics
+import whisper_profiler
+import whisper_tracing
+from whisper_logging import get_logger
+from whisper_runtime import load_whisper_model
+from request_coalescing import SingleFlight, request_key
+from whisper_batch import BatchItem, transcribe_batch
+from idempotency import IDEMPOTENCY_HEADER, IdempotencyConflict, IdempotencyStore, fingerprint, valid_key
+from transcribe_options import TRANSCRIBE_OPTIONS
+import contextlib
 import tempfile
 import os
 import base64
 import difflib
+import json
+import time
 
 app = Flask(__name__)
 CORS(app)  # React アプリからのアクセスを許可
@@ -17,19 +28,36 @@ CORS(app)  # React アプリからのアクセスを許可
 # Whisperモデルをグローバルで読み込み（初回のみ）
 model = None
 
+log = get_logger("api")
+
+# /transcribe/batch の上限（1リクエストのファイル数・1回のバッチデコード件数）
+MAX_BATCH_FILES = int(os.environ.get("WHISPER_MAX_BATCH_FILES", "64"))
+BATCH_SIZE = int(os.environ.get("WHISPER_BATCH_SIZE", "8"))
+
+# 同じ音声の同時リクエストは1回の文字起こしにまとめる
+transcribe_flight = SingleFlight()
+
+# 再送されたアップロード（同じIdempotency-Key）には保存済みの応答を返す
+idempotency_store = IdempotencyStore.from_env()
+
 def setup_whisper():
     """Whisperモデルをセットアップ"""
     global model
     if model is None:
         print("Whisper tinyモデルをロード中...")
-        model = whisper.load_model("tiny")
+        model = load_whisper_model("tiny")
         print("✅ Whisperモデル読み込み完了")
     return model
 
 def transcribe_with_whisper(audio_data):
     """
     音声データをWhisperで文字起こし（誤認識促進設定）
+    同じ音声が処理中なら、その結果を待って共有する
     """
+    key = request_key(audio_data, TRANSCRIBE_OPTIONS)
+    return transcribe_flight.do(key, _transcribe_audio, audio_data)
+
+def _transcribe_audio(audio_data):
     model = setup_whisper()
     
     try:
@@ -38,23 +66,12 @@ def transcribe_with_whisper(audio_data):
             tmp_file.write(audio_data)
             tmp_file_path = tmp_file.name
         
-        print(f"🎤 音声ファイルを分析中: {tmp_file_path}")
+        log.debug("🎤 音声ファイルを分析中: %s", tmp_file_path)
         
-        # 英語認識で実際の発音を取得
-        result = model.transcribe(
-            tmp_file_path,
-            language="en",          # 英語として認識
-            temperature=0.8,        # 少し高めで多様性を持たせる
-            best_of=3,             # 候補数を適度に設定
-            beam_size=3,           # ビーム探索を適度に設定
-            compression_ratio_threshold=2.0,  # 品質基準を緩める
-            logprob_threshold=-1.5  # 確信度基準を緩める
-        )
+        result = model.transcribe(tmp_file_path, **TRANSCRIBE_OPTIONS)
         
         raw_text = result["text"].strip()
-        print(f"📝 Whisper結果: '{raw_text}'", flush=True)
-        print(f"📋 結果の長さ: {len(raw_text)}", flush=True)
-        print(f"📋 結果が空: {raw_text == ''}", flush=True)
+        log.info("📝 Whisper結果: '%s'", raw_text, extra={"fields": {"event": "transcribed", "chars": len(raw_text)}})
         
         # 一時ファイルを削除
         os.unlink(tmp_file_path)
@@ -62,7 +79,7 @@ def transcribe_with_whisper(audio_data):
         return raw_text
         
     except Exception as e:
-        print(f"❌ Whisper文字起こし失敗: {e}")
+        log.error("❌ Whisper文字起こし失敗: %s", e)
         # 一時ファイルを削除（エラー時も）
         if 'tmp_file_path' in locals():
             try:
@@ -71,13 +88,14 @@ def transcribe_with_whisper(audio_data):
                 pass
         raise e
 
+@whisper_metrics.timed("katakana")
 def convert_to_katakana_simple(text):
     """
     音韻ルールベースのカタカナ変換（任意の英単語に対応）
     """
-    print(f"🔤 カタカナ変換入力: '{text}'", flush=True)
+    log.debug("🔤 カタカナ変換入力: '%s'", text)
     if not text:
-        print("⚠️ 空のテキストです")
+        log.warning("⚠️ 空のテキストです")
         return "？？？"
     
     def convert_word_to_katakana(word):
@@ -132,7 +150,7 @@ def convert_to_katakana_simple(text):
     converted_words = [convert_word_to_katakana(word) for word in words]
     result = ' '.join(converted_words)
     
-    print(f"🎌 カタカナ変換結果: '{result}'")
+    log.info("🎌 カタカナ変換結果: '%s'", result, extra={"fields": {"event": "katakana"}})
     return result
 
 def should_exclude_result(reference: str, recognized: str) -> bool:
@@ -162,16 +180,19 @@ def should_exclude_result(reference: str, recognized: str) -> bool:
     # 30%未満は除外
     should_exclude = similarity < 0.3
     
-    print(f"🔍 除外判定: '{reference}' vs '{recognized}'")
-    print(f"   類似度: {similarity:.3f} ({'除外' if should_exclude else '許可'})")
+    log.debug(
+        "🔍 除外判定: '%s' vs '%s' 類似度: %.3f (%s)",
+        reference, recognized, similarity, '除外' if should_exclude else '許可',
+    )
     
     return should_exclude
 
+@whisper_metrics.timed("katakana")
 def convert_japanese_to_katakana(text):
     """
     日本語（ひらがな・漢字・数字）をカタカナに変換
     """
-    print(f"🇯🇵 日本語→カタカナ変換入力: '{text}'", flush=True)
+    log.debug("🇯🇵 日本語→カタカナ変換入力: '%s'", text)
     
     if not text:
         return "？？？"
@@ -216,9 +237,41 @@ def convert_japanese_to_katakana(text):
         else:
             katakana_result += char  # 記号等はそのまま
     
-    print(f"🎌 日本語→カタカナ変換結果: '{katakana_result}'", flush=True)
+    log.info("🎌 日本語→カタカナ変換結果: '%s'", katakana_result, extra={"fields": {"event": "katakana"}})
     return katakana_result
 
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    # X-Request-IDがあればそれを使い、以降のログ・トレースに付ける
+    g.trace = whisper_tracing.start(
+        f'{request.method} {request.path}', request.headers.get(whisper_tracing.REQUEST_ID_HEADER)
+    )
+    # プロファイリング中なら、このリクエストを計測対象に数える（管理用のリクエストは除く）
+    if not request.path.startswith('/admin/'):
+        g.profile_scope = contextlib.ExitStack()
+        g.profile_scope.enter_context(whisper_profiler.profile_request())
+
+@app.after_request
+def count_request(response):
+    """エンドポイント・ステータスごとのリクエスト数と所要時間を記録"""
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    whisper_metrics.increment('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    if 'request_start' in g:
+        whisper_metrics.histogram('http_request_seconds', time.perf_counter() - g.request_start, endpoint=endpoint)
+    if 'trace' in g:
+        g.trace.set(status=response.status_code)
+        response.headers[whisper_tracing.REQUEST_ID_HEADER] = g.trace.request_id
+    return response
+
+@app.teardown_request
+def finish_trace(_):
+    # ストリーミング応答（/transcribe/batch）の本文はこの後に生成されるため、トレースには含まれない
+    if 'trace' in g:
+        g.pop('trace').finish()
+    if 'profile_scope' in g:
+        g.pop('profile_scope').close()
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
     """
@@ -235,6 +288,19 @@ def transcribe():
         if len(audio_data) == 0:
             return jsonify({'error': '音声データが空です'}), 400
         
+        # 再送（同じ冪等キー）なら保存済みの応答を返す
+        idempotency_key = valid_key(request.headers.get(IDEMPOTENCY_HEADER))
+        audio_fingerprint = fingerprint(audio_data)
+        if idempotency_key:
+            try:
+                stored = idempotency_store.get(idempotency_key, audio_fingerprint)
+            except IdempotencyConflict as e:
+                return jsonify({'success': False, 'error': str(e)}), 422
+            if stored is not None:
+                log.info("♻️ 冪等キーが一致したため保存済みの結果を返します")
+                response = jsonify(stored)
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
         
         # Whisperで文字起こし
         raw_text = transcribe_with_whisper(audio_data)
@@ -242,24 +308,85 @@ def transcribe():
         # 英語→カタカナ変換
         katakana_text = convert_to_katakana_simple(raw_text)
         
-        return jsonify({
+        result = {
             'success': True,
             'whisper_raw': raw_text,
             'whisper_katakana': katakana_text
-        })
+        }
+        if idempotency_key:
+            idempotency_store.put(idempotency_key, audio_fingerprint, result)
+        return jsonify(result)
         
     except Exception as e:
-        print(f"❌ API エラー: {e}")
+        log.exception("❌ API エラー: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@app.route('/transcribe/batch', methods=['POST'])
+def transcribe_batch_endpoint():
+    """
+    複数の音声ファイルをまとめて文字起こし（フィールド名 audio を複数指定）
+    音声長の近いものをまとめてバッチ推論し、終わったものから1行1件のNDJSONで返す
+    """
+    files = request.files.getlist('audio')
+    if not files:
+        return jsonify({'error': '音声ファイルがありません'}), 400
+    if len(files) > MAX_BATCH_FILES:
+        return jsonify({'error': f'ファイル数が多すぎます（最大{MAX_BATCH_FILES}件）'}), 413
+
+    # レスポンスのストリーミング中はリクエストを読めないため、先に全ファイルを読み込む
+    items = [
+        BatchItem(index, audio_file.filename or f'audio_{index}', audio_file.read())
+        for index, audio_file in enumerate(files)
+    ]
+    model = setup_whisper()
+
+    def generate():
+        for result in transcribe_batch(
+            model, items, TRANSCRIBE_OPTIONS,
+            fallback=transcribe_with_whisper,
+            convert=convert_to_katakana_simple,
+            batch_size=BATCH_SIZE,
+        ):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
 @app.route('/health', methods=['GET'])
 def health():
     """ヘルスチェック"""
     return jsonify({'status': 'OK', 'message': 'Whisper API is running'})
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus形式の計測値"""
+    return Response(whisper_metrics.render_prometheus(), content_type=whisper_metrics.CONTENT_TYPE)
+
+@app.route('/admin/profile', methods=['POST'])
+def admin_profile():
+    """
+    次のrequests件のリクエスト、またはseconds秒の間プロファイリングして結果を返す（終わるまで応答しない）
+    クエリ: mode=stack|cprofile, seconds, requests, interval_ms, format=text（cprofileのみ）
+    WHISPER_ADMIN_TOKENと同じトークンを X-Admin-Token または Authorization: Bearer で渡す
+    """
+    headers = {key.lower(): value for key, value in request.headers.items()}
+    if not whisper_profiler.authorized(whisper_profiler.token_from_headers(headers)):
+        # トークン未設定・不一致のときは存在しないものとして扱う
+        return jsonify({'error': 'Not Found'}), 404
+    unavailable = whisper_profiler.endpoint_unavailable()
+    if unavailable:
+        return jsonify({'error': unavailable}), 501
+    try:
+        session = whisper_profiler.run(**whisper_profiler.parse_params(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except whisper_profiler.ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    body, content_type = whisper_profiler.response_body(session, request.args)
+    return Response(body, content_type=content_type)
+
 if __name__ == '__main__':
     print("🚀 Whisper API サーバー起動中...")
     setup_whisper()  # 起動時にモデルをロード
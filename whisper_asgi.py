@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+whisper_api の非同期（ASGI）版
+アップロードの受信はイベントループ上でブロックせずに行い、推論は上限付きキューに渡す
+キューが一杯のときは 503 + Retry-After を返して、スレッドが溜まり続けるのを防ぐ
+各リクエストは期限（X-Request-Timeout ヘッダーの秒数、なければ既定値）を持ち、
+期限に間に合わない・クライアントが切断した場合は推論を打ち切る
+X-Priority: batch を付けたリクエスト（一括採点など）は、練習中の録音より後回しにする
+同じ音声が処理中なら新しくキューに積まず、そのジョブの結果を待つ
+GET /stats でレーンごとの状況、GET /metrics でPrometheus形式の計測値を返す
+
+使い方:
+    uvicorn whisper_asgi:app --host 0.0.0.0 --port 5001
+環境変数:
+    WHISPER_ASGI_WORKERS  推論スレッド数（1のみ対応。2以上は起動時にエラー）
+    WHISPER_ASGI_QUEUE    実行待ちで保持する最大件数（既定: 8）
+    WHISPER_REQUEST_TIMEOUT  ヘッダーがないときの期限（秒、既定: 30）
+    WHISPER_BATCH_SHARE   混雑時にbatchへ割り当てる最低限の割合（既定: 0.2）
+"""
+import asyncio
+import email.parser
+import email.policy
+import functools
+import json
+import os
+import threading
+import time
+import urllib.parse
+from typing import Dict, Iterable, Optional, Tuple
+
+import whisper_api
+import whisper_metrics
+import whisper_profiler
+import whisper_tracing
+from inference_scheduler import LANES, DeadlineExceeded, InferenceScheduler, Job, QueueFull
+from request_coalescing import request_key
+from idempotency import IDEMPOTENCY_HEADER, IdempotencyConflict, fingerprint, valid_key
+from whisper_decoding import DecodeCancelled, cancellation_scope
+from whisper_logging import get_logger
+
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+MAX_REQUEST_TIMEOUT = 300.0
+
+scheduler: Optional[InferenceScheduler] = None
+
+log = get_logger("asgi")
+
+class InflightRequest:
+    """キューに積んだジョブと、その結果を待っているリクエスト数"""
+    def __init__(self, job: Job, cancel_event: threading.Event):
+        self.job = job
+        self.cancel_event = cancel_event
+        self.waiters = 1
+
+# 合流用のキー → 処理中のジョブ（イベントループ上でのみ触るためロック不要）
+inflight: Dict[str, InflightRequest] = {}
+
+def setup_scheduler() -> InferenceScheduler:
+    """推論スケジューラーをセットアップ"""
+    global scheduler
+    if scheduler is None:
+        workers = int(os.environ.get("WHISPER_ASGI_WORKERS", "1"))
+        # デコード中のKVキャッシュは共有モデルのデコーダーに付けたフックに書き込まれるため、
+        # 1つのモデルで同時に2件デコードすると互いのキャッシュを壊す（並列化はプロセス単位で行う）
+        if workers != 1:
+            raise ValueError(
+                f"WHISPER_ASGI_WORKERS={workers} には対応していません（1つのモデルを複数スレッドで同時に使えないため1のみ）。"
+                "並列に処理する場合はuvicornのプロセスを増やしてください"
+            )
+        scheduler = InferenceScheduler(
+            workers=workers,
+            max_queue=int(os.environ.get("WHISPER_ASGI_QUEUE", "8")),
+            batch_share=float(os.environ.get("WHISPER_BATCH_SHARE", "0.2")),
+        )
+        whisper_metrics.register_gauge("scheduler_queue_depth", lambda: {
+            (("lane", name),): lane["depth"] for name, lane in scheduler.stats()["lanes"].items()
+        })
+        whisper_metrics.register_gauge("scheduler_active_jobs", lambda: scheduler.active)
+        whisper_metrics.register_gauge("inflight_requests", lambda: len(inflight))
+    return scheduler
+
+def run_pipeline(audio_data: bytes) -> Dict:
+    """推論スレッドで実行する処理（Flask版の/transcribeと同じ内容）"""
+    with whisper_profiler.profile_request():
+        raw_text = whisper_api.transcribe_with_whisper(audio_data)
+        katakana_text = whisper_api.convert_to_katakana_simple(raw_text)
+    return {
+        'success': True,
+        'whisper_raw': raw_text,
+        'whisper_katakana': katakana_text
+    }
+
+def prepare_upload(content_type: bytes, body: bytes) -> Tuple[Optional[bytes], str, str]:
+    """
+    (音声, 冪等キー用の指紋, 合流用のキー)
+    マルチパートの解析と音声全体のハッシュはCPUを使うため、イベントループとは別のスレッドで呼ぶ
+    """
+    audio_data = parse_multipart(content_type, body).get('audio')
+    if not audio_data:
+        return audio_data, "", ""
+    return audio_data, fingerprint(audio_data), request_key(audio_data, whisper_api.TRANSCRIBE_OPTIONS)
+
+def parse_multipart(content_type: bytes, body: bytes) -> Dict[str, bytes]:
+    """multipart/form-dataをフィールド名 → 内容の辞書にする"""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type + b"\r\n\r\n" + body
+    )
+    fields = {}
+    if message.is_multipart():
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name:
+                fields[name] = part.get_payload(decode=True) or b""
+    return fields
+
+async def send_json(send, status: int, payload: Dict, headers: Iterable[Tuple[bytes, bytes]] = ()) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json; charset=utf-8"),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+def request_deadline(headers: Dict[bytes, bytes], received_at: float) -> float:
+    """リクエストの期限（time.monotonic()基準）"""
+    default = float(os.environ.get("WHISPER_REQUEST_TIMEOUT", "30"))
+    try:
+        timeout = float(headers.get(b"x-request-timeout", b"") or default)
+    except ValueError:
+        timeout = default
+    return received_at + min(max(timeout, 0.0), MAX_REQUEST_TIMEOUT)
+
+def request_lane(headers: Dict[bytes, bytes]) -> str:
+    """X-Priorityヘッダーからレーンを決める（不明な値はinteractive扱い）"""
+    lane = headers.get(b"x-priority", b"").decode("latin-1").strip().lower()
+    return lane if lane in LANES else "interactive"
+
+async def wait_for_disconnect(receive) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def read_body(receive) -> Optional[bytes]:
+    """リクエストボディを非同期で読み込む（上限を超えたらNone）"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+def submit_job(scheduler: InferenceScheduler, key: str, audio_data: bytes, deadline: float, lane: str) -> InflightRequest:
+    """推論ジョブをキューに積み、完了するまで合流できるよう登録する"""
+    cancel_event = threading.Event()
+    # ジョブは投入時のコンテキストごと推論スレッドへ渡るため、ここで中止用のイベントを設定する
+    with cancellation_scope(cancel_event):
+        job = scheduler.submit(run_pipeline, audio_data, deadline=deadline, lane=lane)
+    entry = inflight[key] = InflightRequest(job, cancel_event)
+
+    def unregister(_):
+        if inflight.get(key) is entry:
+            del inflight[key]
+
+    job.future.add_done_callback(unregister)
+    return entry
+
+async def transcribe(scope, receive, send) -> None:
+    """音声データを受け取ってWhisperで文字起こし"""
+    headers = dict(scope["headers"])
+    deadline = request_deadline(headers, time.monotonic())
+    body = await read_body(receive)
+    if body is None:
+        await send_json(send, 413, {'error': '音声ファイルが大きすぎます'})
+        return
+
+    # 最大25MBの解析とハッシュ計算の間も、他の接続の受信・応答を止めない
+    audio_data, audio_fingerprint, key = await asyncio.get_running_loop().run_in_executor(
+        None, prepare_upload, headers.get(b"content-type", b""), body
+    )
+    if audio_data is None:
+        await send_json(send, 400, {'error': '音声ファイルがありません'})
+        return
+    if len(audio_data) == 0:
+        await send_json(send, 400, {'error': '音声データが空です'})
+        return
+
+    # 再送（同じ冪等キー）なら保存済みの応答を返す（Flask版と保存先を共有）
+    idempotency_key = valid_key(headers.get(IDEMPOTENCY_HEADER.lower().encode(), b"").decode("latin-1"))
+    if idempotency_key:
+        try:
+            stored = whisper_api.idempotency_store.get(idempotency_key, audio_fingerprint)
+        except IdempotencyConflict as e:
+            await send_json(send, 422, {'success': False, 'error': str(e)})
+            return
+        if stored is not None:
+            log.info("♻️ 冪等キーが一致したため保存済みの結果を返します")
+            await send_json(send, 200, stored, headers=[(b"idempotent-replayed", b"true")])
+            return
+
+    scheduler = setup_scheduler()
+    entry = inflight.get(key)
+    try:
+        if entry is not None:
+            entry.waiters += 1
+            # 先に来たリクエストの期限で破棄されないよう、待っている中で最も遅い期限に合わせる
+            scheduler.extend_deadline(entry.job, deadline)
+            whisper_metrics.increment("coalesced_requests_total")
+            log.info("🔗 同じ音声の処理中リクエストに合流")
+        else:
+            entry = submit_job(scheduler, key, audio_data, deadline, request_lane(headers))
+    except DeadlineExceeded as e:
+        await send_json(send, 504, {'success': False, 'error': str(e)})
+        return
+    except QueueFull as e:
+        log.warning("⏳ 推論キューが一杯のため拒否（Retry-After: %s秒）", e.retry_after)
+        await send_json(
+            send, 503,
+            {'success': False, 'error': str(e)},
+            headers=[(b"retry-after", str(e.retry_after).encode())],
+        )
+        return
+
+    job = entry.job
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        done, _ = await asyncio.wait(
+            {job.future, disconnect},
+            timeout=max(deadline - time.monotonic(), 0.0),
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+    finally:
+        disconnect.cancel()
+
+    if job.future not in done:
+        # 待っているリクエストがいなくなったら、実行待ちならキューから外し、実行中ならデコードループに中止を伝える
+        entry.waiters -= 1
+        if entry.waiters == 0:
+            entry.cancel_event.set()
+            scheduler.cancel(job)
+            job.future.cancel()
+        if disconnect in done:
+            log.info("🔌 クライアントが切断したため推論を中止")
+            return
+        log.warning("⌛ 期限切れのため推論を中止")
+        await send_json(send, 504, {'success': False, 'error': '期限までに処理を終えられませんでした'})
+        return
+
+    try:
+        result = job.future.result()
+    except (DeadlineExceeded, DecodeCancelled) as e:
+        await send_json(send, 504, {'success': False, 'error': str(e)})
+        return
+    except Exception as e:
+        log.error("❌ API エラー: %s", e, exc_info=e)
+        await send_json(send, 500, {'success': False, 'error': str(e)})
+        return
+    if idempotency_key:
+        whisper_api.idempotency_store.put(idempotency_key, audio_fingerprint, result)
+    await send_json(send, 200, result)
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            print("🚀 Whisper API（非同期版）起動中...")
+            whisper_api.setup_whisper()
+            setup_scheduler()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def send_metrics(send) -> None:
+    body = whisper_metrics.render_prometheus().encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", whisper_metrics.CONTENT_TYPE.encode()),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def admin_profile(scope, send) -> None:
+    """Flask版の/admin/profileと同じ（計測中もイベントループは止めない）"""
+    headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+    if not whisper_profiler.authorized(whisper_profiler.token_from_headers(headers)):
+        await send_json(send, 404, {'error': 'Not Found'})
+        return
+    params = dict(urllib.parse.parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+    try:
+        session = await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(whisper_profiler.run, **whisper_profiler.parse_params(params))
+        )
+    except ValueError as e:
+        await send_json(send, 400, {'error': str(e)})
+        return
+    except whisper_profiler.ProfilerBusy as e:
+        await send_json(send, 409, {'error': str(e)})
+        return
+    body, content_type = whisper_profiler.response_body(session, params)
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+ROUTES = {
+    ("/transcribe", "POST"),
+    ("/health", "GET"),
+    ("/stats", "GET"),
+    ("/metrics", "GET"),
+    ("/admin/profile", "POST"),
+}
+
+async def app(scope, receive, send) -> None:
+    """ASGIエントリーポイント"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    endpoint = path if (path, method) in ROUTES else "unmatched"
+    start = time.perf_counter()
+    status = 0  # 応答を返す前にクライアントが切断した場合は0
+    # 推論ジョブは投入時のコンテキストを引き継ぐため、推論スレッドの区間も同じトレースに入る
+    request_id = dict(scope["headers"]).get(whisper_tracing.REQUEST_ID_HEADER.lower().encode(), b"").decode("latin-1")
+    trace = whisper_tracing.start(f"{method} {path}", request_id)
+
+    async def send_and_count(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            message = dict(message, headers=[
+                *message.get("headers", []),
+                (whisper_tracing.REQUEST_ID_HEADER.lower().encode(), trace.request_id.encode("latin-1", "replace")),
+            ])
+        await send(message)
+
+    try:
+        if path == "/transcribe" and method == "POST":
+            await transcribe(scope, receive, send_and_count)
+        elif path == "/health" and method == "GET":
+            await send_json(send_and_count, 200, {'status': 'OK', 'message': 'Whisper API is running'})
+        elif path == "/stats" and method == "GET":
+            await send_json(send_and_count, 200, setup_scheduler().stats())
+        elif path == "/metrics" and method == "GET":
+            await send_metrics(send_and_count)
+        elif path == "/admin/profile" and method == "POST":
+            await admin_profile(scope, send_and_count)
+        else:
+            await send_json(send_and_count, 404, {'error': 'Not Found'})
+    finally:
+        whisper_metrics.increment("http_requests_total", endpoint=endpoint, method=method, status=status)
+        whisper_metrics.histogram("http_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+        trace.set(status=status)
+        trace.finish()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+複数ファイルの一括文字起こし
+音声長の近いもの同士をまとめ（バケット化）、30秒にパディングしたメルをバッチでデコードする
+音声はアップロード順に読み込み、数バケット分たまるごとに短いものからデコードする（全件の読み込みを待たない）
+品質基準を満たさない結果は、transcribeの温度フォールバックと同じく次の温度で（該当分だけまとめて）デコードし直す
+30秒を超える音声は1件ずつ通常のtranscribeで文字起こしする
+"""
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import torch
+import whisper
+from whisper.audio import N_SAMPLES, SAMPLE_RATE
+from whisper.decoding import DecodingOptions, DecodingResult
+
+import whisper_metrics
+from whisper_logging import get_logger
+
+log = get_logger("batch")
+
+# 長さで並べ替える範囲（バケット数）。広いほど長さが揃うが、最初の結果と保持する波形が増える
+BUCKET_WINDOW = 4
+
+@dataclass
+class BatchItem:
+    """一括リクエスト内の1ファイル"""
+    index: int
+    filename: str
+    audio_data: bytes
+    audio: Optional[np.ndarray] = None
+    error: Optional[str] = None
+
+    @property
+    def seconds(self) -> float:
+        return len(self.audio) / SAMPLE_RATE if self.audio is not None else 0.0
+
+def load_item(item: BatchItem) -> None:
+    """音声をデコードして16kHzの波形にする（失敗したらerrorに理由を入れる）"""
+    if not item.audio_data:
+        item.error = '音声データが空です'
+        return
+    suffix = os.path.splitext(item.filename)[1] or '.m4a'
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp_file:
+        tmp_file.write(item.audio_data)
+        tmp_file_path = tmp_file.name
+    try:
+        item.audio = whisper.load_audio(tmp_file_path)
+    except Exception as e:
+        item.error = f'音声の読み込みに失敗しました: {e}'
+    finally:
+        os.unlink(tmp_file_path)
+
+def length_buckets(items: List[BatchItem], batch_size: int) -> List[List[BatchItem]]:
+    """音声長の短い順に並べ、batch_size件ずつのバケットに分ける（短いバケットから結果が返る）"""
+    ordered = sorted(items, key=lambda item: len(item.audio))
+    return [ordered[i:i + batch_size] for i in range(0, len(ordered), batch_size)]
+
+def take_shortest(pool: List[BatchItem], batch_size: int) -> List[BatchItem]:
+    """読み込み済みの中から短い順にbatch_size件を取り出す（poolからは取り除く）"""
+    pool.sort(key=lambda item: len(item.audio))
+    bucket = pool[:batch_size]
+    del pool[:batch_size]
+    return bucket
+
+def temperatures(options: Dict[str, Any]) -> List[float]:
+    """transcribeが順に試す温度（スカラーなら1段だけで、フォールバックしない）"""
+    temperature = options.get("temperature", 0.0)
+    if isinstance(temperature, (list, tuple)):
+        return list(temperature)
+    return [temperature]
+
+def decoding_options(model, options: Dict[str, Any], temperature: Optional[float] = None) -> DecodingOptions:
+    """transcribe用の設定から1回分のデコード設定を作る（温度の省略時は温度フォールバックの1段目と同じ）"""
+    if temperature is None:
+        temperature = temperatures(options)[0]
+    kwargs = dict(
+        task=options.get("task", "transcribe"),
+        language=options.get("language"),
+        temperature=temperature,
+        fp16=options.get("fp16", True) and model.device.type == "cuda",
+    )
+    # transcribeと同様、サンプリング時はbest_of、貪欲/ビーム時はbeam_sizeだけを使う
+    if temperature > 0:
+        kwargs["best_of"] = options.get("best_of")
+    else:
+        kwargs["beam_size"] = options.get("beam_size")
+        kwargs["patience"] = options.get("patience")
+    return DecodingOptions(**kwargs)
+
+def is_silent(result: DecodingResult, options: Dict[str, Any]) -> bool:
+    """transcribeと同じ無音判定（no_speech確率が高く、確信度も低い）"""
+    no_speech_threshold = options.get("no_speech_threshold", 0.6)
+    logprob_threshold = options.get("logprob_threshold", -1.0)
+    return (
+        no_speech_threshold is not None
+        and result.no_speech_prob > no_speech_threshold
+        and (logprob_threshold is None or result.avg_logprob < logprob_threshold)
+    )
+
+def needs_fallback(result: DecodingResult, options: Dict[str, Any]) -> bool:
+    """transcribeなら温度を上げて再試行する結果か"""
+    compression_ratio_threshold = options.get("compression_ratio_threshold", 2.4)
+    logprob_threshold = options.get("logprob_threshold", -1.0)
+    if compression_ratio_threshold is not None and result.compression_ratio > compression_ratio_threshold:
+        return True
+    return logprob_threshold is not None and result.avg_logprob < logprob_threshold
+
+def decode_with_fallback(model, mel: torch.Tensor, options: Dict[str, Any]) -> List[DecodingResult]:
+    """
+    (バッチ × n_mels × フレーム) のメルをデコードし、基準を満たさない音声だけを次の温度でデコードし直す
+    エンコード済みのメルを使い回すため、1件ずつtranscribeし直すより安い
+    """
+    schedule = temperatures(options)
+    results = model.decode(mel, decoding_options(model, options, schedule[0]))
+    for temperature in schedule[1:]:
+        pending = [
+            i for i, result in enumerate(results)
+            if needs_fallback(result, options) and not is_silent(result, options)
+        ]
+        if not pending:
+            break
+        whisper_metrics.increment("batch_fallback_retries_total", len(pending))
+        retried = model.decode(mel[pending], decoding_options(model, options, temperature))
+        for i, result in zip(pending, retried):
+            results[i] = result
+    return results
+
+def decode_bucket(model, bucket: List[BatchItem], options: Dict[str, Any]) -> List[DecodingResult]:
+    """バケット内の音声を30秒にパディングし、1回のバッチでデコード"""
+    mel = torch.stack([
+        whisper.log_mel_spectrogram(whisper.pad_or_trim(item.audio), model.dims.n_mels)
+        for item in bucket
+    ]).to(model.device)
+    return decode_with_fallback(model, mel, options)
+
+def transcribe_batch(
+    model,
+    items: List[BatchItem],
+    options: Dict[str, Any],
+    fallback: Callable[[bytes], str],
+    convert: Callable[[str], str],
+    batch_size: int = 8,
+) -> Iterator[Dict[str, Any]]:
+    """
+    複数ファイルを文字起こしし、1件終わるごとに結果の辞書をyieldする
+    fallback: 1件ずつの通常の文字起こし（音声バイト列 → テキスト）
+    convert: 英語テキスト → カタカナ
+    """
+    def line(item: BatchItem, text: str, batched: bool) -> Dict[str, Any]:
+        return {
+            'index': item.index,
+            'filename': item.filename,
+            'success': True,
+            'whisper_raw': text,
+            'whisper_katakana': convert(text),
+            'batched': batched,
+        }
+
+    def run_fallback(item: BatchItem) -> Dict[str, Any]:
+        whisper_metrics.increment("batch_fallback_items_total")
+        try:
+            return line(item, fallback(item.audio_data), batched=False)
+        except Exception as e:
+            return {'index': item.index, 'filename': item.filename, 'success': False, 'error': str(e)}
+
+    def run_bucket(bucket: List[BatchItem]) -> Iterator[Dict[str, Any]]:
+        whisper_metrics.histogram("batch_size", len(bucket), buckets=whisper_metrics.SIZE_BUCKETS)
+        try:
+            results = decode_bucket(model, bucket, options)
+        except Exception as e:
+            log.warning("⚠️ バッチデコード失敗、1件ずつ再試行します: %s", e)
+            results = [None] * len(bucket)
+
+        for item, result in zip(bucket, results):
+            item.audio = None  # デコード済みの波形は保持しない
+            if result is None:
+                yield run_fallback(item)
+                continue
+            whisper_metrics.increment("batch_decode_items_total")
+            text = "" if is_silent(result, options) else result.text.strip()
+            yield line(item, text, batched=True)
+
+    pool: List[BatchItem] = []
+    batched = individual = 0
+    for item in items:
+        load_item(item)
+        if item.error:
+            yield {'index': item.index, 'filename': item.filename, 'success': False, 'error': item.error}
+            continue
+        if len(item.audio) > N_SAMPLES:
+            # 30秒を超える音声は通常のtranscribeがバイト列から読み直す
+            item.audio = None
+            individual += 1
+            yield run_fallback(item)
+            continue
+        pool.append(item)
+        batched += 1
+        if len(pool) >= batch_size * BUCKET_WINDOW:
+            yield from run_bucket(take_shortest(pool, batch_size))
+
+    for bucket in length_buckets(pool, batch_size):
+        yield from run_bucket(bucket)
+    log.info("📦 一括文字起こし: バッチ %d件 / 個別 %d件", batched, individual)
@@ -0,0 +1,634 @@
+#!/usr/bin/env python3
+"""
+Whisperデコーダーの拡張
+デコードループの中で暴走（同じフレーズの繰り返し・音声長に見合わない出力）を止める
+プロンプト部分のKV計算は同じ音声のビーム/候補間で共有する（リクエストをまたいだキャッシュはしない）
+温度フォールバックの再試行ではエンコーダ出力とプロンプト部分のKVを使い回す
+小さいモデルの下書きを大きいモデルでまとめて検証する投機的デコードにも対応
+"""
+import contextlib
+import contextvars
+import math
+import threading
+import time
+from dataclasses import asdict, dataclass, replace
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+from whisper.audio import FRAMES_PER_SECOND
+from whisper.decoding import (
+    BeamSearchDecoder,
+    DecodingOptions,
+    DecodingResult,
+    DecodingTask,
+    LogitFilter,
+    PyTorchInference,
+)
+from whisper.transcribe import transcribe as whisper_transcribe
+
+import whisper_metrics
+import whisper_tracing
+from token_repetition import find_repeating_cycle
+from whisper_logging import get_logger
+
+log = get_logger("decoding")
+
+try:
+    from whisper.model import disable_sdpa
+except ImportError:  # openai-whisper 20231117はSDPAを使わない
+    disable_sdpa = contextlib.nullcontext
+
+@dataclass(frozen=True)
+class DecodeGuards:
+    """デコードガードの設定"""
+    loop_max_period: int = 12   # 検出する繰り返し単位の最大トークン数
+    loop_min_repeats: int = 4   # ループと判定する連続回数
+    loop_min_span: int = 12     # ループと判定する繰り返し部分の最小トークン数（短い周期ほど多く繰り返す必要がある）
+    tokens_per_second: float = 12.0  # 発話1秒あたりに許すトークン数
+    token_slack: int = 24            # 音声長に関係なく許す余裕分のトークン数
+    draft_tokens: int = 4            # 投機的デコードで1回に下書きするトークン数
+
+# 発話とみなすフレームのエネルギー閾値（無音レベルからピークまでの割合）
+SPEECH_ENERGY_RATIO = 0.3
+
+def measure_speech_seconds(mel: torch.Tensor) -> List[float]:
+    """
+    log-mel（n_mels × フレーム、またはバッチ）から発話区間の長さ（秒）を推定
+    最初と最後の有音フレームの間を発話区間とみなす
+    """
+    if mel.ndim == 2:
+        mel = mel.unsqueeze(0)
+
+    mel = mel.float()
+    energy = mel.mean(dim=-2)  # (batch, frames)
+    # transcribeは30秒に満たないセグメントを正規化後のlog-mel上で0埋めする（pad_or_trim）
+    # 0は無音より大きい値のため、全帯域が0の末尾の列は音声の外として除く
+    content = mel.abs().amax(dim=-2) > 0
+    seconds = []
+    for row, columns in zip(energy, content):
+        nonzero = columns.nonzero()
+        if len(nonzero) == 0:
+            seconds.append(0.0)
+            continue
+        row = row[: int(nonzero[-1]) + 1]
+        floor, peak = row.min(), row.max()
+        if peak - floor < 1e-3:
+            seconds.append(0.0)
+            continue
+        active = (row > floor + (peak - floor) * SPEECH_ENERGY_RATIO).nonzero()
+        span = int(active[-1]) - int(active[0]) + 1
+        seconds.append(span / FRAMES_PER_SECOND)
+    return seconds
+
+def token_budgets(mel: torch.Tensor, n_mels: int, guards: DecodeGuards) -> Optional[List[int]]:
+    """発話長から系列ごとの最大トークン数を決める（エンコーダ出力が渡された場合はNone）"""
+    if mel.shape[-2] != n_mels:
+        return None
+    return [
+        math.ceil(seconds * guards.tokens_per_second) + guards.token_slack
+        for seconds in measure_speech_seconds(mel)
+    ]
+
+def force_eot(logits: torch.Tensor, row: int, eot: int) -> None:
+    """指定した系列の次トークンをEOTに固定"""
+    logits[row, :] = -np.inf
+    logits[row, eot] = 0
+
+class RepetitionLoopFilter(LogitFilter):
+    """
+    繰り返しループに入った系列にEOTを強制するフィルター
+    「アリガトウアリガトウ…」がトークン上限まで続くのをデコード中に止める
+    """
+    def __init__(self, tokenizer, sample_begin: int, max_period: int, min_repeats: int, min_span: int):
+        self.eot = tokenizer.eot
+        self.sample_begin = sample_begin
+        self.max_period = max_period
+        self.min_repeats = min_repeats
+        self.min_span = min_span
+        # タイムスタンプ等の特殊トークンが混ざっても判定できるよう余裕を持たせる
+        self.window = max(max_period * min_repeats, min_span + max_period) * 2
+        self.aborted = False
+
+    def apply(self, logits: torch.Tensor, tokens: torch.Tensor) -> None:
+        sampled = tokens[:, self.sample_begin:]
+        if sampled.shape[1] < self.min_repeats:
+            return
+
+        for row, seq in enumerate(sampled[:, -self.window:].tolist()):
+            if seq[-1] == self.eot:
+                continue
+            # テキストトークンのみで判定（タイムスタンプは毎回値が変わるため除外）
+            text_tokens = [t for t in seq if t < self.eot]
+            if find_repeating_cycle(text_tokens, self.max_period, self.min_repeats, self.min_span):
+                force_eot(logits, row, self.eot)
+                # ビームの系列ごと・ステップごとではなく、1回のデコードにつき1回数える
+                if not self.aborted:
+                    self.aborted = True
+                    whisper_metrics.increment("decode_loop_aborts_total")
+
+class TokenBudgetFilter(LogitFilter):
+    """
+    音声長から決めた上限トークン数に達した系列にEOTを強制するフィルター
+    2秒の音声が200トークン出力するような暴走の最悪ケースを抑える
+    """
+    def __init__(self, tokenizer, sample_begin: int, n_group: int):
+        self.eot = tokenizer.eot
+        self.sample_begin = sample_begin
+        self.n_group = n_group
+        self.budgets: Optional[List[int]] = None
+        self.exhausted = set()
+
+    def apply(self, logits: torch.Tensor, tokens: torch.Tensor) -> None:
+        if self.budgets is None:
+            return
+        n_sampled = tokens.shape[1] - self.sample_begin
+        if n_sampled < min(self.budgets):
+            return
+
+        for row in range(tokens.shape[0]):
+            audio_index = row // self.n_group
+            if n_sampled < self.budgets[audio_index] or tokens[row, -1] == self.eot:
+                continue
+            force_eot(logits, row, self.eot)
+            if audio_index not in self.exhausted:
+                self.exhausted.add(audio_index)
+                whisper_metrics.increment("decode_token_budget_hits_total")
+
+class DecodeCancelled(Exception):
+    """クライアントの切断や期限切れでデコードが中止された"""
+
+_cancel_event: contextvars.ContextVar = contextvars.ContextVar("decode_cancel_event", default=None)
+
+@contextlib.contextmanager
+def cancellation_scope(event: threading.Event):
+    """
+    このスコープ内で始まるデコードを、eventがセットされた時点で中止できるようにする
+    推論スレッドへはcontextvars.copy_context()で引き継ぐ
+    """
+    token = _cancel_event.set(event)
+    try:
+        yield event
+    finally:
+        _cancel_event.reset(token)
+
+def check_cancelled() -> None:
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        whisper_metrics.increment("decode_cancellations_total")
+        raise DecodeCancelled("デコードが中止されました")
+
+class CancellationFilter(LogitFilter):
+    """
+    1トークンごとに中止要求を確認するフィルター（ロジットは変更しない）
+    デコードループ自体には手を入れず、毎ステップ呼ばれるフィルターを確認点にする
+    """
+    def apply(self, logits: torch.Tensor, tokens: torch.Tensor) -> None:
+        check_cancelled()
+
+@dataclass
+class DecodeAttempt:
+    """1回分のデコード（温度フォールバックの再試行を含む）の記録"""
+    temperature: float
+    seconds: float
+    n_tokens: int
+    retry: bool
+    reused_encoder: bool
+    reused_prefix: bool
+
+class SegmentState:
+    """同じセグメントの再試行で使い回す計算結果"""
+    def __init__(self, mel: torch.Tensor):
+        self.mel = mel
+        self.audio_features: Optional[torch.Tensor] = None
+        # 初期トークン列 → (プロンプト部分のKVキャッシュ, そのロジット)
+        self.prefixes: Dict[Tuple[int, ...], Tuple[dict, torch.Tensor]] = {}
+
+class DecodeSession:
+    """1回のtranscribe呼び出し分のデコード記録と再試行用キャッシュ"""
+    def __init__(self):
+        self.attempts: List[DecodeAttempt] = []
+        self.segment: Optional[SegmentState] = None
+
+    def segment_state(self, mel: torch.Tensor) -> Tuple[SegmentState, bool]:
+        """
+        セグメントの状態を返す（2つ目は再試行かどうか）
+        transcribeは再試行時に同じmelテンソルを渡すため、同一性で判定できる
+        """
+        if self.segment is not None and self.segment.mel is mel:
+            return self.segment, True
+        self.segment = SegmentState(mel)
+        return self.segment, False
+
+    @property
+    def retries(self) -> int:
+        return sum(1 for attempt in self.attempts if attempt.retry)
+
+    @property
+    def retry_seconds(self) -> float:
+        return sum(attempt.seconds for attempt in self.attempts if attempt.retry)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "attempts": len(self.attempts),
+            "retries": self.retries,
+            "retry_seconds": self.retry_seconds,
+            "details": [asdict(attempt) for attempt in self.attempts],
+        }
+
+_current_session: contextvars.ContextVar = contextvars.ContextVar("decode_session", default=None)
+
+class PrefixSharingInference(PyTorchInference):
+    """
+    ビーム/候補間でプロンプト部分のKVキャッシュを共有する推論クラス
+    初回のフォワードでは同じ音声の系列（n_group本）が同一なので1本だけ計算して複製する
+    ※デコーダ2層目以降のKVはクロスアテンション経由で音声に依存するため、
+      リクエストをまたいだ再利用はせず、同じ音声の中（ビーム間・再試行間）でのみ共有する
+    """
+    def __init__(
+        self,
+        model,
+        initial_tokens: Tuple[int, ...],
+        n_group: int,
+        segment_state: Optional[SegmentState] = None,
+    ):
+        super().__init__(model, len(initial_tokens))
+        self.initial_tokens = initial_tokens
+        self.n_group = n_group
+        self.segment_state = segment_state
+        self.reused_prefix = False
+
+    def logits(self, tokens: torch.Tensor, audio_features: torch.Tensor) -> torch.Tensor:
+        if self.kv_cache or tokens.shape[0] % self.n_group:
+            return super().logits(tokens, audio_features)
+
+        prefixes = self.segment_state.prefixes if self.segment_state else {}
+        if self.initial_tokens in prefixes:
+            prefix_cache, logits = prefixes[self.initial_tokens]
+            self.reused_prefix = True
+        else:
+            prefix_cache, hooks = self.model.install_kv_cache_hooks()
+            unique_tokens = tokens[:: self.n_group]
+            if audio_features.shape[0] == tokens.shape[0]:
+                audio_features = audio_features[:: self.n_group]
+            logits = self.model.decoder(unique_tokens, audio_features, kv_cache=prefix_cache)
+            for hook in hooks:
+                hook.remove()
+            # 以降のステップはtorch.catで新しいテンソルを作るため、保存した値は書き換わらない
+            prefixes[self.initial_tokens] = (prefix_cache, logits)
+
+        expanded = {
+            module: value.repeat_interleave(self.n_group, dim=0)
+            for module, value in prefix_cache.items()
+        }
+        self.kv_cache, self.hooks = self.model.install_kv_cache_hooks(expanded)
+        return logits.repeat_interleave(self.n_group, dim=0)
+
+class GuardedDecodingTask(DecodingTask):
+    """ガード付きのDecodingTask"""
+    def __init__(
+        self,
+        model,
+        options: DecodingOptions,
+        guards: DecodeGuards,
+        segment_state: Optional[SegmentState] = None,
+    ):
+        super().__init__(model, options)
+        self.guards = guards
+        self.segment_state = segment_state
+        self.reused_encoder = False
+        self.encoder_seconds = 0.0
+
+        if hasattr(model, "create_inference"):
+            # ONNX Runtime等の別バックエンドは自前のInferenceを提供する
+            self.inference = model.create_inference(self.initial_tokens, self.n_group, segment_state)
+        else:
+            self.inference = PrefixSharingInference(
+                model, self.initial_tokens, self.n_group, segment_state
+            )
+        if isinstance(self.decoder, BeamSearchDecoder):
+            self.decoder.inference = self.inference
+
+        self.loop_filter = RepetitionLoopFilter(
+            self.tokenizer,
+            self.sample_begin,
+            guards.loop_max_period,
+            guards.loop_min_repeats,
+            guards.loop_min_span,
+        )
+        self.budget_filter = TokenBudgetFilter(self.tokenizer, self.sample_begin, self.n_group)
+        # 既存のタイムスタンプ規則より後に適用してEOT強制を優先させる
+        self.logit_filters += [self.loop_filter, self.budget_filter]
+        if _cancel_event.get() is not None:
+            self.logit_filters.append(CancellationFilter())
+
+    def _get_audio_features(self, mel: torch.Tensor) -> torch.Tensor:
+        state = self.segment_state
+        if state is not None and state.audio_features is not None:
+            self.reused_encoder = True
+            return self._repeat_for_group(state.audio_features)
+
+        start = time.perf_counter()
+        with whisper_tracing.span("encoder"):
+            audio_features = super()._get_audio_features(mel)
+        self.encoder_seconds = time.perf_counter() - start
+        if state is not None:
+            state.audio_features = audio_features
+        return self._repeat_for_group(audio_features)
+
+    def _repeat_for_group(self, audio_features: torch.Tensor) -> torch.Tensor:
+        """
+        openai-whisper 20231117のrunは音声特徴をn_group倍に複製しないため、
+        複数音声のバッチでbest_of/ビームを使うとクロスアテンションと結果の整形（audio_features[::n_group]）が合わない
+        1音声ならブロードキャストで動くため、複数音声のときだけ系列と同じ並びに複製する
+        """
+        if self.n_group > 1 and audio_features.shape[0] > 1:
+            return audio_features.repeat_interleave(self.n_group, dim=0)
+        return audio_features
+
+    def _detect_language(self, audio_features: torch.Tensor, tokens: torch.Tensor):
+        # 言語判定・言語リストは音声ごと（tokensはまだ複製前）
+        if audio_features.shape[0] != tokens.shape[0]:
+            audio_features = audio_features[:: self.n_group]
+        return super()._detect_language(audio_features, tokens)
+
+    def run(self, mel: torch.Tensor) -> List[DecodingResult]:
+        self.budget_filter.budgets = token_budgets(mel, self.model.dims.n_mels, self.guards)
+        return super().run(mel)
+
+class _OffsetMask:
+    """
+    qkv_attentionは mask[:n_ctx, :n_ctx] で切り出すため、
+    KVキャッシュ付きで複数トークンを流すときは切り出さずに全幅のマスクを返す
+    """
+    def __init__(self, mask: torch.Tensor):
+        self.mask = mask
+
+    def __getitem__(self, _) -> torch.Tensor:
+        return self.mask
+
+def decoder_forward(decoder, tokens: torch.Tensor, audio_features: torch.Tensor, kv_cache: dict, offset: int) -> torch.Tensor:
+    """
+    TextDecoder.forwardの複数トークン版
+    offset位置から続くトークン列をまとめて流し、各位置のロジットを返す
+    """
+    n = tokens.shape[-1]
+    x = decoder.token_embedding(tokens) + decoder.positional_embedding[offset:offset + n]
+    x = x.to(audio_features.dtype)
+
+    mask = torch.full((n, offset + n), -np.inf, device=tokens.device).triu_(offset + 1)
+    with disable_sdpa():
+        for block in decoder.blocks:
+            x = block(x, audio_features, mask=_OffsetMask(mask), kv_cache=kv_cache)
+
+    x = decoder.ln(x)
+    return (x @ torch.transpose(decoder.token_embedding.weight.to(x.dtype), 0, 1)).float()
+
+class IncrementalDecoder:
+    """KVキャッシュを持ち、流したトークンを後から巻き戻せるデコーダ"""
+    def __init__(self, model, audio_features: torch.Tensor):
+        self.model = model
+        self.audio_features = audio_features
+        self.kv_cache, self.hooks = model.install_kv_cache_hooks()
+        self.self_attn_modules = [
+            module
+            for block in model.decoder.blocks
+            for module in (block.attn.key, block.attn.value)
+        ]
+        self.length = 0
+
+    def forward(self, tokens: torch.Tensor) -> torch.Tensor:
+        """キャッシュに無い末尾部分だけを流してロジットを返す"""
+        new_tokens = tokens[:, self.length:]
+        logits = decoder_forward(
+            self.model.decoder, new_tokens, self.audio_features, self.kv_cache, self.length
+        )
+        self.length = tokens.shape[-1]
+        return logits
+
+    def truncate(self, length: int) -> None:
+        """自己注意のKVキャッシュをlengthトークン分まで巻き戻す"""
+        for module in self.self_attn_modules:
+            if module in self.kv_cache:
+                self.kv_cache[module] = self.kv_cache[module][:, :length]
+        self.length = min(self.length, length)
+
+    def close(self) -> None:
+        for hook in self.hooks:
+            hook.remove()
+        self.kv_cache = {}
+        self.hooks = []
+
+def supports_speculation(options: DecodingOptions) -> bool:
+    """投機的デコードで結果が変わらないのは貪欲法（温度0・ビーム探索なし）のみ"""
+    return (
+        options.temperature == 0
+        and options.beam_size is None
+        and (options.best_of or 1) == 1
+    )
+
+_speculation_warned = False
+
+def warn_speculation_unused(options: DecodingOptions) -> None:
+    """下書きモデルを読み込んだのに使えない設定でデコードしたことを知らせる（警告は1プロセス1回）"""
+    global _speculation_warned
+    whisper_metrics.increment("speculative_skipped_total")
+    if _speculation_warned:
+        return
+    _speculation_warned = True
+    log.warning(
+        "⚠️ 投機的デコードは貪欲デコード（temperature=0、beam_size/best_ofなし）のみ対応のため、"
+        "この設定（temperature=%s, beam_size=%s, best_of=%s）では下書きモデルを使いません",
+        options.temperature, options.beam_size, options.best_of,
+    )
+
+class SpeculativeDecodingTask(GuardedDecodingTask):
+    """
+    投機的デコード
+    小さいモデル（tiny）が数トークンを下書きし、本モデル（base）が1回のフォワードで検証する
+    本モデル側のロジットとフィルターで貪欲に選ぶため、出力は本モデル単体の貪欲デコードと一致する
+    （まとめて流すことによる浮動小数点の丸め差を除く）
+    """
+    def __init__(self, model, draft_model, options: DecodingOptions, guards: DecodeGuards, **kwargs):
+        super().__init__(model, options, guards, **kwargs)
+        self.draft_model = draft_model
+        # 下書き側ではガード（計測カウンタを持つ）を除いたフィルターだけを使う
+        self.draft_filters = [
+            f for f in self.logit_filters
+            if not isinstance(f, (RepetitionLoopFilter, TokenBudgetFilter))
+        ]
+        self.mel: Optional[torch.Tensor] = None
+
+    def run(self, mel: torch.Tensor) -> List[DecodingResult]:
+        self.mel = mel
+        return super().run(mel)
+
+    def _propose(self, draft: IncrementalDecoder, tokens: torch.Tensor, n_draft: int) -> torch.Tensor:
+        """下書きモデルで最大n_draftトークンを貪欲に生成"""
+        current = tokens
+        for _ in range(n_draft):
+            logits = draft.forward(current)[:, -1]
+            for logit_filter in self.draft_filters:
+                logit_filter.apply(logits, current)
+            next_token = logits.argmax(dim=-1)
+            current = torch.cat([current, next_token[:, None]], dim=-1)
+            if next_token.item() == self.tokenizer.eot:
+                break
+        return current[:, tokens.shape[-1]:]
+
+    def _main_loop(self, audio_features: torch.Tensor, tokens: torch.Tensor):
+        mel = self.mel
+        if tokens.shape[0] != 1 or mel is None or mel.shape[-2] != self.draft_model.dims.n_mels:
+            return super()._main_loop(audio_features, tokens)
+
+        draft_features = self.draft_model.encoder(mel.half() if self.options.fp16 else mel)
+        base = IncrementalDecoder(self.model, audio_features)
+        draft = IncrementalDecoder(self.draft_model, draft_features)
+        sum_logprobs = torch.zeros(1, device=audio_features.device)
+        no_speech_probs = [np.nan]
+        n_sampled = 0
+        completed = False
+
+        try:
+            while not completed and n_sampled < self.sample_len:
+                length = tokens.shape[-1]
+                n_draft = min(
+                    self.guards.draft_tokens,
+                    self.sample_len - n_sampled - 1,
+                    self.n_ctx - length,
+                )
+                proposal = self._propose(draft, tokens, max(n_draft, 0))
+                is_first = base.length == 0
+                logits = base.forward(torch.cat([tokens, proposal], dim=-1))
+
+                if is_first and self.tokenizer.no_speech is not None:
+                    probs_at_sot = logits[:, self.sot_index].float().softmax(dim=-1)
+                    no_speech_probs = probs_at_sot[:, self.tokenizer.no_speech].tolist()
+
+                # 位置jのロジットは「確定済み + 下書きj個」の次のトークンを予測する
+                verify = logits[:, -(proposal.shape[-1] + 1):]
+                accepted = 0
+                for j in range(proposal.shape[-1] + 1):
+                    step_logits = verify[:, j].clone()
+                    for logit_filter in self.logit_filters:
+                        logit_filter.apply(step_logits, tokens)
+                    tokens, completed = self.decoder.update(tokens, step_logits, sum_logprobs)
+                    n_sampled += 1
+                    if completed or tokens.shape[-1] > self.n_ctx:
+                        completed = True
+                        break
+                    if j < proposal.shape[-1] and tokens[0, -1] == proposal[0, j]:
+                        accepted += 1
+                        continue
+                    break
+
+                whisper_metrics.increment("speculative_draft_tokens_total", proposal.shape[-1])
+                whisper_metrics.increment("speculative_accepted_tokens_total", accepted)
+                base.truncate(length + accepted)
+                draft.truncate(length + accepted)
+        finally:
+            base.close()
+            draft.close()
+
+        return tokens, sum_logprobs, no_speech_probs
+
+@torch.no_grad()
+def guarded_decode(
+    model,
+    mel: torch.Tensor,
+    options: DecodingOptions = DecodingOptions(),
+    guards: DecodeGuards = DecodeGuards(),
+    draft_model=None,
+    **kwargs,
+) -> Union[DecodingResult, List[DecodingResult]]:
+    """
+    whisper.decodeと同じインターフェースのガード付きデコード
+    draft_modelを渡すと、貪欲デコードのときだけ投機的デコードを使う
+    """
+    check_cancelled()
+    session = _current_session.get()
+    segment_state, is_retry = session.segment_state(mel) if session else (None, False)
+
+    if single := mel.ndim == 2:
+        mel = mel.unsqueeze(0)
+
+    if kwargs:
+        options = replace(options, **kwargs)
+
+    if draft_model is not None and supports_speculation(options):
+        task = SpeculativeDecodingTask(
+            model, draft_model, options, guards,
+            segment_state=segment_state,
+        )
+    else:
+        if draft_model is not None:
+            warn_speculation_unused(options)
+        task = GuardedDecodingTask(model, options, guards, segment_state)
+    start = time.perf_counter()
+    with whisper_tracing.span("decode", temperature=options.temperature, retry=is_retry) as span:
+        result = task.run(mel)
+        span["reused_encoder"] = task.reused_encoder
+    elapsed = time.perf_counter() - start
+    # エンコーダ出力を使い回した再試行ではエンコーダは動いていないため記録しない（0秒が分布を歪める）
+    if not task.reused_encoder:
+        whisper_metrics.observe("encoder", task.encoder_seconds)
+    whisper_metrics.observe("decoder", elapsed - task.encoder_seconds)
+
+    if session is not None:
+        session.attempts.append(DecodeAttempt(
+            temperature=options.temperature,
+            seconds=elapsed,
+            n_tokens=sum(len(r.tokens) for r in result),
+            retry=is_retry,
+            reused_encoder=task.reused_encoder,
+            reused_prefix=task.inference.reused_prefix,
+        ))
+    whisper_metrics.increment("decode_attempts_total", temperature=f"{options.temperature:.1f}")
+    if is_retry:
+        whisper_metrics.increment("decode_fallback_retries_total")
+        whisper_metrics.increment("decode_fallback_retry_seconds_total", elapsed)
+        whisper_metrics.increment("encoder_reuse_hits_total" if task.reused_encoder else "encoder_reuse_misses_total")
+
+    return result[0] if single else result
+
+def transcribe_with_report(model, audio, **transcribe_options) -> Dict[str, Any]:
+    """
+    model.transcribeの代わりに使うラッパー
+    温度フォールバックの再試行回数とコストを結果の"decode_report"に載せる
+    """
+    if transcribe_options.get("word_timestamps") and not getattr(model, "supports_word_timestamps", True):
+        log.warning("⚠️ このバックエンドは単語タイムスタンプ非対応のため無効化します")
+        transcribe_options["word_timestamps"] = False
+
+    session = DecodeSession()
+    token = _current_session.set(session)
+    try:
+        # Gradio版など、呼び出し側でトレースを始めていない場合はtranscribe単位でトレースする
+        with whisper_tracing.traced("transcribe"), whisper_metrics.stage("transcribe"):
+            result = whisper_transcribe(model, audio, **transcribe_options)
+    finally:
+        _current_session.reset(token)
+    whisper_metrics.increment("transcriptions_total")
+
+    result["decode_report"] = session.summary()
+    if session.retries:
+        log.info(
+            "🔁 温度フォールバック再試行: %d回 (%.2f秒)", session.retries, session.retry_seconds,
+            extra={"fields": {"event": "fallback", "retries": session.retries}},
+        )
+    return result
+
+def install_decode_guards(model, guards: DecodeGuards = DecodeGuards(), draft_model=None):
+    """
+    model.transcribe内部のデコードをガード付きに差し替える
+    transcribeはmodel.decodeを呼ぶため、インスタンス属性で上書きすれば足りる
+    """
+    model.decode = partial(
+        guarded_decode,
+        model,
+        guards=guards,
+        draft_model=draft_model,
+    )
+    model.transcribe = partial(transcribe_with_report, model)
+    return model
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+推論パイプラインのログ
+リクエストごとのログはキュー経由で別スレッドが書き出す（呼び出し側は標準出力への書き込みを待たない）
+メッセージは %s 形式の引数で渡し、実際に出力するときに初めて組み立てる
+レベルごとに出力する割合を決められる（例: DEBUGは1%だけ残す）
+
+環境変数:
+    WHISPER_LOG_LEVEL   出力する最低レベル（既定: INFO、OFFで無効）
+    WHISPER_LOG_FORMAT  text（既定）または json（1行1件、fieldsの値を含む）
+    WHISPER_LOG_SAMPLE  レベルごとの出力割合（例: DEBUG=0.01,INFO=0.5、既定は全件）
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from typing import Dict, Optional
+
+import whisper_tracing
+
+ROOT_LOGGER = "whisper"
+
+_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[logging.handlers.QueueHandler] = None
+_configured = False
+
+class SamplingFilter(logging.Filter):
+    """レベルごとに一定の割合だけ通す（WARNING以上は指定がなければ全件）"""
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+class RequestIdFilter(logging.Filter):
+    """呼び出し時点のリクエストID（whisper_tracing）をレコードに付ける"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = whisper_tracing.current_request_id()
+        record.request_id = request_id
+        record.request_tag = f"[{request_id}] " if request_id else ""
+        return True
+
+class StdoutHandler(logging.StreamHandler):
+    """書き出す時点のsys.stdoutに出力する（ベンチマーク等で標準出力を差し替えても追従する）"""
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    標準のQueueHandlerは積む前に呼び出し側のスレッドでメッセージを組み立てるため、
+    組み立て（%の展開・例外の整形）も書き出しスレッドに任せる
+    引数は後から書き換えない値（文字列・数値）を渡すこと
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """1行1件のJSON（extra={"fields": {...}} の値を展開して含める）"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def parse_sample_rates(value: str) -> Dict[int, float]:
+    """"DEBUG=0.01,INFO=0.5" → {logging.DEBUG: 0.01, logging.INFO: 0.5}"""
+    rates = {}
+    for part in value.split(","):
+        if "=" not in part:
+            continue
+        level, rate = part.split("=", 1)
+        levelno = logging.getLevelName(level.strip().upper())
+        if isinstance(levelno, int):
+            rates[levelno] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+def setup_logging(
+    level: Optional[str] = None,
+    log_format: Optional[str] = None,
+    sample: Optional[str] = None,
+) -> logging.Logger:
+    """
+    whisper配下のロガーをキュー + 書き出しスレッド構成にする（2回目以降は何もしない）
+    引数を省略した項目は環境変数から読む
+    """
+    global _listener, _handler, _configured
+    root = logging.getLogger(ROOT_LOGGER)
+    with _lock:
+        if _configured:
+            return root
+        _configured = True
+        level = (level or os.environ.get("WHISPER_LOG_LEVEL") or "INFO").upper()
+        log_format = log_format or os.environ.get("WHISPER_LOG_FORMAT") or "text"
+        sample = sample if sample is not None else os.environ.get("WHISPER_LOG_SAMPLE", "")
+
+        root.propagate = False
+        if level == "OFF":
+            # ロガーの段階で捨てるため、ログ呼び出しはレベル判定だけで戻る
+            root.setLevel(logging.CRITICAL + 1)
+            return root
+        root.setLevel(level)
+
+        output = StdoutHandler()
+        output.setFormatter(
+            JsonFormatter() if log_format == "json"
+            else logging.Formatter("%(asctime)s %(levelname)-7s %(request_tag)s%(message)s", "%H:%M:%S")
+        )
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        handler = DeferredQueueHandler(log_queue)
+        rates = parse_sample_rates(sample)
+        if rates:
+            handler.addFilter(SamplingFilter(rates))
+        # リクエストIDはcontextvarのため、積む前（呼び出し側のスレッド）で読む
+        handler.addFilter(RequestIdFilter())
+        root.addHandler(handler)
+        _handler = handler
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        # 終了時に残りを書き出す
+        atexit.register(_stop_listener)
+    return root
+
+def _stop_listener() -> None:
+    if _listener is not None:
+        _listener.stop()
+
+def _restart_after_fork() -> None:
+    """
+    fork後の子プロセスには書き出しスレッドが引き継がれない（whisper_prefork.pyのワーカー等）
+    親のキューに残った分は親が書き出すため、子ではキューごと作り直して書き出しスレッドを起動する
+    """
+    global _listener
+    if _listener is None:
+        return
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    _handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+def get_logger(name: str) -> logging.Logger:
+    """whisper配下のロガー（初回に出力先を用意する）"""
+    setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
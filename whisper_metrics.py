@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+推論パイプラインの計測値
+デコードの早期終了回数などをプロセス内のカウンタで集計
+各段階（エンコーダ・デコーダ等）の所要時間はヒストグラムに集計し、記録を有効にしたときは生の値も保持する（ベンチマーク用）
+render_prometheus()でPrometheusのテキスト形式に書き出す（/metrics用）
+"""
+import bisect
+import contextlib
+import functools
+import http.server
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import whisper_tracing
+from whisper_logging import get_logger
+
+log = get_logger("metrics")
+
+# 出力時に全ての名前へ付ける接頭辞
+NAMESPACE = "whisper"
+
+# 所要時間（秒）のヒストグラムの区切り
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 件数（バッチサイズ等）のヒストグラムの区切り
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_samples: Dict[str, List[float]] = defaultdict(list)
+_recording = False
+
+class Histogram:
+    """区切りごとの件数・合計・件数（Prometheusのhistogramと同じ累積前の値を持つ）"""
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+# 名前 → {ラベル → ヒストグラム}
+_histograms: Dict[str, Dict[str, Histogram]] = defaultdict(dict)
+# 出力のたびに値を取り直すゲージ（名前 → ラベル → 値 を返す関数）
+_gauges: Dict[str, Callable[[], Dict[str, float]]] = {}
+_server: Optional[http.server.ThreadingHTTPServer] = None
+
+def _labels(labels: Dict[str, object]) -> str:
+    """ラベルをPrometheusの表記にする（名前順、空なら空文字）"""
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return "{" + pairs + "}"
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def increment(name: str, value: float = 1, **labels) -> None:
+    """カウンタを加算（ラベル付きの場合は name{key="value"} の系列として集計）"""
+    with _lock:
+        _counters[name + _labels(labels)] += value
+
+def get_counters() -> Dict[str, float]:
+    """現在のカウンタ値のコピーを返す"""
+    with _lock:
+        return dict(_counters)
+
+def record_samples(enabled: bool = True) -> None:
+    """段階ごとの所要時間の記録を有効/無効にする"""
+    global _recording
+    _recording = enabled
+
+def histogram(name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels) -> None:
+    """値をヒストグラムに集計（区切りは系列の初回に決まる）"""
+    key = _labels(labels)
+    with _lock:
+        series = _histograms[name].get(key)
+        if series is None:
+            series = _histograms[name][key] = Histogram(buckets)
+        series.add(value)
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """段階の所要時間をstage_secondsヒストグラムに集計（記録が有効なら生の値も保持）"""
+    histogram("stage_seconds", seconds, stage=name, **labels)
+    if not _recording:
+        return
+    with _lock:
+        _samples[name].append(seconds)
+
+@contextlib.contextmanager
+def stage(name: str):
+    """with内の所要時間をnameの段階として記録（トレース中なら区間としても記録）"""
+    start = time.perf_counter()
+    try:
+        with whisper_tracing.span(name):
+            yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def timed(name: str):
+    """関数の所要時間をnameの段階として記録するデコレータ（関数名をfunctionラベルに付ける）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with whisper_tracing.span(name, function=func.__name__):
+                    return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start, function=func.__name__)
+        return wrapper
+    return decorator
+
+def get_samples() -> Dict[str, List[float]]:
+    """記録済みの所要時間のコピーを返す"""
+    with _lock:
+        return {name: list(values) for name, values in _samples.items()}
+
+def reset() -> None:
+    """全カウンタと記録をクリア（ベンチマーク・テスト用）"""
+    with _lock:
+        _counters.clear()
+        _samples.clear()
+        _histograms.clear()
+
+def register_gauge(name: str, read: Callable[[], object]) -> None:
+    """
+    出力のたびにread()で値を取るゲージを登録（同じ名前は上書き）
+    read()は数値、または ラベルの辞書 → 値 の組を返す（例: {(("lane", "batch"),): 3}）
+    """
+    _gauges[name] = read
+
+def _gauge_series(value) -> Dict[str, float]:
+    if isinstance(value, dict):
+        return {_labels(dict(labels)): float(v) for labels, v in value.items()}
+    return {"": float(value)}
+
+def process_rss_bytes() -> float:
+    """現在の常駐メモリ（Linuxは/proc、それ以外は最大常駐メモリで代用）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        import sys
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+def _number(value: float) -> str:
+    """整数値は整数として、それ以外は丸めずに出力"""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _split_series(series: str) -> Tuple[str, str]:
+    """name{labels} → (name, labelsの中身)"""
+    name, _, labels = series.partition("{")
+    return name, labels.rstrip("}")
+
+def _with_label(labels: str, extra: str) -> str:
+    return "{" + ",".join(part for part in (labels, extra) if part) + "}"
+
+def render_prometheus() -> str:
+    """全ての計測値をPrometheusのテキスト形式（0.0.4）にする"""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {
+            name: {labels: (h.buckets, list(h.counts), h.sum, h.count) for labels, h in series.items()}
+            for name, series in _histograms.items()
+        }
+    lines = []
+
+    families: Dict[str, List[Tuple[str, float]]] = defaultdict(list)
+    for series, value in counters.items():
+        name, labels = _split_series(series)
+        families[name].append((labels, value))
+    for name in sorted(families):
+        metric = f"{NAMESPACE}_{name}"
+        lines.append(f"# TYPE {metric} counter")
+        for labels, value in sorted(families[name]):
+            lines.append(f"{metric}{_with_label(labels, '') if labels else ''} {_number(value)}")
+
+    for name in sorted(histograms):
+        metric = f"{NAMESPACE}_{name}"
+        lines.append(f"# TYPE {metric} histogram")
+        for key, (buckets, counts, total, count) in sorted(histograms[name].items()):
+            labels = key.strip("{}")
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{metric}_bucket{_with_label(labels, le)} {cumulative}")
+            lines.append(f"{metric}_sum{key} {_number(total)}")
+            lines.append(f"{metric}_count{key} {count}")
+
+    gauges = dict(_gauges, process_resident_memory_bytes=process_rss_bytes)
+    for name in sorted(gauges):
+        try:
+            series = _gauge_series(gauges[name]())
+        except Exception:
+            continue  # 取得に失敗したゲージは出力しない（/metrics全体は返す）
+        metric = f"{NAMESPACE}_{name}"
+        lines.append(f"# TYPE {metric} gauge")
+        for labels, value in sorted(series.items()):
+            lines.append(f"{metric}{labels} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass  # スクレイプのたびにアクセスログを出さない
+
+def start_server(port: int, host: str = "0.0.0.0") -> http.server.ThreadingHTTPServer:
+    """
+    /metricsだけを返すHTTPサーバーを別スレッドで起動（Gradio版など、/metricsを足せないアプリ用）
+    同じプロセスで2回目以降は起動済みのサーバーを返す
+    """
+    global _server
+    with _lock:
+        if _server is None:
+            _server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+            log.info("📊 メトリクス: http://%s:%d/metrics", host, port)
+    return _server
+
+def start_server_from_env() -> Optional[http.server.ThreadingHTTPServer]:
+    """環境変数WHISPER_METRICS_PORTが設定されていればメトリクスサーバーを起動"""
+    port = os.environ.get("WHISPER_METRICS_PORT")
+    if not port:
+        return None
+    return start_server(int(port))
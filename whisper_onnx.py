@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtimeによる推論バックエンド
+Whisperのエンコーダ・デコーダ（KVキャッシュ入出力付き）をONNXに書き出し、CPUのONNX Runtimeで実行する
+OnnxWhisperはwhisperのモデルと同じtranscribe/decodeインターフェースを持つ
+
+使い方（書き出しのみ）:
+    python whisper_onnx.py tiny [--out ~/.cache/whisper-onnx/tiny] [--int8]
+"""
+import argparse
+import json
+import os
+from dataclasses import asdict
+from functools import partial
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import whisper
+from whisper.decoding import Inference, detect_language as detect_language_function
+from whisper.model import ModelDimensions
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "whisper-onnx")
+OPSET_VERSION = 17
+
+def _attention(q, k, v, n_head: int, mask: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """MultiHeadAttention.qkv_attentionと同じ計算（マスクは全幅で受け取る）"""
+    n_batch, n_ctx, n_state = q.shape
+    scale = (n_state // n_head) ** -0.25
+    q = q.reshape(n_batch, n_ctx, n_head, -1).permute(0, 2, 1, 3) * scale
+    k = k.reshape(k.shape[0], k.shape[1], n_head, -1).permute(0, 2, 3, 1) * scale
+    v = v.reshape(v.shape[0], v.shape[1], n_head, -1).permute(0, 2, 1, 3)
+    qk = q @ k
+    if mask is not None:
+        qk = qk + mask
+    w = F.softmax(qk.float(), dim=-1).to(q.dtype)
+    return (w @ v).permute(0, 2, 1, 3).flatten(start_dim=2)
+
+class _CrossKV(nn.Module):
+    """エンコーダ出力からクロスアテンションのK/Vを一括で計算（デコード中は1回だけ）"""
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, audio_features):
+        return torch.stack([
+            module(audio_features)
+            for block in self.decoder.blocks
+            for module in (block.cross_attn.key, block.cross_attn.value)
+        ])
+
+class _DecoderWithCache(nn.Module):
+    """
+    KVキャッシュを入出力に持つデコーダ
+    self_kv: (n_layer*2, batch, past, n_state) / cross_kv: (n_layer*2, batch, n_audio_ctx, n_state)
+    """
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, tokens, self_kv, cross_kv):
+        decoder = self.decoder
+        offset = self_kv.shape[2]
+        n = tokens.shape[1]
+        x = decoder.token_embedding(tokens) + decoder.positional_embedding[offset:offset + n]
+
+        # 因果マスク（過去分offsetを含めた全幅）。動的な長さでも書き出せるよう比較で作る
+        query_positions = torch.arange(n).unsqueeze(1) + offset
+        key_positions = torch.arange(offset + n).unsqueeze(0)
+        future = key_positions > query_positions
+        mask = torch.zeros(future.shape, dtype=x.dtype).masked_fill(future, float("-inf"))
+
+        present = []
+        for i, block in enumerate(decoder.blocks):
+            attn = block.attn
+            h = block.attn_ln(x)
+            k = torch.cat([self_kv[2 * i], attn.key(h)], dim=1)
+            v = torch.cat([self_kv[2 * i + 1], attn.value(h)], dim=1)
+            present += [k, v]
+            x = x + attn.out(_attention(attn.query(h), k, v, attn.n_head, mask))
+
+            cross = block.cross_attn
+            h = block.cross_attn_ln(x)
+            x = x + cross.out(_attention(cross.query(h), cross_kv[2 * i], cross_kv[2 * i + 1], cross.n_head))
+
+            x = x + block.mlp(block.mlp_ln(x))
+
+        x = decoder.ln(x)
+        logits = x @ torch.transpose(decoder.token_embedding.weight, 0, 1)
+        return logits.float(), torch.stack(present)
+
+def export_onnx(name: str, out_dir: str, int8: bool = False) -> str:
+    """PyTorchのWhisperモデルをencoder/cross_kv/decoderの3つのONNXに書き出す"""
+    os.makedirs(out_dir, exist_ok=True)
+    model = whisper.load_model(name, device="cpu").float().eval()
+    dims = model.dims
+    n_layer = dims.n_text_layer
+
+    mel = torch.zeros(1, dims.n_mels, dims.n_audio_ctx * 2)
+    audio_features = torch.zeros(1, dims.n_audio_ctx, dims.n_audio_state)
+    tokens = torch.zeros(1, 3, dtype=torch.long)
+    self_kv = torch.zeros(n_layer * 2, 1, 1, dims.n_text_state)
+    cross_kv = torch.zeros(n_layer * 2, 1, dims.n_audio_ctx, dims.n_text_state)
+
+    print(f"📦 {name}モデルをONNXに書き出し中: {out_dir}")
+    with torch.no_grad():
+        torch.onnx.export(
+            model.encoder, (mel,), os.path.join(out_dir, "encoder.onnx"),
+            input_names=["mel"], output_names=["audio_features"],
+            dynamic_axes={"mel": {0: "batch"}, "audio_features": {0: "batch"}},
+            opset_version=OPSET_VERSION,
+        )
+        torch.onnx.export(
+            _CrossKV(model.decoder), (audio_features,), os.path.join(out_dir, "cross_kv.onnx"),
+            input_names=["audio_features"], output_names=["cross_kv"],
+            dynamic_axes={"audio_features": {0: "batch"}, "cross_kv": {1: "batch"}},
+            opset_version=OPSET_VERSION,
+        )
+        torch.onnx.export(
+            _DecoderWithCache(model.decoder), (tokens, self_kv, cross_kv),
+            os.path.join(out_dir, "decoder.onnx"),
+            input_names=["tokens", "self_kv", "cross_kv"],
+            output_names=["logits", "present_kv"],
+            dynamic_axes={
+                "tokens": {0: "batch", 1: "n_tokens"},
+                "self_kv": {1: "batch", 2: "past"},
+                "cross_kv": {1: "audio_batch"},
+                "logits": {0: "batch", 1: "n_tokens"},
+                "present_kv": {1: "batch", 2: "total"},
+            },
+            opset_version=OPSET_VERSION,
+        )
+
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        for part in ("encoder", "cross_kv", "decoder"):
+            path = os.path.join(out_dir, f"{part}.onnx")
+            quantize_dynamic(path, os.path.join(out_dir, f"{part}.int8.onnx"), weight_type=QuantType.QInt8)
+
+    with open(os.path.join(out_dir, "dims.json"), "w") as f:
+        json.dump(asdict(dims), f)
+    print("✅ ONNX書き出し完了")
+    return out_dir
+
+class _OrtEncoder:
+    """model.encoder(mel)と同じ呼び出し方でONNXエンコーダを実行"""
+    def __init__(self, session):
+        self.session = session
+
+    def __call__(self, mel: torch.Tensor) -> torch.Tensor:
+        (audio_features,) = self.session.run(None, {"mel": mel.float().numpy()})
+        return torch.from_numpy(audio_features)
+
+class _OrtTextDecoder:
+    """
+    デコーダのONNXセッション
+    DecodingTaskは最初にPyTorchInferenceを作るため、空のblocksを持たせてそれを無害にしておく
+    """
+    blocks: Tuple = ()
+
+    def __init__(self, decoder_session, cross_kv_session, dims: ModelDimensions):
+        self.decoder_session = decoder_session
+        self.cross_kv_session = cross_kv_session
+        self.dims = dims
+
+    def cross_kv(self, audio_features: torch.Tensor) -> np.ndarray:
+        (cross_kv,) = self.cross_kv_session.run(None, {"audio_features": audio_features.float().numpy()})
+        return cross_kv
+
+    def empty_kv(self, batch: int) -> np.ndarray:
+        return np.zeros((self.dims.n_text_layer * 2, batch, 0, self.dims.n_text_state), dtype=np.float32)
+
+    def run(self, tokens: torch.Tensor, self_kv: np.ndarray, cross_kv: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        logits, present_kv = self.decoder_session.run(None, {
+            "tokens": tokens.numpy().astype(np.int64),
+            "self_kv": self_kv,
+            "cross_kv": cross_kv,
+        })
+        return logits, present_kv
+
+class OrtInference(Inference):
+    """
+    ONNX Runtime版のInference
+    PrefixSharingInferenceと同様に、プロンプト部分は音声ごとに1本だけ計算して候補間・再試行間で共有する
+    """
+    def __init__(self, model, initial_tokens: Tuple[int, ...], n_group: int, segment_state=None):
+        self.decoder: _OrtTextDecoder = model.decoder
+        self.initial_tokens = initial_tokens
+        self.n_group = n_group
+        self.segment_state = segment_state
+        self.self_kv: Optional[np.ndarray] = None
+        self.cross_kv: Optional[np.ndarray] = None
+        self.reused_prefix = False
+
+    def logits(self, tokens: torch.Tensor, audio_features: torch.Tensor) -> torch.Tensor:
+        if self.self_kv is not None:
+            new_tokens = tokens[:, self.self_kv.shape[2]:]
+            logits, self.self_kv = self.decoder.run(new_tokens, self.self_kv, self.cross_kv)
+            return torch.from_numpy(logits)
+
+        prefixes = self.segment_state.prefixes if self.segment_state else {}
+        if self.initial_tokens in prefixes:
+            (self_kv, cross_kv), logits = prefixes[self.initial_tokens]
+            self.reused_prefix = True
+        else:
+            unique_tokens = tokens[:: self.n_group]
+            if audio_features.shape[0] == tokens.shape[0]:
+                audio_features = audio_features[:: self.n_group]
+            cross_kv = self.decoder.cross_kv(audio_features)
+            logits, self_kv = self.decoder.run(unique_tokens, self.decoder.empty_kv(unique_tokens.shape[0]), cross_kv)
+            prefixes[self.initial_tokens] = ((self_kv, cross_kv), logits)
+
+        self.self_kv = np.repeat(self_kv, self.n_group, axis=1)
+        # 音声が1本ならクロスK/Vはbatch=1のままブロードキャストさせ、候補数分の複製を避ける
+        self.cross_kv = cross_kv if cross_kv.shape[1] == 1 else np.repeat(cross_kv, self.n_group, axis=1)
+        return torch.from_numpy(np.repeat(logits, self.n_group, axis=0))
+
+    def rearrange_kv_cache(self, source_indices) -> None:
+        if source_indices != list(range(len(source_indices))):
+            self.self_kv = self.self_kv[:, source_indices]
+            if self.cross_kv.shape[1] != 1:
+                self.cross_kv = self.cross_kv[:, source_indices]
+
+    def cleanup_caching(self) -> None:
+        self.self_kv = None
+        self.cross_kv = None
+
+class OnnxWhisper:
+    """whisper.model.Whisperの代わりに使えるONNX Runtime版モデル"""
+    supports_word_timestamps = False
+
+    def __init__(self, model_dir: str, int8: bool = False, num_threads: Optional[int] = None):
+        import onnxruntime as ort
+
+        with open(os.path.join(model_dir, "dims.json")) as f:
+            self.dims = ModelDimensions(**json.load(f))
+
+        session_options = ort.SessionOptions()
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+        suffix = ".int8.onnx" if int8 else ".onnx"
+        self.model_paths = [os.path.join(model_dir, part + suffix) for part in ("encoder", "decoder", "cross_kv")]
+
+        def session(part: str):
+            return ort.InferenceSession(
+                os.path.join(model_dir, part + suffix),
+                sess_options=session_options,
+                providers=["CPUExecutionProvider"],
+            )
+
+        self.device = torch.device("cpu")
+        self.encoder = _OrtEncoder(session("encoder"))
+        self.decoder = _OrtTextDecoder(session("decoder"), session("cross_kv"), self.dims)
+        self.detect_language = partial(detect_language_function, self)
+
+    @property
+    def is_multilingual(self) -> bool:
+        return self.dims.n_vocab >= 51865
+
+    @property
+    def num_languages(self) -> int:
+        return self.dims.n_vocab - 51765 - int(self.is_multilingual)
+
+    def weight_bytes(self) -> int:
+        """読み込んだONNXファイルの大きさ（ほぼ重みの初期値。/metricsのmodel_memory_bytes用）"""
+        return sum(os.path.getsize(path) for path in self.model_paths)
+
+    def create_inference(self, initial_tokens, n_group: int, segment_state=None) -> OrtInference:
+        """GuardedDecodingTaskから呼ばれ、PyTorchInferenceの代わりに使われる"""
+        return OrtInference(self, initial_tokens, n_group, segment_state)
+
+    def logits(self, tokens: torch.Tensor, audio_features: torch.Tensor) -> torch.Tensor:
+        """キャッシュなしのフォワード（言語判定用）"""
+        cross_kv = self.decoder.cross_kv(audio_features)
+        logits, _ = self.decoder.run(tokens, self.decoder.empty_kv(tokens.shape[0]), cross_kv)
+        return torch.from_numpy(logits)
+
+def load_onnx_model(name: str = "tiny", int8: bool = False, cache_dir: str = DEFAULT_CACHE_DIR) -> OnnxWhisper:
+    """書き出し済みのONNXモデルを読み込む（なければ書き出してから読み込む）"""
+    model_dir = os.path.join(cache_dir, name)
+    expected = os.path.join(model_dir, "decoder.int8.onnx" if int8 else "decoder.onnx")
+    if not os.path.exists(expected):
+        export_onnx(name, model_dir, int8=int8)
+
+    threads = os.environ.get("WHISPER_ORT_THREADS")
+    return OnnxWhisper(model_dir, int8=int8, num_threads=int(threads) if threads else None)
+
+def main():
+    parser = argparse.ArgumentParser(description="WhisperモデルをONNXに書き出す")
+    parser.add_argument("model", nargs="?", default="tiny", help="Whisperモデル名（tiny/base）")
+    parser.add_argument("--out", help="出力ディレクトリ")
+    parser.add_argument("--int8", action="store_true", help="int8動的量子化版も作成する")
+    args = parser.parse_args()
+    export_onnx(args.model, args.out or os.path.join(DEFAULT_CACHE_DIR, args.model), int8=args.int8)
+
+if __name__ == "__main__":
+    main()
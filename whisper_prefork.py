@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+whisper_api の本番用プリフォークサーバー
+親プロセスでWhisperモデルを読み込み、N個のワーカーをforkして重みをコピーオンライトで共有する
+CPUコアはワーカー間で分割し、各ワーカーのtorchスレッド数をそれに合わせる
+
+使い方:
+    python whisper_prefork.py --workers 4 --port 5001
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+import torch
+from werkzeug.serving import make_server
+
+import whisper_api
+import whisper_profiler
+
+# 起動後この秒数以内に終了したワーカーは起動失敗とみなし、再起動を指数的に遅らせる
+MIN_UPTIME_SECONDS = 10.0
+RESPAWN_BACKOFF_SECONDS = 1.0
+RESPAWN_BACKOFF_MAX_SECONDS = 30.0
+# 起動失敗がこの回数続いたら再起動をやめてサーバーを止める
+MAX_FAST_FAILURES = 5
+
+def respawn_delay(fast_failures: int) -> float:
+    """連続した起動失敗の回数から再起動までの待ち時間（秒）を決める"""
+    if fast_failures <= 0:
+        return 0.0
+    return min(RESPAWN_BACKOFF_MAX_SECONDS, RESPAWN_BACKOFF_SECONDS * 2 ** (fast_failures - 1))
+
+def threads_per_worker(workers: int, cores: int = 0) -> int:
+    """1ワーカーあたりのintra-opスレッド数（コア数をワーカー数で等分）"""
+    cores = cores or os.cpu_count() or 1
+    return max(1, cores // workers)
+
+def _bind(host: str, port: int, backlog: int = 128) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def _run_worker(sock: socket.socket, host: str, port: int, threads: int) -> None:
+    """子プロセス: 共有ソケットでリクエストを受け付ける（1ワーカー1リクエストずつ）"""
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # 既に設定済みの場合は変更できない
+    # 計測を待つ間このワーカーは他のリクエストを受けられず、リクエストは他のワーカーに流れて結果が空になる
+    whisper_profiler.disable_endpoint(
+        "プリフォークのワーカーは1リクエストずつ処理するため/admin/profileは使えません。"
+        "計測するワーカーに kill -USR2 <pid> を送ってください（結果はWHISPER_PROFILE_DIRに保存）"
+    )
+
+    server = make_server(host, port, whisper_api.app, threaded=False, fd=sock.fileno())
+    print(f"👷 ワーカー起動: pid={os.getpid()} threads={threads}", flush=True)
+    server.serve_forever()
+
+def _spawn(sock: socket.socket, host: str, port: int, threads: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _run_worker(sock, host, port, threads)
+        finally:
+            os._exit(0)
+    return pid
+
+def serve(host: str = "0.0.0.0", port: int = 5001, workers: int = 0) -> None:
+    """
+    親プロセス: モデルを読み込んでワーカーをforkし、落ちたワーカーは再起動する
+    起動直後に落ちるワーカーは間隔を空けて再起動し、続くようならサーバーを止める
+    """
+    workers = workers or os.cpu_count() or 1
+    threads = threads_per_worker(workers)
+
+    # fork前にOpenMPのスレッドプールを作らないよう、親は1スレッドでモデルを読み込む
+    torch.set_num_threads(1)
+    sock = _bind(host, port)
+    print(f"🚀 プリフォークサーバー起動中: {host}:{port} workers={workers} threads/worker={threads}")
+    whisper_api.setup_whisper()
+
+    # 読み込み済みオブジェクトをGC対象から外し、GCによるページの書き換え（COW解除）を防ぐ
+    gc.collect()
+    gc.freeze()
+
+    children: Dict[int, float] = {}
+    for _ in range(workers):
+        children[_spawn(sock, host, port, threads)] = time.time()
+
+    stopping = False
+    fast_failures = 0
+    failed = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        spawned_at = children.pop(pid, None)
+        if stopping or spawned_at is None:
+            continue
+
+        uptime = time.time() - spawned_at
+        fast_failures = fast_failures + 1 if uptime < MIN_UPTIME_SECONDS else 0
+        if fast_failures >= MAX_FAST_FAILURES:
+            print(f"❌ ワーカーが起動直後に{fast_failures}回続けて終了したため停止します（status={status}）", flush=True)
+            stop()
+            failed = True
+            continue
+
+        delay = respawn_delay(fast_failures)
+        print(f"⚠️ ワーカー終了 pid={pid} status={status} uptime={uptime:.1f}s、{delay:.0f}秒後に再起動します", flush=True)
+        # 待っている間に停止シグナルを受けたら再起動しない
+        resume_at = time.time() + delay
+        while not stopping and time.time() < resume_at:
+            time.sleep(max(0.0, min(0.5, resume_at - time.time())))
+        if not stopping:
+            children[_spawn(sock, host, port, threads)] = time.time()
+
+    sock.close()
+    if failed:
+        sys.exit(1)
+    print("✅ プリフォークサーバー停止")
+
+def main():
+    parser = argparse.ArgumentParser(description="whisper_apiのプリフォークサーバー")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--workers", type=int, default=0, help="ワーカー数（既定: CPUコア数）")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
+
+if __name__ == "__main__":
+    main()
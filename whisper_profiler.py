@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+稼働中のプロセスのプロファイリング（再起動なしで有効にする）
+次のN件のリクエスト、またはT秒の間だけ計測し、結果を返す
+
+モード:
+    stack    全スレッドのスタックを一定間隔で採取し、collapsed stack形式（flamegraph.pl / speedscope用）にする
+             計測中も推論はほぼ遅くならない。C実装の処理（torchの演算・str.replace等）は呼び出し元の関数に計上される
+    cprofile 計測中のリクエスト処理をcProfileで計測し、pstatsの結果を返す（同時に計測するのは1件ずつ、計測分は遅くなる）
+
+呼び出し方:
+    whisper_api.py / whisper_asgi.py  POST /admin/profile（環境変数WHISPER_ADMIN_TOKENのトークンが必要）
+    Gradio版など                      kill -USR2 <pid>（WHISPER_PROFILE_SECONDS秒計測し、WHISPER_PROFILE_DIRに保存）
+"""
+import cProfile
+import contextlib
+import hmac
+import io
+import marshal
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+import whisper_logging
+
+MODES = ("stack", "cprofile")
+MAX_SECONDS = 600.0
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+log = whisper_logging.get_logger("profiler")
+
+# 待機中のスレッド（キュー待ち・accept等）のスタックは集計から除く
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("handlers.py", "dequeue"),  # ログの書き出しスレッド（whisper_logging）
+    ("selectors.py", "select"),
+    ("socketserver.py", "serve_forever"),
+    ("base_events.py", "_run_once"),
+}
+
+class ProfilerBusy(Exception):
+    """既に計測中"""
+    pass
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    """別スレッドから全スレッドのスタックを一定間隔で採取する"""
+    def __init__(self, interval: float = 0.005, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                if not self.include_idle and leaf in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """1行1スタック「スレッド;外側の関数;...;内側の関数 回数」"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+class ProfileSession:
+    """1回分の計測（requests件のリクエストが終わるか、seconds秒経つまで）"""
+    def __init__(self, mode: str, seconds: float, requests: Optional[int], interval: float):
+        if mode not in MODES:
+            raise ValueError(f"未対応のモード: {mode}（対応: {', '.join(MODES)}）")
+        self.mode = mode
+        self.seconds = min(max(seconds, 0.1), MAX_SECONDS)
+        self.requests = requests
+        self.completed = 0
+        self.started_at = time.monotonic()
+        self.done = threading.Event()
+        self.sampler = StackSampler(interval) if mode == "stack" else None
+        self.profile = cProfile.Profile() if mode == "cprofile" else None
+        self._profile_lock = threading.Lock()  # cProfileは1件ずつ
+
+    def request_finished(self) -> None:
+        self.completed += 1
+        if self.requests is not None and self.completed >= self.requests:
+            self.done.set()
+
+    def wait(self) -> None:
+        self.done.wait(self.seconds)
+
+    def result(self) -> bytes:
+        """stackはcollapsed stackのテキスト、cprofileはpstatsのバイナリ（pstats.Stats(ファイル名)で読める）"""
+        if self.sampler is not None:
+            return self.sampler.collapsed().encode("utf-8")
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
+
+    def summary(self, limit: int = 40) -> str:
+        """cprofileの結果を累積時間順のテキストにする"""
+        output = io.StringIO()
+        pstats.Stats(self.profile, stream=output).sort_stats("cumulative").print_stats(limit)
+        return output.getvalue()
+
+_lock = threading.Lock()
+_session: Optional[ProfileSession] = None
+_endpoint_unavailable: Optional[str] = None
+
+def disable_endpoint(reason: str) -> None:
+    """
+    このプロセスでは管理用エンドポイントからの計測を受け付けない（reasonはエラー応答に載せる）
+    1リクエストずつ処理するサーバーでは、計測を待つ間ほかのリクエストを処理できず、結果も空になるため
+    """
+    global _endpoint_unavailable
+    _endpoint_unavailable = reason
+
+def endpoint_unavailable() -> Optional[str]:
+    return _endpoint_unavailable
+
+def run(mode: str = "stack", seconds: float = 30.0, requests: Optional[int] = None, interval: float = 0.005) -> ProfileSession:
+    """
+    計測して終わったセッションを返す（終わるまでブロックする）
+    requestsを指定すると、その件数のリクエストが終わった時点で止める（seconds秒が上限）
+    """
+    global _session
+    session = ProfileSession(mode, seconds, requests, interval)
+    with _lock:
+        if _session is not None:
+            raise ProfilerBusy("既にプロファイリング中です")
+        _session = session
+    log.info("🔬 プロファイリング開始: %s（最大%g秒, %s件）", mode, session.seconds, requests or "-")
+    if session.sampler is not None:
+        session.sampler.start()
+    try:
+        session.wait()
+    finally:
+        if session.sampler is not None:
+            session.sampler.stop()
+        with _lock:
+            _session = None
+        # 計測中のリクエストがcProfileを止めるまで待つ
+        with session._profile_lock:
+            pass
+    log.info("🔬 プロファイリング終了: %.1f秒, %d件", time.monotonic() - session.started_at, session.completed)
+    return session
+
+@contextlib.contextmanager
+def profile_request():
+    """
+    リクエスト処理をこの中で行う（計測中でなければ何もしない）
+    cprofileモードでは、他のリクエストを計測中でなければこのスレッドでcProfileを有効にする
+    """
+    session = _session
+    if session is None:
+        yield
+        return
+    profiling = session.profile is not None and session._profile_lock.acquire(blocking=False)
+    if profiling:
+        session.profile.enable()
+    try:
+        yield
+    finally:
+        if profiling:
+            session.profile.disable()
+            session._profile_lock.release()
+        session.request_finished()
+
+def authorized(token: Optional[str]) -> bool:
+    """環境変数WHISPER_ADMIN_TOKENと一致するか（未設定なら常に拒否）"""
+    expected = os.environ.get("WHISPER_ADMIN_TOKEN")
+    if not expected or not token:
+        return False
+    return hmac.compare_digest(token.encode(), expected.encode())
+
+def token_from_headers(headers: Dict[str, str]) -> Optional[str]:
+    """X-Admin-Token または Authorization: Bearer からトークンを取り出す（キーは小文字）"""
+    token = headers.get(ADMIN_TOKEN_HEADER.lower())
+    if token:
+        return token
+    authorization = headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return None
+
+def parse_params(params: Dict[str, str]) -> Dict:
+    """クエリ文字列からrun()の引数を作る（不正な値はValueError）"""
+    requests = params.get("requests")
+    return {
+        "mode": params.get("mode", "stack"),
+        "seconds": float(params.get("seconds", "30")),
+        "requests": int(requests) if requests else None,
+        "interval": float(params.get("interval_ms", "5")) / 1000,
+    }
+
+def response_body(session: ProfileSession, params: Dict[str, str]) -> tuple:
+    """(本文, Content-Type)。cprofileは format=text で累積時間順のテキスト、既定はpstatsのバイナリ"""
+    if session.mode == "cprofile" and params.get("format") == "text":
+        return session.summary().encode("utf-8"), "text/plain; charset=utf-8"
+    if session.mode == "cprofile":
+        return session.result(), "application/octet-stream"
+    return session.result(), "text/plain; charset=utf-8"
+
+def _dump_in_background(mode: str) -> None:
+    seconds = float(os.environ.get("WHISPER_PROFILE_SECONDS", "30"))
+    directory = os.environ.get("WHISPER_PROFILE_DIR", "profiles")
+    try:
+        session = run(mode, seconds)
+    except ProfilerBusy:
+        log.warning("🔬 既にプロファイリング中のため無視します")
+        return
+    os.makedirs(directory, exist_ok=True)
+    extension = "prof" if mode == "cprofile" else "collapsed"
+    path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.{extension}")
+    with open(path, "wb") as f:
+        f.write(session.result())
+    log.info("🔬 プロファイル保存: %s", path)
+
+def install_signal_handler(signum: int = getattr(signal, "SIGUSR2", 0)) -> bool:
+    """
+    シグナル（既定SIGUSR2）を受けたら計測を始め、終わったらファイルに保存する
+    モードは環境変数WHISPER_PROFILE_MODE（既定stack）。メインスレッド以外・非対応OSでは何もしない
+    """
+    if not signum or threading.current_thread() is not threading.main_thread():
+        return False
+    mode = os.environ.get("WHISPER_PROFILE_MODE", "stack")
+
+    def handle(*_):
+        threading.Thread(target=_dump_in_background, args=(mode,), name="profile-dump", daemon=True).start()
+
+    signal.signal(signum, handle)
+    return True
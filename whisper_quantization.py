@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+WhisperのCPU向けint8動的量子化
+エンコーダ・デコーダのLinear層をint8に置き換え、fp32との差分を手元の音声で確認する
+
+使い方:
+    python whisper_quantization.py <音声ファイル or ディレクトリ> ... [--model tiny] [--json report.json]
+"""
+import argparse
+import io
+import json
+import sys
+import time
+from typing import Dict, List
+
+import torch
+import torch.nn as nn
+import whisper
+from whisper.model import Linear as WhisperLinear
+
+from audio_files import collect_audio_files
+
+def _replace_whisper_linear(module: nn.Module) -> None:
+    """
+    whisper.model.Linearを素のnn.Linearに置き換える
+    quantize_dynamicは型の完全一致で対象を選ぶため、サブクラスのままでは量子化されない
+    """
+    for name, child in module.named_children():
+        if isinstance(child, WhisperLinear):
+            linear = nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+            linear.load_state_dict(child.state_dict())
+            setattr(module, name, linear)
+        else:
+            _replace_whisper_linear(child)
+
+def quantize_dynamic_int8(model):
+    """エンコーダ・デコーダのLinear層をint8動的量子化に置き換える（CPU専用）"""
+    model = model.cpu().float()
+    _replace_whisper_linear(model)
+    torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+def load_quantized_model(name: str = "tiny"):
+    """int8量子化済みのWhisperモデルを読み込む"""
+    return quantize_dynamic_int8(whisper.load_model(name, device="cpu"))
+
+def model_size_mb(model) -> float:
+    """state_dictをシリアライズした大きさ（MB）"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024 / 1024
+
+def edit_distance(reference: List[str], hypothesis: List[str]) -> int:
+    """レーベンシュタイン距離（単語列・文字列共通）"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref in enumerate(reference, 1):
+        current = [i]
+        for j, hyp in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref != hyp),
+            ))
+        previous = current
+    return previous[-1]
+
+def error_rate(reference: List[str], hypothesis: List[str]) -> float:
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    return edit_distance(reference, hypothesis) / len(reference)
+
+def time_encoder(model, mel: torch.Tensor, repeats: int = 3) -> float:
+    """エンコーダ1回あたりの平均時間（秒）"""
+    with torch.no_grad():
+        model.encoder(mel)  # ウォームアップ
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model.encoder(mel)
+    return (time.perf_counter() - start) / repeats
+
+def parity_check(files: List[str], model_name: str = "tiny") -> Dict:
+    """
+    fp32とint8で同じ音声を文字起こしし、WERとカタカナの文字差分を比較
+    比較を決定的にするため温度0（貪欲法）で実行する
+    """
+    from whisper_api import convert_to_katakana_simple
+
+    fp32_model = whisper.load_model(model_name, device="cpu")
+    fp32_size = model_size_mb(fp32_model)
+    int8_model = load_quantized_model(model_name)
+    int8_size = model_size_mb(int8_model)
+
+    options = dict(language="en", temperature=0.0, fp16=False, condition_on_previous_text=False)
+    rows = []
+    for path in files:
+        fp32_text = fp32_model.transcribe(path, **options)["text"].strip()
+        int8_text = int8_model.transcribe(path, **options)["text"].strip()
+        fp32_kana = convert_to_katakana_simple(fp32_text)
+        int8_kana = convert_to_katakana_simple(int8_text)
+        rows.append({
+            "file": path,
+            "fp32_text": fp32_text,
+            "int8_text": int8_text,
+            "wer": error_rate(fp32_text.lower().split(), int8_text.lower().split()),
+            "katakana_cer": error_rate(list(fp32_kana), list(int8_kana)),
+        })
+
+    report = {
+        "model": model_name,
+        "files": rows,
+        "mean_wer": sum(r["wer"] for r in rows) / len(rows) if rows else 0.0,
+        "mean_katakana_cer": sum(r["katakana_cer"] for r in rows) / len(rows) if rows else 0.0,
+        "fp32_size_mb": fp32_size,
+        "int8_size_mb": int8_size,
+    }
+
+    if files:
+        audio = whisper.pad_or_trim(whisper.load_audio(files[0]))
+        mel = whisper.log_mel_spectrogram(audio, fp32_model.dims.n_mels).unsqueeze(0)
+        report["fp32_encoder_seconds"] = time_encoder(fp32_model, mel)
+        report["int8_encoder_seconds"] = time_encoder(int8_model, mel)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="int8量子化モデルとfp32モデルの差分チェック")
+    parser.add_argument("paths", nargs="+", help="音声ファイルまたはディレクトリ")
+    parser.add_argument("--model", default="tiny", help="Whisperモデル名（tiny/base）")
+    parser.add_argument("--json", help="レポートをJSONで保存するパス")
+    args = parser.parse_args()
+
+    files = collect_audio_files(args.paths)
+    if not files:
+        print("❌ 音声ファイルが見つかりません")
+        sys.exit(1)
+
+    print(f"🔍 int8パリティチェック: {len(files)}ファイル（{args.model}）")
+    report = parity_check(files, args.model)
+
+    for row in report["files"]:
+        print(f"   {row['file']}: WER {row['wer']:.3f} / カタカナ差分 {row['katakana_cer']:.3f}")
+        if row["fp32_text"] != row["int8_text"]:
+            print(f"      fp32: '{row['fp32_text']}'")
+            print(f"      int8: '{row['int8_text']}'")
+    print(f"📊 平均WER: {report['mean_wer']:.3f} / 平均カタカナ差分: {report['mean_katakana_cer']:.3f}")
+    print(f"💾 モデルサイズ: fp32 {report['fp32_size_mb']:.1f}MB → int8 {report['int8_size_mb']:.1f}MB")
+    if "fp32_encoder_seconds" in report:
+        print(f"⏱️ エンコーダ: fp32 {report['fp32_encoder_seconds']:.3f}秒 → int8 {report['int8_encoder_seconds']:.3f}秒")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ レポート保存: {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Whisperモデルの共通ローダー
+各app_*.pyのsetup_whisperから呼び出し、推論の拡張をまとめて組み込む
+"""
+import importlib
+import os
+from typing import Dict, Optional
+
+import torch
+import whisper
+
+import whisper_metrics
+import whisper_profiler
+from whisper_decoding import DecodeGuards, install_decode_guards
+from whisper_logging import get_logger
+from whisper_quantization import load_quantized_model
+
+log = get_logger("runtime")
+
+QUANTIZE_MODES = ("int8",)
+BACKENDS = ("torch", "onnx")
+
+# 読み込んだモデル名 → 重みのバイト数（/metricsのmodel_memory_bytes）
+_model_bytes: Dict[str, int] = {}
+_audio_instrumented = False
+
+def instrument_audio_stages() -> None:
+    """
+    whisper内部の音声デコード（ffmpeg）とメル計算を、それぞれaudio_decode / melの段階として計測する
+    transcribeはパスを受け取るとメル計算の中で音声を読み込むため、先に読み込んでから渡し、両者を分けて計る
+    """
+    global _audio_instrumented
+    if _audio_instrumented:
+        return
+    import whisper.audio
+    transcribe_module = importlib.import_module("whisper.transcribe")
+    load_audio = whisper.audio.load_audio
+    log_mel_spectrogram = transcribe_module.log_mel_spectrogram
+
+    def timed_load_audio(*args, **kwargs):
+        with whisper_metrics.stage("audio_decode"):
+            return load_audio(*args, **kwargs)
+
+    def timed_log_mel_spectrogram(audio, *args, **kwargs):
+        if isinstance(audio, str):
+            audio = timed_load_audio(audio)
+        with whisper_metrics.stage("mel"):
+            return log_mel_spectrogram(audio, *args, **kwargs)
+
+    whisper.audio.load_audio = whisper.load_audio = timed_load_audio
+    transcribe_module.log_mel_spectrogram = timed_log_mel_spectrogram
+    _audio_instrumented = True
+
+def _tensor_bytes(value) -> int:
+    """state_dictの値のバイト数（int8動的量子化のLinearは (重み, バイアス) のタプルで入っている）"""
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(item) for item in value)
+    return 0
+
+def model_bytes(model) -> int:
+    """
+    重みのバイト数
+    int8動的量子化のLinearの重みはparameters()に出てこないため、state_dictの値から数える
+    ONNX Runtime等の別バックエンドは weight_bytes() の値を使う
+    """
+    if hasattr(model, "weight_bytes"):
+        return model.weight_bytes()
+    if not hasattr(model, "state_dict"):
+        return 0
+    return sum(_tensor_bytes(value) for value in model.state_dict().values())
+
+def _record_model(name: str, model) -> None:
+    _model_bytes[name] = model_bytes(model)
+    whisper_metrics.register_gauge(
+        "model_memory_bytes",
+        lambda: {(("model", model_name),): size for model_name, size in _model_bytes.items()},
+    )
+
+def _load_weights(name: str, quantize: Optional[str], device=None, backend: str = "torch"):
+    if quantize and quantize not in QUANTIZE_MODES:
+        raise ValueError(f"未対応の量子化モード: {quantize}（対応: {', '.join(QUANTIZE_MODES)}）")
+    if backend == "onnx":
+        from whisper_onnx import load_onnx_model
+        log.info("🔧 %sモデルをONNX Runtimeで使用（CPU）", name)
+        return load_onnx_model(name, int8=quantize == "int8")
+    if backend != "torch":
+        raise ValueError(f"未対応のバックエンド: {backend}（対応: {', '.join(BACKENDS)}）")
+
+    if quantize == "int8":
+        log.info("🔧 %sモデルをint8動的量子化で使用（CPU）", name)
+        return load_quantized_model(name)
+    return whisper.load_model(name, device=device)
+
+def load_whisper_model(
+    name: str = "tiny",
+    guards: DecodeGuards = DecodeGuards(),
+    draft_model_name: Optional[str] = None,
+    quantize: Optional[str] = None,
+    backend: Optional[str] = None,
+):
+    """
+    Whisperモデルを読み込み、デコードガードを組み込んで返す
+    guardsでループ検出や音声長あたりのトークン上限（余裕分を含む）を調整できる
+
+    draft_model_name（または環境変数WHISPER_DRAFT_MODEL）を指定すると、
+    そのモデルで下書きする投機的デコードを有効にする（例: base本体 + tiny下書き）
+    使われるのは貪欲デコード（temperature=0、beam_size/best_ofなし）のときだけ
+
+    quantize（または環境変数WHISPER_QUANTIZE）に"int8"を指定すると、
+    Linear層をint8動的量子化したCPU推論用モデルを使う
+
+    backend（または環境変数WHISPER_BACKEND）に"onnx"を指定すると、
+    ONNX Runtimeで推論する（transcribeの呼び出し方はそのまま）
+    """
+    quantize = quantize or os.environ.get("WHISPER_QUANTIZE") or None
+    backend = backend or os.environ.get("WHISPER_BACKEND") or "torch"
+    model = _load_weights(name, quantize, backend=backend)
+
+    draft_model_name = draft_model_name or os.environ.get("WHISPER_DRAFT_MODEL")
+    draft_model = None
+    if draft_model_name and backend != "torch":
+        log.warning("⚠️ 投機的デコードはPyTorchバックエンドのみ対応のため無効化します")
+    elif draft_model_name and draft_model_name != name:
+        log.info("Whisper %sモデルを下書き用にロード中...", draft_model_name)
+        log.info("ℹ️ 下書きモデルは貪欲デコード（temperature=0、beam_size/best_ofなし）のときだけ使われます")
+        draft_model = _load_weights(draft_model_name, quantize, device=model.device)
+
+    install_decode_guards(model, guards, draft_model)
+
+    # 段階別の計測と/metrics（Gradio版はWHISPER_METRICS_PORTで別ポートに公開）
+    instrument_audio_stages()
+    _record_model(name, model)
+    if draft_model is not None:
+        _record_model(f"{draft_model_name}-draft", draft_model)
+    whisper_metrics.start_server_from_env()
+    # kill -USR2 <pid> で稼働中にプロファイリングできるようにする（起動時のメインスレッドで読み込んだ場合のみ）
+    whisper_profiler.install_signal_handler()
+    return model
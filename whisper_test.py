@@ -2,7 +2,7 @@
 """
 超シンプル版: Whisperの誤認識を3行で実現
 """
-import whisper
+from whisper_runtime import load_whisper_model
 import sys
 import os
 
@@ -11,7 +11,7 @@ def setup_whisper():
     print("Whisper tinyモデルをロード中...")
     try:
         # 1. 小さいモデルを読み込み（誤認識しやすい）
-        model = whisper.load_model("tiny")
+        model = load_whisper_model("tiny")
         print("✅ Whisperモデル読み込み完了")
         return model
     except Exception as e:
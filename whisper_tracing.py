@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+リクエスト単位のトレース
+リクエストIDとトレースはcontextvarで持ち回るため、推論スレッド（contextごと渡すジョブ）の中の区間も同じリクエストに記録される
+記録対象のリクエストは、段階ごとの区間（audio_decode / mel / encoder / decode / katakana / mecab ...）を
+Chrome trace形式のJSONとして1リクエスト1ファイルに書き出す（chrome://tracing や https://ui.perfetto.dev で開ける）
+書き出しは別スレッドで行う。記録しないリクエストでは区間の計測を行わない
+
+環境変数:
+    WHISPER_TRACE_SAMPLE        記録するリクエストの割合（0〜1、既定: 0）
+    WHISPER_TRACE_SLOW_SECONDS  これ以上かかったリクエストは割合に関係なく記録（指定時は全リクエストの区間を計測）
+    WHISPER_TRACE_DIR           書き出し先（既定: traces）
+"""
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+REQUEST_ID_HEADER = "X-Request-ID"
+MAX_REQUEST_ID_LENGTH = 128
+
+class Trace:
+    """1リクエスト分の区間の記録"""
+    def __init__(self, name: str, request_id: str, recording: bool, sampled: bool):
+        self.name = name
+        self.request_id = request_id
+        self.recording = recording  # 区間を計測するか
+        self.sampled = sampled      # 終了時に必ず書き出すか（でなければ遅いときだけ）
+        self.events: List[Dict[str, Any]] = []
+        self.attributes: Dict[str, Any] = {}
+        self.start_ns = time.perf_counter_ns()
+        self._tokens: List[contextvars.Token] = []
+
+    def add(self, name: str, start_ns: int, end_ns: int, attributes: Dict[str, Any]) -> None:
+        # 複数スレッドから追加されるが、list.appendは1回の操作で完結する
+        self.events.append({
+            "name": name,
+            "ph": "X",
+            "ts": start_ns / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": attributes,
+        })
+
+    def set(self, **attributes) -> None:
+        """リクエスト全体の区間に付ける属性（ステータスコード等）"""
+        self.attributes.update(attributes)
+
+    def finish(self) -> None:
+        """トレースを閉じ、対象なら書き出しを依頼する"""
+        end_ns = time.perf_counter_ns()
+        for token in reversed(self._tokens):
+            token.var.reset(token)
+        self._tokens.clear()
+        if not self.recording:
+            return
+        slow = _settings.slow_seconds is not None and (end_ns - self.start_ns) / 1e9 >= _settings.slow_seconds
+        if self.sampled or slow:
+            self.add(self.name, self.start_ns, end_ns, {"request_id": self.request_id, **self.attributes})
+            _exporter.submit(self)
+
+class _Settings:
+    def __init__(self):
+        self.sample = min(max(float(os.environ.get("WHISPER_TRACE_SAMPLE", "0") or 0), 0.0), 1.0)
+        slow = os.environ.get("WHISPER_TRACE_SLOW_SECONDS")
+        self.slow_seconds = float(slow) if slow else None
+        self.directory = os.environ.get("WHISPER_TRACE_DIR", "traces")
+
+class _Exporter:
+    """終わったトレースを別スレッドでファイルに書き出す"""
+    def __init__(self):
+        self._queue: "queue.SimpleQueue[Trace]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, trace: Trace) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+        self._queue.put(trace)
+
+    def _run(self) -> None:
+        while True:
+            trace = self._queue.get()
+            try:
+                write_trace(trace, _settings.directory)
+            except OSError:
+                pass  # 書き出せなくてもリクエストには影響させない
+
+_settings = _Settings()
+_exporter = _Exporter()
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("whisper_trace", default=None)
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("whisper_request_id", default=None)
+
+def configure(sample: Optional[float] = None, slow_seconds: Optional[float] = None, directory: Optional[str] = None) -> None:
+    """環境変数の設定を上書き（テスト・ベンチマーク用）"""
+    if sample is not None:
+        _settings.sample = sample
+    if slow_seconds is not None:
+        _settings.slow_seconds = slow_seconds
+    if directory is not None:
+        _settings.directory = directory
+
+def valid_request_id(value: Optional[str]) -> Optional[str]:
+    """クライアントが付けたリクエストIDを使う（空・長すぎる・制御文字を含むものは捨てる）"""
+    if not value:
+        return None
+    value = value.strip()
+    if not 0 < len(value) <= MAX_REQUEST_ID_LENGTH or not value.isprintable():
+        return None
+    return value
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+def start(name: str, request_id: Optional[str] = None) -> Trace:
+    """
+    リクエストのトレースを始める（finish()まで、このコンテキストの区間を記録する）
+    request_idを省略すると新しく作る
+    """
+    request_id = valid_request_id(request_id) or uuid.uuid4().hex[:16]
+    sampled = _settings.sample > 0 and random.random() < _settings.sample
+    trace = Trace(name, request_id, sampled or _settings.slow_seconds is not None, sampled)
+    trace._tokens = [_trace.set(trace), _request_id.set(request_id)]
+    return trace
+
+@contextlib.contextmanager
+def traced(name: str, request_id: Optional[str] = None):
+    """with内を1リクエストとしてトレースする（既にトレース中ならその中の区間にする）"""
+    if _trace.get() is not None:
+        with span(name):
+            yield _trace.get()
+        return
+    trace = start(name, request_id)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """
+    with内を1つの区間として記録（トレース中でなければ何もしない）
+    asで受け取った辞書に入れた値は、区間の属性として一緒に記録される
+    """
+    trace = _trace.get()
+    if trace is None or not trace.recording:
+        yield attributes
+        return
+    start_ns = time.perf_counter_ns()
+    try:
+        yield attributes
+    finally:
+        trace.add(name, start_ns, time.perf_counter_ns(), attributes)
+
+def write_trace(trace: Trace, directory: str) -> str:
+    """トレースをChrome trace形式（JSON Object Format）で書き出す"""
+    os.makedirs(directory, exist_ok=True)
+    threads = {event["tid"] for event in trace.events}
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    metadata = [
+        {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": names.get(tid, str(tid))}}
+        for tid in threads
+    ]
+    # リクエストIDはクライアントが付けた値の場合があるため、ファイル名には英数字だけを使う
+    safe_id = re.sub(r"[^0-9A-Za-z_-]", "_", trace.request_id)[:64]
+    path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_id}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "traceEvents": metadata + sorted(trace.events, key=lambda event: event["ts"]),
+            "displayTimeUnit": "ms",
+            "otherData": {"request_id": trace.request_id, "name": trace.name},
+        }, f, ensure_ascii=False, default=str)
+    return path